@@ -1,8 +1,9 @@
 import numpy as np
+import pandas as pd
 
 aa2num = {
         '-': 0,
-        'A': 1,    
+        'A': 1,
         'C': 2,
         'D': 3,
         'E': 4,
@@ -24,27 +25,323 @@ aa2num = {
         'Y': 20
 }
 
+Q = len(aa2num)
 
-def calc_Hamiltonian(seq_list, coupling_tbl, lf_tbl):
-    H = np.zeros(len(seq_list))
-    
-    for seq_idx, seq in enumerate(seq_list):
-        nums = np.array([aa2num[aa] for aa in seq])
-        
-        # Add all local fields at once using numpy operations
-        H[seq_idx] += np.sum([lf_tbl.iloc[num, pos] for pos, num in enumerate(nums)])
-        
-        # Compute all coupling pairs at once
-        positions = np.arange(len(nums))
-        i_indices = [21 * pos + nums[pos] for pos in positions]
-        
-        # Create all pairs of positions efficiently
-        pairs = [(i, j) for i in range(len(nums)) for j in range(i + 1, len(nums))]
-        j_indices = [21 * pair[1] + nums[pair[1]] for pair in pairs]
-        i_indices_pairs = [21 * pair[0] + nums[pair[0]] for pair in pairs]
-        
-        # Sum all coupling terms at once
-        H[seq_idx] += np.sum([coupling_tbl.iloc[i, j] for i, j in zip(i_indices_pairs, j_indices)])
-    
-    return -H
+# Byte -> state lookup used to encode whole batches at once. Unknown characters map to -1.
+_aa_lookup = np.full(256, -1, dtype=np.int16)
+for _aa, _num in aa2num.items():
+    _aa_lookup[ord(_aa)] = _num
 
+# Upper bound on the memory used by the gathered coupling terms (and their indices) of one chunk.
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+_BYTES_PER_PAIR_TERM = 32
+
+
+def encode_sequences(seq_list, length=None):
+    """
+    Encode equal length sequences into one integer matrix of Potts states.
+
+    Parameters
+    ----------
+    seq_list : iterable of str
+        Sequences using the alphabet in ``aa2num``.
+    length : int, optional
+        Expected length of every sequence. Defaults to the length of the first sequence.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``(n_sequences, length)`` int64 matrix of states.
+    """
+    seq_list = list(seq_list)
+    if length is None:
+        length = len(seq_list[0]) if seq_list else 0
+    for seq in seq_list:
+        if len(seq) != length:
+            raise ValueError(f"All sequences must have length {length}, got {len(seq)}.")
+    joined = "".join(seq_list)
+    # Characters outside ASCII become a single "?", which is not a residue, so they are reported with the other unknown residues
+    raw = np.frombuffer(joined.encode("ascii", errors="replace"), dtype=np.uint8)
+    nums = _aa_lookup[raw]
+    if np.any(nums < 0):
+        bad = sorted(set(joined) - set(aa2num))
+        raise KeyError(f"Unknown residues {bad}")
+    return nums.astype(np.int64).reshape(len(seq_list), length)
+
+
+def pack_couplings(couplings):
+    """
+    Pack a ``(21L, 21L)`` coupling table into its upper-triangular ``(L(L-1)/2, 21, 21)`` blocks.
+
+    Block ``p`` holds the couplings of the ``p``-th pair of ``numpy.triu_indices(L, k=1)``, so
+    ``packed[p, a, b] == couplings[21*i + a, 21*j + b]``.
+    """
+    if isinstance(couplings, pd.DataFrame):
+        couplings = couplings.to_numpy()
+    length = couplings.shape[0] // Q
+    pair_i, pair_j = np.triu_indices(length, k=1)
+    return np.ascontiguousarray(couplings.reshape(length, Q, length, Q)[pair_i, :, pair_j, :])
+
+
+def potts_tables_from_dca(couplings, local_fields, length, dtype=None):
+    """
+    Convert the couplings and local fields of a DCA fit into the ProSSpeC table layout.
+
+    Parameters
+    ----------
+    couplings : numpy.ndarray
+        Either ``(Lq, Lq)`` or ``(L(q-1), L(q-1))`` position-major coupling matrix, or ``(L, L, q, q)``
+        / ``(L, L, q-1, q-1)`` blocks. With ``q - 1`` states the missing last state is the gauge state
+        and gets zero couplings.
+    local_fields : numpy.ndarray
+        ``(L, q)``, ``(L, q-1)``, ``(q, L)`` or ``(q-1, L)`` local fields, zero-filled the same way.
+    length : int
+        Number of positions ``L``.
+
+    dtype : numpy.dtype, optional
+        Data type of the returned tables. Defaults to the type of `couplings`.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Packed ``(L(L-1)/2, 21, 21)`` couplings (see `pack_couplings`) and ``(21, L)`` local fields.
+    """
+    couplings = np.asarray(couplings)
+    local_fields = np.asarray(local_fields)
+
+    if couplings.ndim == 2 and couplings.shape[0] == couplings.shape[1] and couplings.shape[0] % length == 0:
+        states = couplings.shape[0] // length
+        blocks = couplings.reshape(length, states, length, states).transpose(0, 2, 1, 3)
+    elif couplings.ndim == 4 and couplings.shape[:2] == (length, length):
+        states = couplings.shape[2]
+        blocks = couplings
+    else:
+        raise ValueError(f"Unsupported coupling shape {couplings.shape} for {length} positions")
+    if states not in (Q, Q - 1):
+        raise ValueError(f"Couplings have {states} states per position, expected {Q} or {Q - 1}")
+
+    if local_fields.shape in ((length, Q), (length, Q - 1)):
+        fields = local_fields.T
+    elif local_fields.shape in ((Q, length), (Q - 1, length)):
+        fields = local_fields
+    else:
+        raise ValueError(f"Unsupported local field shape {local_fields.shape} for {length} positions")
+
+    dtype = couplings.dtype if dtype is None else dtype
+    pair_i, pair_j = np.triu_indices(length, k=1)
+    packed = np.zeros((len(pair_i), Q, Q), dtype=dtype)
+    packed[:, :states, :states] = blocks[pair_i, pair_j]
+    lf_tbl = np.zeros((Q, length), dtype=dtype)
+    lf_tbl[:fields.shape[0]] = fields
+    return packed, lf_tbl
+
+
+class PottsModel:
+    """
+    Potts model parameters in the ProSSpeC table layout, held as contiguous arrays.
+
+    Parameters
+    ----------
+    couplings : numpy.ndarray or pandas.DataFrame
+        Either the ``(21L, 21L)`` coupling table where entry ``[21*i + a, 21*j + b]`` is the coupling
+        of state ``a`` at position ``i`` with state ``b`` at position ``j`` (only ``i < j`` is read),
+        or the packed ``(L(L-1)/2, 21, 21)`` blocks from `pack_couplings` (or the blocks of `pairs`).
+        Memory-mapped arrays are read in place.
+    local_fields : numpy.ndarray or pandas.DataFrame
+        ``(21, L)`` table where entry ``[a, i]`` is the field of state ``a`` at position ``i``.
+    column_map : numpy.ndarray, optional
+        For parameters fitted on a column-trimmed alignment, the parameter position of each column of the
+        full-length sequences, or -1 for trimmed columns. Sequences are then scored at full length and
+        trimmed columns contribute nothing.
+    pairs : numpy.ndarray, optional
+        For packed couplings of only some of the pairs, the ascending ``numpy.triu_indices(L, k=1)``
+        index of the pair of each block. Pairs that are not listed have zero couplings.
+    """
+    def __init__(self, couplings, local_fields, column_map=None, pairs=None):
+        if isinstance(couplings, pd.DataFrame):
+            couplings = couplings.to_numpy()
+        if isinstance(local_fields, pd.DataFrame):
+            local_fields = local_fields.to_numpy()
+        self.couplings = np.ascontiguousarray(couplings)
+        self.local_fields = np.ascontiguousarray(local_fields)
+        self.column_map = None if column_map is None else np.asarray(column_map, dtype=np.int64)
+        self.pairs = None if pairs is None else np.asarray(pairs, dtype=np.int64)
+        if self.pairs is not None and (not self.packed or len(self.pairs) != len(self.couplings)):
+            raise ValueError("Pairs must list the pair of each block of packed couplings")
+
+    @property
+    def length(self):
+        return self.local_fields.shape[1]
+
+    @property
+    def sequence_length(self):
+        """
+        Length of the sequences scored, which differs from `length` when the parameters have a `column_map`.
+        """
+        return self.length if self.column_map is None else len(self.column_map)
+
+    def model_positions(self, positions):
+        """
+        Parameter positions of sequence positions, -1 for trimmed columns.
+        """
+        return positions if self.column_map is None else self.column_map[positions]
+
+    def trim(self, codes):
+        """
+        Drop the trimmed columns of encoded full-length sequences.
+        """
+        return codes if self.column_map is None else codes[..., self.column_map >= 0]
+
+    @property
+    def packed(self):
+        return self.couplings.ndim == 3
+
+    @property
+    def nbytes(self):
+        pairs_nbytes = 0 if self.pairs is None else self.pairs.nbytes
+        return self.couplings.nbytes + self.local_fields.nbytes + pairs_nbytes
+
+    def coupled_pairs(self, length=None):
+        """
+        Positions ``i < j`` below `length` of the pairs with couplings, and the index of their block in
+        the packed couplings (None for the couplings of every pair).
+        """
+        length = self.length if length is None else length
+        if self.pairs is None:
+            pair_i, pair_j = np.triu_indices(length, k=1)
+            return pair_i, pair_j, None
+        pair_i, pair_j = np.triu_indices(self.length, k=1)
+        pair_i, pair_j = pair_i[self.pairs], pair_j[self.pairs]
+        blocks = np.flatnonzero(pair_j < length)
+        return pair_i[blocks], pair_j[blocks], blocks
+
+    def _pair_blocks(self, pos_i, pos_j):
+        # Block of each pair in the packed couplings, and whether it has one
+        L = self.length
+        pair_idx = pos_i * (2 * L - pos_i - 1) // 2 + (pos_j - pos_i - 1)
+        if self.pairs is None:
+            return pair_idx, True
+        blocks = np.minimum(np.searchsorted(self.pairs, pair_idx), max(len(self.pairs) - 1, 0))
+        return blocks, self.pairs[blocks] == pair_idx if len(self.pairs) else np.zeros(pair_idx.shape, dtype=bool)
+
+    def _coupling_indices(self, chunk, pair_i, pair_j, blocks=None):
+        # Flat index of each (sequence, pair) term in the coupling array
+        if self.packed:
+            if blocks is None:
+                blocks, _ = self._pair_blocks(pair_i, pair_j)
+            return blocks * (Q * Q) + chunk[:, pair_i] * Q + chunk[:, pair_j]
+        rows = Q * pair_i + chunk[:, pair_i]
+        cols = Q * pair_j + chunk[:, pair_j]
+        return rows * self.couplings.shape[1] + cols
+
+    def pair_couplings(self, pos_i, state_i, pos_j, state_j):
+        """
+        Couplings of state `state_i` at `pos_i` with state `state_j` at `pos_j`, for broadcastable
+        arrays of positions with ``pos_i < pos_j``.
+        """
+        pos_i, state_i, pos_j, state_j = np.broadcast_arrays(pos_i, state_i, pos_j, state_j)
+        if self.packed:
+            blocks, coupled = self._pair_blocks(pos_i, pos_j)
+            if not self.couplings.size:
+                return np.zeros(blocks.shape, dtype=self.couplings.dtype)
+            flat_idx = blocks * (Q * Q) + state_i * Q + state_j
+            return np.where(coupled, np.take(self.couplings.ravel(), flat_idx), 0)
+        flat_idx = (Q * pos_i + state_i) * self.couplings.shape[1] + Q * pos_j + state_j
+        return np.take(self.couplings.ravel(), flat_idx)
+
+    def coupling_fields(self, codes, chunk_size=None):
+        """
+        Total coupling of every state at every position with the rest of a sequence.
+
+        Parameters
+        ----------
+        codes : numpy.ndarray
+            ``(L,)`` states of the sequence, from `encode_sequences`.
+        chunk_size : int, optional
+            Number of positions handled at once.
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(L, 21)`` array where entry ``[i, b]`` is the sum over ``j != i`` of the coupling of state
+            ``b`` at ``i`` with ``codes[j]`` at ``j``.
+        """
+        length = len(codes)
+        if chunk_size is None:
+            chunk_size = max(1, DEFAULT_CHUNK_BYTES // max(1, Q * length * _BYTES_PER_PAIR_TERM))
+        states = np.arange(Q)[None, :, None]
+        others = np.arange(length)[None, None, :]
+        other_states = codes[None, None, :]
+
+        fields = np.zeros((length, Q))
+        for start in range(0, length, chunk_size):
+            pos = np.arange(start, min(start + chunk_size, length))[:, None, None]
+            before = pos < others
+            values = self.pair_couplings(
+                np.minimum(pos, others),
+                np.where(before, states, other_states),
+                np.maximum(pos, others),
+                np.where(before, other_states, states),
+            )
+            # pos == others looks up an arbitrary in-range coupling, which is dropped here
+            values = np.where(pos == others, 0, values)
+            fields[start:start + len(pos)] = values.sum(axis=2, dtype=np.float64)
+        return fields
+
+    def energies(self, codes, chunk_size=None):
+        """
+        Sum of local fields and couplings for every row of an encoded batch.
+
+        Parameters
+        ----------
+        codes : numpy.ndarray
+            ``(n_sequences, L)`` state matrix from `encode_sequences`.
+        chunk_size : int, optional
+            Number of sequences scored at once. Defaults to a size that keeps the gathered
+            coupling terms and their indices under ``DEFAULT_CHUNK_BYTES``.
+
+        Returns
+        -------
+        numpy.ndarray
+            Energy of each sequence, in the same order as `codes`.
+        """
+        n_seqs, length = codes.shape
+        pair_i, pair_j, blocks = self.coupled_pairs(length)
+        if chunk_size is None:
+            chunk_size = max(1, DEFAULT_CHUNK_BYTES // max(1, len(pair_i) * _BYTES_PER_PAIR_TERM))
+        positions = np.arange(length)
+
+        # Flat indices into C-ordered tables; np.take keeps the gathered rows contiguous so each
+        # row is summed in the same order as a 1D sum over that sequence's terms.
+        flat_fields = self.local_fields.ravel()
+        flat_couplings = self.couplings.ravel()
+        field_cols = self.local_fields.shape[1]
+
+        # Accumulate in float64 so float32 parameters do not lose precision over O(L^2) terms
+        E = np.zeros(n_seqs)
+        for start in range(0, n_seqs, chunk_size):
+            chunk = codes[start:start + chunk_size]
+            E[start:start + chunk_size] = np.take(flat_fields, chunk * field_cols + positions).sum(axis=1, dtype=np.float64)
+            coupling_idx = self._coupling_indices(chunk, pair_i, pair_j, blocks)
+            E[start:start + chunk_size] += np.take(flat_couplings, coupling_idx).sum(axis=1, dtype=np.float64)
+        return E
+
+    def hamiltonian(self, seq_list, chunk_size=None):
+        """
+        Potts Hamiltonian ``-H`` of each sequence. Sequences may have different lengths.
+        """
+        seq_list = list(seq_list)
+        H = np.zeros(len(seq_list))
+        by_length = {}
+        for idx, seq in enumerate(seq_list):
+            by_length.setdefault(len(seq), []).append(idx)
+        for length, indices in by_length.items():
+            if self.column_map is not None and length != self.sequence_length:
+                raise ValueError(f"Sequences must have length {self.sequence_length}, got {length}.")
+            codes = encode_sequences((seq_list[idx] for idx in indices), length)
+            H[indices] = self.energies(self.trim(codes), chunk_size=chunk_size)
+        return -H
+
+
+def calc_Hamiltonian(seq_list, coupling_tbl, lf_tbl, chunk_size=None):
+    return PottsModel(coupling_tbl, lf_tbl).hamiltonian(seq_list, chunk_size=chunk_size)
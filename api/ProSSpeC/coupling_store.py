@@ -0,0 +1,196 @@
+import struct
+
+import numpy as np
+
+from .calculate_Hamiltonian import PottsModel, Q
+
+MAGIC = b"DCACPL\x01\x00"
+# Magic, number of positions, states per position and number of stored blocks
+_HEADER = struct.Struct("<8sIIQ")
+_ALIGN = 64
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def _layout(length, n_blocks):
+    # Offsets of the sections of a store: pair norms, local fields, stored pair indices and blocks
+    n_pairs = length * (length - 1) // 2
+    norms = _aligned(_HEADER.size)
+    fields = _aligned(norms + 4 * n_pairs)
+    pairs = _aligned(fields + 4 * Q * length)
+    blocks = _aligned(pairs + 8 * n_blocks)
+    return norms, fields, pairs, blocks, blocks + 4 * Q * Q * n_blocks
+
+
+def pair_norms(couplings, chunk_size=65536):
+    """
+    Frobenius norm of each ``(21, 21)`` block of packed couplings, in float64.
+    """
+    norms = np.empty(len(couplings))
+    for start in range(0, len(couplings), chunk_size):
+        chunk = np.asarray(couplings[start:start + chunk_size], dtype=np.float64)
+        norms[start:start + len(chunk)] = np.sqrt(np.einsum("pab,pab->p", chunk, chunk))
+    return norms
+
+
+def stored_block_count(length, top_k=None, max_bytes=None):
+    """
+    Number of coupling blocks a store of `length` positions keeps under `top_k` and a file size of `max_bytes`.
+    """
+    n_pairs = length * (length - 1) // 2
+    count = n_pairs if top_k is None else min(top_k, n_pairs)
+    if max_bytes is not None:
+        fixed = _layout(length, 0)[-1]
+        count = min(count, max(0, (max_bytes - fixed - _ALIGN) // (4 * Q * Q + 8)))
+    return count
+
+
+def write_coupling_store(fs, couplings, local_fields, top_k=None, max_bytes=None, pairs=None, norms=None):
+    """
+    Write Potts parameters as a coupling store that keeps the norm of every pair but only the
+    couplings of the strongest pairs.
+
+    The little-endian file holds a header (`MAGIC`, ``L``, 21 and the number of stored blocks ``K``)
+    followed by 64-byte aligned sections: the float32 Frobenius norm of every pair block in
+    ``numpy.triu_indices(L, k=1)`` order, the ``(21, L)`` float32 local fields, the int64 indices of
+    the ``K`` stored pairs in ascending order and their ``(K, 21, 21)`` float32 blocks.
+
+    Parameters
+    ----------
+    fs : file-like
+        Binary file the store is written to.
+    couplings : numpy.ndarray
+        Packed ``(L(L-1)/2, 21, 21)`` couplings, see `pack_couplings`, or with `pairs` the blocks of
+        those pairs. Any array-like indexable by an array of block indices is read in slices.
+    local_fields : numpy.ndarray
+        ``(21, L)`` local fields.
+    top_k : int, optional
+        Number of blocks kept, by decreasing norm. Defaults to every pair.
+    max_bytes : int, optional
+        Keep fewer blocks if needed for the file to fit in this size.
+    pairs : numpy.ndarray, optional
+        Ascending ``numpy.triu_indices(L, k=1)`` index of the pair of each block of `couplings`, when
+        only some pairs have couplings. The others have zero couplings.
+    norms : numpy.ndarray, optional
+        Precomputed norm of every pair, required with `pairs`.
+
+    Returns
+    -------
+    int
+        Number of blocks stored.
+    """
+    length = local_fields.shape[1]
+    n_pairs = length * (length - 1) // 2
+    if pairs is None:
+        if couplings.shape != (n_pairs, Q, Q):
+            raise ValueError(f"Couplings {couplings.shape} are not packed tables of {length} positions")
+        pairs = np.arange(n_pairs)
+        if norms is None:
+            norms = pair_norms(couplings)
+    elif norms is None or len(norms) != n_pairs or len(pairs) != len(couplings):
+        raise ValueError("Couplings of some pairs need the norms of every pair and the pair of each block")
+    if local_fields.shape != (Q, length):
+        raise ValueError(f"Local fields {local_fields.shape} are not a table of {length} positions")
+
+    n_blocks = min(stored_block_count(length, top_k, max_bytes), len(pairs))
+    if n_blocks < len(pairs):
+        # Blocks of the strongest pairs, keeping them in ascending pair order
+        kept = np.sort(np.argpartition(-np.asarray(norms)[pairs], n_blocks)[:n_blocks]) if n_blocks else np.zeros(0, dtype=np.int64)
+    else:
+        kept = np.arange(len(pairs))
+
+    offsets = _layout(length, n_blocks)
+    sections = (
+        np.asarray(norms, dtype="<f4"),
+        np.asarray(local_fields, dtype="<f4"),
+        np.asarray(pairs, dtype="<i8")[kept],
+    )
+    fs.write(_HEADER.pack(MAGIC, length, Q, n_blocks))
+    position = _HEADER.size
+    for offset, section in zip(offsets, sections):
+        fs.write(b"\0" * (offset - position))
+        fs.write(np.ascontiguousarray(section).tobytes())
+        position = offset + section.nbytes
+    fs.write(b"\0" * (offsets[3] - position))
+    # Blocks are written in slices so a memory-mapped source is not read into memory at once
+    for start in range(0, n_blocks, 4096):
+        fs.write(np.ascontiguousarray(couplings[kept[start:start + 4096]], dtype="<f4").tobytes())
+    return n_blocks
+
+
+class CouplingStore:
+    """
+    Read-only, memory-mapped view of a file written by `write_coupling_store`. Only the pages of the
+    norms, fields and blocks that are accessed are read from disk.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path of the store.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as fs:
+            magic, length, states, n_blocks = _HEADER.unpack(fs.read(_HEADER.size))
+        if magic != MAGIC or states != Q:
+            raise ValueError(f"{path} is not a coupling store")
+        self.length = length
+        self.n_blocks = n_blocks
+        offsets = _layout(length, n_blocks)
+        n_pairs = length * (length - 1) // 2
+
+        def section(offset, dtype, shape):
+            if not np.prod(shape):
+                return np.zeros(shape, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+        self.norms = section(offsets[0], "<f4", (n_pairs,))
+        self.local_fields = section(offsets[1], "<f4", (Q, length))
+        self.pairs = section(offsets[2], "<i8", (n_blocks,))
+        self.blocks = section(offsets[3], "<f4", (n_blocks, Q, Q))
+
+    @property
+    def complete(self):
+        """
+        True if the couplings of every pair are stored.
+        """
+        return self.n_blocks == len(self.norms)
+
+    def pair_index(self, pos_i, pos_j):
+        """
+        Index in ``numpy.triu_indices(L, k=1)`` order of pairs of 0-based positions, in either order.
+        """
+        pos_i, pos_j = np.minimum(pos_i, pos_j), np.maximum(pos_i, pos_j)
+        if np.any(pos_i == pos_j) or np.any(pos_i < 0) or np.any(pos_j >= self.length):
+            raise ValueError(f"Pairs must be of two different positions below {self.length}")
+        return pos_i * (2 * self.length - pos_i - 1) // 2 + (pos_j - pos_i - 1)
+
+    def pair_norms(self, pos_i, pos_j):
+        """
+        Frobenius norm of the couplings of pairs of 0-based positions, whether or not their block is stored.
+        """
+        return np.asarray(self.norms[self.pair_index(pos_i, pos_j)], dtype=np.float64)
+
+    def pair_blocks(self, pos_i, pos_j):
+        """
+        ``(n, 21, 21)`` couplings of pairs of 0-based positions, with entry ``[p, a, b]`` the coupling
+        of state ``a`` at ``pos_i[p]`` with state ``b`` at ``pos_j[p]``, and a mask of the pairs whose
+        block is stored. Blocks that are not stored are zero.
+        """
+        pos_i, pos_j = np.atleast_1d(pos_i), np.atleast_1d(pos_j)
+        slots = np.searchsorted(self.pairs, self.pair_index(pos_i, pos_j))
+        stored = slots < self.n_blocks
+        stored[stored] = self.pairs[slots[stored]] == self.pair_index(pos_i, pos_j)[stored]
+        blocks = np.zeros((len(pos_i), Q, Q), dtype=np.float32)
+        blocks[stored] = self.blocks[slots[stored]]
+        # Blocks are stored for i < j
+        swapped = pos_i > pos_j
+        blocks[swapped] = blocks[swapped].transpose(0, 2, 1)
+        return blocks, stored
+
+    def potts_model(self, column_map=None):
+        """
+        PottsModel of the stored parameters. Pairs whose block was not stored have zero couplings.
+        """
+        return PottsModel(self.blocks, self.local_fields, column_map=column_map, pairs=None if self.complete else self.pairs)
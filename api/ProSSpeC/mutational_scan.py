@@ -0,0 +1,114 @@
+import re
+
+import numpy as np
+
+from .calculate_Hamiltonian import Q, aa2num, encode_sequences
+
+ALPHABET = "".join(sorted(aa2num, key=aa2num.get))
+
+_MUTATION_RE = re.compile(r"^([A-Z-])(\d+)([A-Z-])$")
+
+
+def parse_mutation(mutation, wild_type):
+    """
+    Parse a substitution such as ``"A12G"`` (1-based position) against the wild type.
+
+    Returns
+    -------
+    tuple of int
+        0-based position and the Potts state of the substituted residue.
+    """
+    match = _MUTATION_RE.match(mutation.strip().upper())
+    if match is None:
+        raise ValueError(f"Invalid mutation {mutation!r}, expected e.g. 'A12G'")
+    wt_aa, position, mut_aa = match.group(1), int(match.group(2)) - 1, match.group(3)
+    if not 0 <= position < len(wild_type):
+        raise ValueError(f"Mutation {mutation} is outside of the wild type")
+    if wild_type[position] != wt_aa:
+        raise ValueError(f"Mutation {mutation} does not match wild type residue {wild_type[position]}")
+    if mut_aa not in aa2num:
+        raise ValueError(f"Unknown residue in mutation {mutation}")
+    return position, aa2num[mut_aa]
+
+
+def single_mutant_scan(model, wild_type):
+    """
+    Change of the Potts Hamiltonian ``-H`` for every single substitution of a wild type sequence.
+
+    Each substitution only changes the local field at its position and the couplings of that
+    position with the rest of the sequence, so all ``21L`` mutants are scored in O(L) each.
+
+    Parameters
+    ----------
+    model : PottsModel
+        Parameters the wild type is scored with. Must have the same length as `wild_type`.
+    wild_type : str
+        Wild type sequence.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``(L, 21)`` matrix where entry ``[i, b]`` is ``H(mutant) - H(wild type)`` for state ``b`` (see
+        `ALPHABET`) at position ``i``. Wild type states are 0.
+    """
+    if len(wild_type) != model.sequence_length:
+        raise ValueError(f"Wild type has length {len(wild_type)} but the parameters have length {model.sequence_length}")
+    codes = encode_sequences([wild_type])[0]
+    model_codes = model.trim(codes)
+    model_changes = model.local_fields[:, :len(model_codes)].T + model.coupling_fields(model_codes)
+    model_changes -= model_changes[np.arange(len(model_codes)), model_codes][:, None]
+    # Columns trimmed before fitting have no parameters, so substitutions there do not change H
+    energy_changes = np.zeros((len(codes), Q))
+    energy_changes[model.trim(np.arange(len(codes)))] = model_changes
+    return -energy_changes
+
+
+def double_mutant_scan(model, wild_type, mutation_pairs, single_mutants=None):
+    """
+    Change of the Potts Hamiltonian ``-H`` for pairs of substitutions, from the single mutant
+    changes and the coupling of the two substituted positions.
+
+    Parameters
+    ----------
+    model : PottsModel
+        Parameters the wild type is scored with.
+    wild_type : str
+        Wild type sequence.
+    mutation_pairs : list of tuple of str
+        Pairs of substitutions at different positions, e.g. ``[("A12G", "K30R")]``.
+    single_mutants : numpy.ndarray, optional
+        Output of `single_mutant_scan`, computed if not given.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``H(mutant) - H(wild type)`` for each pair.
+    """
+    if single_mutants is None:
+        single_mutants = single_mutant_scan(model, wild_type)
+    if not mutation_pairs:
+        return np.zeros(0)
+    codes = encode_sequences([wild_type])[0]
+    parsed = []
+    for first, second in mutation_pairs:
+        (pos_i, state_i), (pos_k, state_k) = sorted((parse_mutation(first, wild_type), parse_mutation(second, wild_type)))
+        if pos_i == pos_k:
+            raise ValueError(f"Mutations {first} and {second} are at the same position")
+        parsed.append((pos_i, state_i, pos_k, state_k))
+    pos_i, state_i, pos_k, state_k = np.array(parsed).T
+    singles = single_mutants[pos_i, state_i] + single_mutants[pos_k, state_k]
+
+    # Singles already count the coupling of each substituted residue with the other wild type residue.
+    # Pairs involving a column trimmed before fitting have no coupling.
+    model_i, model_k = model.model_positions(pos_i), model.model_positions(pos_k)
+    coupled = (model_i >= 0) & (model_k >= 0)
+    model_i, model_k, state_i, state_k = model_i[coupled], model_k[coupled], state_i[coupled], state_k[coupled]
+    wt_i, wt_k = codes[pos_i[coupled]], codes[pos_k[coupled]]
+    epistasis = np.zeros(len(parsed))
+    epistasis[coupled] = (
+        model.pair_couplings(model_i, state_i, model_k, state_k)
+        - model.pair_couplings(model_i, state_i, model_k, wt_k)
+        - model.pair_couplings(model_i, wt_i, model_k, state_k)
+        + model.pair_couplings(model_i, wt_i, model_k, wt_k)
+    )
+    return singles - epistasis
@@ -0,0 +1,174 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ..cacheutils import LRUCache
+from .calculate_Hamiltonian import PottsModel, pack_couplings
+
+_PROJECT_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+class ProjectParameterStore:
+    """
+    Binary, memory-mapped store of the Potts parameters of Hamiltonian projects.
+
+    The source tables are read once from ``{projects_dir}/local_fields/{project_id}.csv`` and
+    ``{projects_dir}/couplings/{project_id}.csv`` and converted into ``{store_dir}/{project_id}/``,
+    which holds ``local_fields.npy`` (``(21, L)``), ``couplings.npy`` (upper-triangular blocks, see
+    `pack_couplings`) and ``source.json`` (the size and modification time of the CSVs they were built
+    from). Loaded projects are memory-mapped and kept in a per-process LRU bounded by `max_bytes`.
+
+    Parameters
+    ----------
+    projects_dir : str or pathlib.Path
+        Directory containing the ``local_fields`` and ``couplings`` CSV folders.
+    store_dir : str or pathlib.Path
+        Directory the converted parameters are written to.
+    max_bytes : int
+        Maximum total size of the projects kept open in this process.
+    """
+    def __init__(self, projects_dir, store_dir, max_bytes):
+        self.projects_dir = Path(projects_dir)
+        self.store_dir = Path(store_dir)
+        self.cache = LRUCache(max_bytes, sizeof=lambda model: model.nbytes)
+
+    @staticmethod
+    def check_project_id(project_id):
+        if not _PROJECT_ID_RE.match(project_id) or ".." in project_id:
+            raise ValueError(f"Invalid project id {project_id!r}")
+        return project_id
+
+    def source_paths(self, project_id):
+        return (
+            self.projects_dir / "local_fields" / f"{project_id}.csv",
+            self.projects_dir / "couplings" / f"{project_id}.csv",
+        )
+
+    def project_dir(self, project_id):
+        return self.store_dir / self.check_project_id(project_id)
+
+    def _source_signature(self, project_id):
+        signature = {}
+        for key, path in zip(("local_fields", "couplings"), self.source_paths(project_id)):
+            if not path.exists():
+                return None
+            stat = path.stat()
+            signature[key] = [stat.st_size, stat.st_mtime_ns]
+        return signature
+
+    def is_built(self, project_id):
+        """
+        True if converted parameters exist and are not older than the source CSVs. Projects whose
+        CSVs were removed after conversion are still considered built.
+        """
+        meta_path = self.project_dir(project_id) / "source.json"
+        if not meta_path.exists():
+            return False
+        signature = self._source_signature(project_id)
+        if signature is None:
+            return True
+        with open(meta_path) as fs:
+            return json.load(fs) == signature
+
+    def build(self, project_id):
+        """
+        Convert the project's CSV tables into the binary store, replacing any previous conversion.
+        """
+        lf_path, coup_path = self.source_paths(project_id)
+        signature = self._source_signature(project_id)
+        if signature is None:
+            raise FileNotFoundError(f"Missing local fields or couplings for project {project_id}")
+
+        local_fields = pd.read_csv(lf_path, header=None).to_numpy()
+        couplings = pack_couplings(pd.read_csv(coup_path, header=None).to_numpy())
+
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.store_dir, prefix=f".{project_id}-"))
+        try:
+            np.save(tmp_dir / "local_fields.npy", local_fields)
+            np.save(tmp_dir / "couplings.npy", couplings)
+            with open(tmp_dir / "source.json", "w") as fs:
+                json.dump(signature, fs)
+            self.invalidate(project_id)
+            try:
+                os.replace(tmp_dir, self.project_dir(project_id))
+            except OSError:
+                # Another process finished converting the same project first
+                if not self.is_built(project_id):
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def invalidate(self, project_id):
+        """
+        Drop the project from this process' cache and delete its converted parameters.
+        """
+        self.cache.pop(project_id)
+        shutil.rmtree(self.project_dir(project_id), ignore_errors=True)
+
+    def built_projects(self):
+        if not self.store_dir.exists():
+            return []
+        return sorted(path.name for path in self.store_dir.iterdir() if (path / "source.json").exists())
+
+    def source_projects(self):
+        lf_dir = self.projects_dir / "local_fields"
+        if not lf_dir.exists():
+            return []
+        return sorted(path.stem for path in lf_dir.glob("*.csv") if self.source_paths(path.stem)[1].exists())
+
+    def _load(self, project_id):
+        if not self.is_built(project_id):
+            self.build(project_id)
+        project_dir = self.project_dir(project_id)
+        return PottsModel(
+            np.load(project_dir / "couplings.npy", mmap_mode="r"),
+            np.load(project_dir / "local_fields.npy", mmap_mode="r"),
+        )
+
+    def get(self, project_id):
+        """
+        Get the memory-mapped PottsModel of a project, converting its CSVs first if needed. Cached
+        projects are reloaded if they were invalidated or their CSVs changed since they were loaded.
+        """
+        self.check_project_id(project_id)
+        model = self.cache.get(project_id)
+        if model is None or not self.is_built(project_id):
+            self.cache.pop(project_id)
+            model = self.cache.put(project_id, self._load(project_id))
+        return model
+
+
+_project_store = None
+
+
+def get_project_store():
+    global _project_store
+    if _project_store is None:
+        from django.conf import settings
+        _project_store = ProjectParameterStore(
+            settings.HAMILTONIAN_PROJECTS_DIR,
+            settings.HAMILTONIAN_STORE_DIR,
+            settings.HAMILTONIAN_STORE_CACHE_BYTES,
+        )
+    return _project_store
+
+
+_dca_model_cache = None
+
+
+def get_dca_model_cache():
+    """
+    Per-process LRU of the memory-mapped PottsModels of stored DCA results, keyed by DCA id.
+    """
+    global _dca_model_cache
+    if _dca_model_cache is None:
+        from django.conf import settings
+        _dca_model_cache = LRUCache(settings.HAMILTONIAN_STORE_CACHE_BYTES, sizeof=lambda model: model.nbytes)
+    return _dca_model_cache
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import APITaskMeta, SeedSequence, MultipleSequenceAlignment, DirectCouplingAnalysis, MappedDi, StructureContacts
+from .models import APITaskMeta, SeedSequence, MultipleSequenceAlignment, DirectCouplingAnalysis, MappedDi, StructureContacts, SequenceLibrary, HamiltonianScores
 
 admin.site.register(APITaskMeta)
 admin.site.register(SeedSequence)
@@ -8,3 +8,5 @@ admin.site.register(MultipleSequenceAlignment)
 admin.site.register(DirectCouplingAnalysis)
 admin.site.register(MappedDi)
 admin.site.register(StructureContacts)
+admin.site.register(SequenceLibrary)
+admin.site.register(HamiltonianScores)
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache bounded by the total size of its values.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum total size of the cached values. Least recently used values are evicted to stay under it.
+    sizeof : callable, optional
+        Size of a value. Defaults to 1 per value, which bounds the number of entries instead.
+    """
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof if sizeof is not None else (lambda value: 1)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if size > self.max_size:
+                return value
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+        return value
+
+    def get_or_create(self, key, create):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, create())
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self._size -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,608 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+import os
+
+import billiard
+import numpy as np
+import numpy.typing as npt
+from scipy import optimize, sparse
+from scipy.linalg import blas, lapack
+
+from .msamatrix import STATES
+
+Q = len(STATES)
+
+# Sequences closer than this Hamming distance are down-weighted as redundant
+DEFAULT_THETA = 0.2
+
+# Number of residue pairs whose direct information is computed at once
+DI_PAIR_CHUNK = 1024
+# Memory used by each sequence weights thread for its one-hot blocks and identity matrices
+WEIGHTS_BLOCK_BYTES = 256 * 1024 * 1024
+
+
+def weights_block_size(depth: int, length: int, block_bytes: int = WEIGHTS_BLOCK_BYTES) -> int:
+    """
+    Number of sequences compared at once so that two float32 one-hot blocks, their float32 matches and a boolean comparison fit in `block_bytes`.
+    """
+    # 5 b^2 + 2 * 4 * 21 L b <= block_bytes
+    linear = 2 * 4 * Q * length
+    size = int((-linear + np.sqrt(linear ** 2 + 4 * 5 * block_bytes)) / (2 * 5))
+    return max(1, min(depth, size))
+
+
+def one_hot(codes: npt.NDArray, dtype=np.float32) -> npt.NDArray:
+    """
+    ``(depth, cols * 21)`` one-hot encoding of a matrix of states, where column ``21*i + a`` is set if position ``i`` has state ``a``.
+    """
+    depth, cols = codes.shape
+    encoded = np.zeros((depth, cols * Q), dtype=dtype)
+    encoded[np.arange(depth)[:, None], np.arange(cols) * Q + codes] = 1
+    return encoded
+
+
+class DCAFit:
+    """
+    Parameters and pair scores of a DCA fit, with the attributes of the py-mfdca ``dca`` class.
+
+    Attributes
+    ----------
+    Meff : float
+        Effective number of sequences, the sum of the sequence weights.
+    couplings : numpy.ndarray
+        Couplings in one of the layouts read by ``potts_tables_from_dca``.
+    localfields : numpy.ndarray
+        Local fields in the same gauge.
+    DI : numpy.ndarray
+        ``(L(L-1)/2, 3)`` rows of ``(i, j, score)`` for every pair of 1-based positions ``i < j``. The score is the direct information for mean-field DCA
+        and the APC-corrected Frobenius norm of the couplings for plmDCA.
+    """
+    def __init__(self, Meff, couplings, localfields, DI):
+        self.Meff = Meff
+        self.couplings = couplings
+        self.localfields = localfields
+        self.DI = DI
+
+
+class DCAModel(ABC):
+    """
+    Encoded alignment fitted by a DCA engine.
+
+    The alignment is encoded once, so several fits, for example for different ``theta``, share the parsing and the sequence identities.
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        ``(depth, L)`` matrix of states, indexed as in ``msamatrix.STATES``. See MSAMatrix.encode.
+    block_size : int
+        Number of sequences one-hot encoded at once.
+    """
+    def __init__(self, codes: npt.NDArray, block_size: int = 1024):
+        self.codes = np.ascontiguousarray(codes, dtype=np.uint8)
+        self.block_size = max(block_size, 1)
+
+    @property
+    def depth(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def length(self) -> int:
+        return self.codes.shape[1]
+
+    def _blocks(self):
+        for start in range(0, self.depth, self.block_size):
+            yield start, self.codes[start:start + self.block_size]
+
+    def sequence_weights(self, thetas: Iterable[float], block_bytes: int = WEIGHTS_BLOCK_BYTES, workers: Optional[int] = None) -> npt.NDArray[np.float64]:
+        """
+        Sequence weights for each ``theta``, from a single pass over the sequence identities.
+
+        The weight of a sequence is one over the number of sequences, itself included, within a Hamming distance (fraction of differing positions) of less
+        than ``theta``. A ``theta`` of 0 gives every sequence a weight of 1.
+
+        Identities are one-hot matrix products between blocks of sequences, sized to `block_bytes`. Only the blocks on and above the diagonal are computed,
+        as identities are symmetric, and the rows of blocks are spread over a pool of threads.
+
+        Parameters
+        ----------
+        thetas : iterable of float
+            Distance thresholds, between 0 and 1.
+        block_bytes : int
+            Memory used by each thread, see weights_block_size.
+        workers : int, optional
+            Number of threads. Defaults to the number of CPUs.
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(len(thetas), depth)`` weights.
+        """
+        thetas = np.asarray(list(thetas), dtype=np.float64)
+        neighbours = np.zeros((len(thetas), self.depth), dtype=np.int64)
+        if self.depth and self.length and np.any(thetas > 0):
+            size = weights_block_size(self.depth, self.length, block_bytes)
+            starts = range(0, self.depth, size)
+            # Fewest matches of two sequences within each theta, from the same float64 distances (L - matches) / L
+            distances = (self.length - np.arange(self.length + 1)) / self.length
+            min_matches = [np.flatnonzero(distances < theta)[0] if theta > 0 else self.length + 1 for theta in thetas]
+
+            def count(start):
+                # Neighbours among the rows of this block and of every later block, for both blocks
+                counts = np.zeros_like(neighbours)
+                rows = one_hot(self.codes[start:start + size])
+                for other in range(start, self.depth, size):
+                    others = rows if other == start else one_hot(self.codes[other:other + size])
+                    # Matches are counted exactly in float32 as long as L < 2^24
+                    matches = rows @ others.T
+                    for k, threshold in enumerate(min_matches):
+                        close = matches >= threshold
+                        counts[k, start:start + len(rows)] += close.sum(axis=1)
+                        if other != start:
+                            counts[k, other:other + len(others)] += close.sum(axis=0)
+                return counts
+
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                for counts in executor.map(count, starts):
+                    neighbours += counts
+        # The self-match is counted above for theta > 0
+        neighbours[thetas <= 0] = 1
+        return 1 / neighbours
+
+    @abstractmethod
+    def fit(self, weights: npt.NDArray, **options) -> DCAFit:
+        """
+        Fit the model with the given sequence weights, see sequence_weights.
+        """
+
+
+class MeanFieldDCA(DCAModel):
+    """
+    Mean-field DCA (Morcos et al. 2011), as computed by py-mfdca.
+
+    The couplings are ``(L(q-1), L(q-1))`` ``e_ij(a, b) = -C^-1`` and the local fields ``(L, q-1)``. The last state, ``Y``, is the gauge state with zero
+    couplings and fields.
+    """
+    def frequencies(self, weights: npt.NDArray, states: int = Q, dtype=np.float64) -> tuple[npt.NDArray[np.float64], npt.NDArray]:
+        """
+        Weighted single-site and pair frequencies, without pseudocounts.
+
+        Parameters
+        ----------
+        weights : numpy.ndarray
+            Weight of each sequence.
+        states : int
+            Number of states, starting from the first, included in the pair frequencies.
+        dtype : numpy.dtype
+            Data type the pair frequencies are accumulated in.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            ``(L, q)`` float64 single-site frequencies and ``(L * states, L * states)`` pair frequencies.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        Pi = np.zeros(self.length * Q)
+        Pij = np.zeros((self.length * states, self.length * states), dtype=dtype)
+        syrk = blas.get_blas_funcs("syrk", (Pij,))
+        positions = np.arange(self.length)
+        for start, block in self._blocks():
+            block_weights = weights[start:start + len(block)]
+            Pi += np.bincount((positions * Q + block).ravel(), weights=np.repeat(block_weights, self.length), minlength=self.length * Q)
+            # One-hot rows of the first `states` states scaled by sqrt(w), so that Pij += X^T X is accumulated in place into the lower triangle of Pij
+            # (the upper triangle of the Fortran-ordered Pij.T)
+            scaled = np.zeros((len(block), self.length * states), dtype=dtype)
+            rows, cols = np.nonzero(block < states)
+            scaled[rows, cols * states + block[rows, cols]] = np.sqrt(block_weights)[rows]
+            syrk(1.0, scaled.T, beta=1.0, c=Pij.T, lower=0, overwrite_c=1)
+        symmetrize_lower(Pij)
+        Meff = weights.sum()
+        Pij /= Meff
+        return Pi.reshape(self.length, Q) / Meff, Pij
+
+    def fit(self, weights: npt.NDArray, pseudocount_weight: float = 0.5, dtype=np.float64) -> DCAFit:
+        """
+        Fit the couplings and compute the direct information of every pair of positions.
+
+        The correlation matrix is built, inverted and negated in place, so the fit holds a single ``(L(q-1), L(q-1))`` matrix of `dtype`.
+
+        Parameters
+        ----------
+        weights : numpy.ndarray
+            Weight of each sequence, see sequence_weights.
+        pseudocount_weight : float
+            Relative weight of the uniform pseudocount mixed into the frequencies.
+        dtype : numpy.dtype
+            Data type of the correlations and couplings. float32 halves the memory of the fit; local fields, ``Meff`` and DI are float64.
+        """
+        L = self.length
+        n = L * (Q - 1)
+        Meff = float(np.sum(weights))
+        # Connected correlations of the first q - 1 states; the last is the gauge state
+        Pi_true, C = self.frequencies(weights, states=Q - 1, dtype=dtype)
+        Pi = (1 - pseudocount_weight) * Pi_true + pseudocount_weight / Q
+        C *= 1 - pseudocount_weight
+        C += pseudocount_weight / Q / Q
+        diagonal = (1 - pseudocount_weight) * Pi_true[:, :-1, None] * np.eye(Q - 1) + pseudocount_weight / Q * np.eye(Q - 1)
+        C.reshape(L, Q - 1, L, Q - 1)[np.arange(L), :, np.arange(L), :] = diagonal
+        P = Pi[:, :-1].ravel().astype(dtype)
+        for start in range(0, n, Q - 1):
+            C[start:start + Q - 1] -= P[start:start + Q - 1, None] * P
+
+        couplings = invert_covariance(C)
+        np.negative(couplings, out=couplings)
+        blocks = couplings.reshape(L, Q - 1, L, Q - 1)
+        blocks[np.arange(L), :, np.arange(L), :] = 0
+        # h_i(a) = log(P_i(a) / P_i(q)) - sum_{j != i} sum_b e_ij(a, b) P_j(b)
+        localfields = np.log(Pi[:, :-1] / Pi[:, -1:]) - (couplings @ P).reshape(L, Q - 1)
+
+        pair_i, pair_j = np.triu_indices(L, k=1)
+        DI = np.empty((len(pair_i), 3))
+        DI[:, 0] = pair_i + 1
+        DI[:, 1] = pair_j + 1
+        for start in range(0, len(pair_i), DI_PAIR_CHUNK):
+            i = pair_i[start:start + DI_PAIR_CHUNK]
+            j = pair_j[start:start + DI_PAIR_CHUNK]
+            # The two-site fields converge slowly for strong couplings, so DI is computed in float64 a chunk at a time
+            DI[start:start + len(i), 2] = direct_information(blocks[i, :, j, :].astype(np.float64), Pi[i], Pi[j])
+        return DCAFit(Meff, couplings, localfields, DI)
+
+
+def invert_covariance(C: npt.NDArray) -> npt.NDArray:
+    """
+    Inverse of a symmetric positive definite matrix, computed in place through its Cholesky factorization.
+
+    Parameters
+    ----------
+    C : numpy.ndarray
+        C-contiguous float32 or float64 matrix. It is overwritten with its inverse.
+
+    Returns
+    -------
+    numpy.ndarray
+        `C`.
+
+    Raises
+    ------
+    numpy.linalg.LinAlgError
+        If `C` is not positive definite. Correlations with a pseudocount always are.
+    """
+    potrf, potri = lapack.get_lapack_funcs(("potrf", "potri"), (C,))
+    # A C-contiguous symmetric matrix is its own Fortran-contiguous transpose, so LAPACK works on C.T in place.
+    # The upper triangle of C.T is the lower triangle of C.
+    factor, info = potrf(C.T, lower=0, overwrite_a=1, clean=0)
+    if info == 0:
+        _, info = potri(factor, lower=0, overwrite_c=1)
+    if info != 0:
+        raise np.linalg.LinAlgError("The correlation matrix is not positive definite.")
+    return symmetrize_lower(C)
+
+
+def symmetrize_lower(C: npt.NDArray, band_size: int = 256) -> npt.NDArray:
+    """
+    Copy the lower triangle of a square matrix to its upper triangle in place, a band of rows at a time.
+    """
+    for start in range(0, len(C), band_size):
+        stop = min(start + band_size, len(C))
+        C[start:stop, stop:] = C[stop:, start:stop].T
+        band = C[start:stop, start:stop]
+        upper = np.triu_indices(stop - start, k=1)
+        band[upper] = band.T[upper]
+    return C
+
+
+def direct_information(couplings: npt.NDArray, Pi: npt.NDArray, Pj: npt.NDArray, epsilon: float = 1e-4, tiny: float = 1e-100) -> npt.NDArray[np.float64]:
+    """
+    Direct information of a batch of position pairs.
+
+    Parameters
+    ----------
+    couplings : numpy.ndarray
+        ``(n_pairs, q-1, q-1)`` couplings of each pair.
+    Pi, Pj : numpy.ndarray
+        ``(n_pairs, q)`` single-site frequencies, with pseudocounts, of the first and second position of each pair.
+    epsilon : float
+        Convergence threshold of the two-site model's fields.
+
+    Returns
+    -------
+    numpy.ndarray
+        Direct information of each pair.
+    """
+    n_pairs = len(couplings)
+    W = np.ones((n_pairs, Q, Q))
+    W[:, :-1, :-1] = np.exp(couplings)
+    mu1 = np.full((n_pairs, Q), 1 / Q)
+    mu2 = np.full((n_pairs, Q), 1 / Q)
+    # Fields are updated until each pair has converged
+    active = np.arange(n_pairs)
+    while len(active):
+        w = W[active]
+        new1 = Pi[active] / np.einsum("nb,nab->na", mu2[active], w)
+        new1 /= new1.sum(axis=1, keepdims=True)
+        new2 = Pj[active] / np.einsum("na,nab->nb", mu1[active], w)
+        new2 /= new2.sum(axis=1, keepdims=True)
+        diff = np.maximum(np.abs(new1 - mu1[active]), np.abs(new2 - mu2[active])).max(axis=1)
+        mu1[active] = new1
+        mu2[active] = new2
+        active = active[diff > epsilon]
+
+    Pdir = W * mu1[:, :, None] * mu2[:, None, :]
+    Pdir /= Pdir.sum(axis=(1, 2), keepdims=True)
+    Pfac = Pi[:, :, None] * Pj[:, None, :]
+    return np.sum(Pdir * np.log((Pdir + tiny) / (Pfac + tiny)), axis=(1, 2))
+
+
+# Sequences, weights and regularization of the sites fitted by a plmDCA worker process
+_plm_worker_data = None
+
+
+def _init_plm_worker(codes, weights, lambda_h, lambda_J):
+    global _plm_worker_data
+    depth, length = codes.shape
+    # Sparse one-hot matrix, so that energies and gradients cost O(depth L q) rather than O(depth L q^2)
+    encoded = sparse.csr_matrix(
+        (np.ones(depth * length), (np.repeat(np.arange(depth), length), (np.arange(length) * Q + codes).ravel())),
+        shape=(depth, length * Q),
+    )
+    _plm_worker_data = (codes, encoded, weights / weights.sum(), lambda_h, lambda_J)
+
+
+def _fit_plm_site(site):
+    """
+    Fields ``(q,)`` and couplings ``(L, q, q)`` of one site, where ``J[i, b, a]`` couples state ``a`` at `site` with state ``b`` at ``i``.
+    """
+    codes, encoded, weights, lambda_h, lambda_J = _plm_worker_data
+    depth, length = codes.shape
+    observed = codes[:, site]
+    rows = np.arange(depth)
+    own = slice(site * Q, (site + 1) * Q)
+
+    def objective(x):
+        h = x[:Q]
+        J = x[Q:].reshape(length * Q, Q)
+        energies = encoded @ J + h
+        energies -= energies.max(axis=1, keepdims=True)
+        log_z = np.log(np.exp(energies).sum(axis=1))
+        loss = -np.dot(weights, energies[rows, observed] - log_z) + lambda_h * np.dot(h, h) + lambda_J * np.dot(x[Q:], x[Q:])
+
+        # Gradient of the negative log-likelihood: weighted model minus observed state probabilities
+        residual = np.exp(energies - log_z[:, None])
+        residual[rows, observed] -= 1
+        residual *= weights[:, None]
+        grad_J = encoded.T @ residual + 2 * lambda_J * J
+        # A site is not coupled to itself
+        grad_J[own] = 0
+        return loss, np.concatenate([residual.sum(axis=0) + 2 * lambda_h * h, grad_J.ravel()])
+
+    result = optimize.minimize(objective, np.zeros(Q + length * Q * Q), jac=True, method="L-BFGS-B")
+    return result.x[:Q], result.x[Q:].reshape(length, Q, Q)
+
+
+class PseudoLikelihoodDCA(DCAModel):
+    """
+    Asymmetric pseudo-likelihood maximization DCA (plmDCA, Ekeberg et al. 2014).
+
+    The conditional likelihood of each site given the rest of its sequence is maximized independently, with L-BFGS and L2 regularization, and the two
+    estimates of each coupling averaged. The couplings are ``(L, L, q, q)`` and the local fields ``(L, q)``, for every state including gaps.
+
+    Parameters
+    ----------
+    codes, block_size
+        As in DCAModel.
+    lambda_h, lambda_J : float
+        Strength of the L2 regularization of the fields and couplings.
+    """
+    def __init__(self, codes: npt.NDArray, block_size: int = 1024, lambda_h: float = 0.01, lambda_J: float = 0.01):
+        super().__init__(codes, block_size=block_size)
+        self.lambda_h = lambda_h
+        self.lambda_J = lambda_J
+
+    def fit(self, weights: npt.NDArray, workers: Optional[int] = None) -> DCAFit:
+        """
+        Fit every site, in parallel over a pool of `workers` processes, and score pairs by the APC-corrected Frobenius norm of their couplings.
+
+        Parameters
+        ----------
+        weights : numpy.ndarray
+            Weight of each sequence, see sequence_weights.
+        workers : int, optional
+            Number of processes. Defaults to the number of CPUs; with 1 the sites are fitted in this process.
+        """
+        L = self.length
+        weights = np.asarray(weights, dtype=np.float64)
+        initargs = (self.codes, weights, self.lambda_h, self.lambda_J)
+        workers = min(workers or os.cpu_count() or 1, L)
+        if workers > 1:
+            # billiard, unlike multiprocessing, can start pools from the daemonic processes of Celery's prefork workers
+            pool = billiard.Pool(workers, initializer=_init_plm_worker, initargs=initargs)
+            try:
+                # One job per site: billiard workers that ran chunks of a map only exit after a 30 s timeout
+                results = [pool.apply_async(_fit_plm_site, (site,)) for site in range(L)]
+                sites = [result.get() for result in results]
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_plm_worker(*initargs)
+            sites = [_fit_plm_site(site) for site in range(L)]
+
+        localfields = np.stack([h for h, _ in sites])
+        # couplings[i, j, a, b] couples state a at i with state b at j
+        couplings = np.stack([J for _, J in sites]).transpose(0, 1, 3, 2)
+        couplings += couplings.transpose(1, 0, 3, 2)
+        couplings /= 2
+
+        # Frobenius norms in the zero-sum gauge, without gaps, then the average product correction
+        gauged = couplings - couplings.mean(axis=2, keepdims=True) - couplings.mean(axis=3, keepdims=True) + couplings.mean(axis=(2, 3), keepdims=True)
+        norms = np.sqrt(np.sum(gauged[:, :, 1:, 1:] ** 2, axis=(2, 3)))
+        norms[np.arange(L), np.arange(L)] = 0
+        scores = norms - np.outer(norms.mean(axis=0), norms.mean(axis=0)) / norms.mean()
+
+        pair_i, pair_j = np.triu_indices(L, k=1)
+        DI = np.column_stack([pair_i + 1, pair_j + 1, scores[pair_i, pair_j]]).astype(np.float64)
+        return DCAFit(float(weights.sum()), couplings, localfields, DI)
+
+
+DCA_ENGINES = {
+    "mean_field": MeanFieldDCA,
+    "plm": PseudoLikelihoodDCA,
+}
+
+
+def alignment_boundaries(codes: npt.NDArray, min_fraction: float = 0.05) -> npt.NDArray[np.int64]:
+    """
+    Candidate domain boundaries of an alignment, from the HMM match states its hits start and end at.
+
+    The columns of an alignment produced by hmmsearch are the match states of the seed HMM, so the first and last aligned column of a row are where its hit
+    starts and ends on the HMM. Hits covering single domains of a multi-domain family pile up at the domain boundaries.
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        ``(depth, L)`` matrix of states, see DCAModel.
+    min_fraction : float
+        Fraction of the rows that must start at a position, or end just before it, for it to be a boundary.
+
+    Returns
+    -------
+    numpy.ndarray
+        Ascending positions ``0 < p < L`` that start a new segment.
+    """
+    depth, L = codes.shape
+    aligned = codes != STATES.index("-")
+    covered = aligned.any(axis=1)
+    first = aligned.argmax(axis=1)[covered]
+    last = L - 1 - aligned[:, ::-1].argmax(axis=1)[covered]
+    counts = np.bincount(first, minlength=L + 1) + np.bincount(last + 1, minlength=L + 1)
+    counts[[0, L]] = 0
+    return np.flatnonzero(counts >= max(min_fraction * depth, 1))
+
+
+def dca_windows(length: int, size: int, overlap: int, boundaries: Optional[npt.NDArray] = None) -> list[tuple[int, int]]:
+    """
+    Overlapping ``[start, stop)`` windows of at most `size` positions covering `length` positions.
+
+    Consecutive windows share `overlap` positions centred on a cut point. Without `boundaries` the cut points are evenly spaced; otherwise each window ends
+    around the last boundary in its second half, when there is one, so that windows hold whole domains.
+    """
+    if not 0 <= overlap < size // 2:
+        raise ValueError(f"The window overlap must be at least 0 and less than half of the window size {size}")
+    if length <= size:
+        return [(0, length)]
+    boundaries = np.asarray([] if boundaries is None else boundaries, dtype=np.int64)
+    half = overlap // 2
+    windows = []
+    start = 0
+    while start + size < length:
+        cut = start + size - (overlap - half)
+        guides = boundaries[(boundaries >= start + size // 2) & (boundaries <= cut)]
+        if len(guides):
+            cut = int(guides[-1])
+        windows.append((start, cut + overlap - half))
+        start = cut - half
+    windows.append((start, length))
+    return windows
+
+
+def window_pair_owners(length: int, windows: list[tuple[int, int]]) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """
+    For every pair of positions within a window, the window it is furthest from the edges of, where its fit is the least affected by the positions the
+    window leaves out. Ties go to the first window.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Ascending ``numpy.triu_indices(length, k=1)`` index of each covered pair, its window and its ``numpy.triu_indices`` index within that window.
+    """
+    pairs, centrality, owners, local = [], [], [], []
+    for k, (start, stop) in enumerate(windows):
+        size = stop - start
+        i, j = np.triu_indices(size, k=1)
+        global_i, global_j = i + start, j + start
+        pairs.append(global_i * (2 * length - global_i - 1) // 2 + (global_j - global_i - 1))
+        centrality.append(np.minimum(i, size - 1 - j))
+        owners.append(np.full(len(i), k))
+        local.append(np.arange(len(i)))
+    pairs, centrality, owners, local = (np.concatenate(values) for values in (pairs, centrality, owners, local))
+    order = np.lexsort((owners, -centrality, pairs))
+    pairs = pairs[order]
+    first = np.r_[True, pairs[1:] != pairs[:-1]]
+    return pairs[first], owners[order][first], local[order][first]
+
+
+class WindowBlocks:
+    """
+    Coupling blocks of covered pairs gathered from the fits of their windows, indexable by arrays of block indices like packed couplings.
+    """
+    def __init__(self, window_blocks, owners, local):
+        self.window_blocks = window_blocks
+        self.owners = owners
+        self.local = local
+
+    def __len__(self):
+        return len(self.owners)
+
+    def __getitem__(self, index):
+        index = np.asarray(index)
+        blocks = np.empty((len(index), Q, Q), dtype=np.float32)
+        owners = self.owners[index]
+        for k in np.unique(owners):
+            rows = np.flatnonzero(owners == k)
+            blocks[rows] = self.window_blocks[k][self.local[index[rows]]]
+        return blocks
+
+
+def merge_window_fits(length: int, windows: list[tuple[int, int]], window_scores: list, window_norms: list, window_fields: list, window_blocks: list):
+    """
+    Merge the fits of overlapping windows into the pair scores and Potts parameters of the whole alignment. Each pair takes its score and couplings from the
+    window it is most central in (see window_pair_owners), and each position its local fields likewise. Pairs no window covers have no score and zero couplings.
+
+    Parameters
+    ----------
+    length : int
+        Number of positions of the alignment.
+    windows : list of tuple of int
+        ``[start, stop)`` of each window, see dca_windows.
+    window_scores : list of numpy.ndarray
+        Pair scores of each window, in ``numpy.triu_indices`` order of its positions.
+    window_norms : list of numpy.ndarray
+        Norms of the coupling blocks of each window, in the same order.
+    window_fields : list of numpy.ndarray
+        ``(21, size)`` local fields of each window.
+    window_blocks : list of numpy.ndarray
+        Packed ``(size(size-1)/2, 21, 21)`` coupling blocks of each window.
+
+    Returns
+    -------
+    DI : numpy.ndarray
+        ``(n, 3)`` rows of ``(i, j, score)`` for the covered pairs of 1-based positions ``i < j``.
+    norms : numpy.ndarray
+        Norm of every pair of the alignment, zero for uncovered pairs.
+    local_fields : numpy.ndarray
+        ``(21, length)`` local fields.
+    pairs : numpy.ndarray
+        ``numpy.triu_indices(length, k=1)`` index of each covered pair.
+    blocks : WindowBlocks
+        Couplings of each covered pair.
+    """
+    pairs, owners, local = window_pair_owners(length, windows)
+    scores = np.empty(len(pairs))
+    norms = np.zeros(length * (length - 1) // 2, dtype=np.float32)
+    for k in range(len(windows)):
+        rows = np.flatnonzero(owners == k)
+        scores[rows] = np.asarray(window_scores[k])[local[rows]]
+        norms[pairs[rows]] = np.asarray(window_norms[k])[local[rows]]
+
+    local_fields = np.empty((Q, length), dtype=np.float32)
+    best = np.full(length, -1)
+    for k, (start, stop) in enumerate(windows):
+        positions = np.arange(start, stop)
+        centrality = np.minimum(positions - start, stop - 1 - positions)
+        better = centrality > best[positions]
+        local_fields[:, positions[better]] = np.asarray(window_fields[k])[:, better]
+        best[positions[better]] = centrality[better]
+
+    pair_i, pair_j = np.triu_indices(length, k=1)
+    DI = np.column_stack([pair_i[pairs] + 1, pair_j[pairs] + 1, scores]).astype(np.float64)
+    return DI, norms, local_fields, pairs, WindowBlocks(window_blocks, owners, local)
@@ -0,0 +1,57 @@
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from scipy.stats import spearmanr
+
+from api.dcautils import MeanFieldDCA, DEFAULT_THETA
+from api.msamatrix import MSAMatrix
+from api.msautils import prepare_dca_matrix
+
+
+class Command(BaseCommand):
+    help = "Fit MSAs with float64 and float32 mean-field DCA and compare their DI rankings, peak memory and time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("msas", nargs="+", help="MSAs in FASTA format, without insert positions.")
+        parser.add_argument("--theta", type=float, default=DEFAULT_THETA, help="Sequence reweighting threshold.")
+        parser.add_argument("--perc-max-col-gaps", type=float, help="Trim columns with more than this percentage of gaps first.")
+        parser.add_argument("--top", type=int, help="Number of top ranked pairs compared. Defaults to L.")
+
+    def fit(self, model, weights, dtype):
+        # Peak memory of the numpy allocations of one fit
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            fit = model.fit(weights, dtype=dtype)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return fit.DI[:, 2], peak, elapsed
+
+    def handle(self, *args, **options):
+        self.stdout.write("msa\tdepth\tL\ttop\ttop_overlap\tspearman\tmax_di_diff\tpeak_mb_float64\tpeak_mb_float32\tseconds_float64\tseconds_float32")
+        for path in options["msas"]:
+            try:
+                matrix, _, _ = prepare_dca_matrix(MSAMatrix.load_from_file(path), perc_max_col_gaps=options["perc_max_col_gaps"])
+            except (ValueError, OSError) as e:
+                raise CommandError(f"{path}: {e}")
+            model = MeanFieldDCA(matrix.encode())
+            weights = model.sequence_weights([options["theta"]], block_bytes=settings.DCA_WEIGHTS_BLOCK_BYTES, workers=settings.DCA_CPUS)[0]
+
+            di64, peak64, seconds64 = self.fit(model, weights, np.float64)
+            di32, peak32, seconds32 = self.fit(model, weights, np.float32)
+
+            top = min(options["top"] or model.length, len(di64))
+            # Stable sorts so tied pairs are ranked the same way in both
+            top64 = np.argsort(-di64, kind="stable")[:top]
+            top32 = np.argsort(-di32, kind="stable")[:top]
+            overlap = len(np.intersect1d(top64, top32)) / top if top else 1.0
+            rho = spearmanr(di64, di32).statistic if len(di64) > 1 else 1.0
+            self.stdout.write(
+                f"{path}\t{model.depth}\t{model.length}\t{top}\t{overlap:.4f}\t{rho:.6f}\t{np.abs(di64 - di32).max():.3g}\t"
+                f"{peak64 / 2 ** 20:.1f}\t{peak32 / 2 ** 20:.1f}\t{seconds64:.2f}\t{seconds32:.2f}"
+            )
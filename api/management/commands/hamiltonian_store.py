@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ProSSpeC.parameter_store import get_project_store
+
+
+class Command(BaseCommand):
+    help = "Build, invalidate or list the binary Potts parameters of Hamiltonian projects."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["build", "invalidate", "list"])
+        parser.add_argument("project_ids", nargs="*", help="Projects to build or invalidate.")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Build every project with source CSVs, or invalidate every built project.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild projects that are already up to date.",
+        )
+
+    def handle(self, *args, **options):
+        store = get_project_store()
+        action = options["action"]
+
+        if action == "list":
+            built = set(store.built_projects())
+            for project_id in sorted(built | set(store.source_projects())):
+                state = "built" if store.is_built(project_id) else ("stale" if project_id in built else "not built")
+                self.stdout.write(f"{project_id}\t{state}")
+            return
+
+        project_ids = options["project_ids"]
+        if options["all"]:
+            project_ids = store.source_projects() if action == "build" else store.built_projects()
+        elif not project_ids:
+            raise CommandError("Supply project ids or --all.")
+
+        for project_id in project_ids:
+            try:
+                if action == "build":
+                    if store.is_built(project_id) and not options["force"]:
+                        self.stdout.write(f"{project_id} is up to date")
+                        continue
+                    store.build(project_id)
+                    self.stdout.write(self.style.SUCCESS(f"Built {project_id}"))
+                else:
+                    store.invalidate(project_id)
+                    self.stdout.write(self.style.SUCCESS(f"Invalidated {project_id}"))
+            except (ValueError, OSError) as e:
+                raise CommandError(f"{project_id}: {e}")
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.msautils import is_sequence_database_current, prepare_sequence_database
+
+
+class Command(BaseCommand):
+    help = "Digitize the hmmsearch sequence database so Celery workers can load it without parsing the FASTA."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fasta", default=settings.HMM_DATABASE, help="FASTA database to digitize.")
+        parser.add_argument("--output", default=settings.HMM_DATABASE_DIGITIZED, help="Directory to write the digitized database to.")
+        parser.add_argument("--batch-size", type=int, default=100000, help="Sequences digitized at once.")
+        parser.add_argument("--force", action="store_true", help="Rebuild a database that is already up to date.")
+
+    def handle(self, *args, **options):
+        fasta, output = str(options["fasta"]), str(options["output"])
+        if is_sequence_database_current(fasta, output) and not options["force"]:
+            self.stdout.write(f"{output} is up to date")
+            return
+        try:
+            count = prepare_sequence_database(fasta, output, batch_size=options["batch_size"])
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Digitized {count} sequences into {output}"))
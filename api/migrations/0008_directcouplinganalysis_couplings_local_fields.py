@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:05
+
+import api.modelutils
+import functools
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_pdb'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='couplings',
+            field=models.FileField(null=True, upload_to=functools.partial(api.modelutils.get_user_spesific_path, *(), **{'subfolder': 'dca', 'suffix': '.npy'})),
+        ),
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='local_fields',
+            field=models.FileField(null=True, upload_to=functools.partial(api.modelutils.get_user_spesific_path, *(), **{'subfolder': 'dca', 'suffix': '.npy'})),
+        ),
+    ]
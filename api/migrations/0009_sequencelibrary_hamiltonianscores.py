@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:07
+
+import api.modelutils
+import django.db.models.deletion
+import functools
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_directcouplinganalysis_couplings_local_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenceLibrary',
+            fields=[
+                ('apidataobject_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='api.apidataobject')),
+                ('name', models.CharField(max_length=200)),
+                ('fasta', models.FileField(upload_to=functools.partial(api.modelutils.get_user_spesific_path, *(), **{'subfolder': 'libraries', 'suffix': '.fasta'}))),
+            ],
+            bases=('api.apidataobject',),
+        ),
+        migrations.CreateModel(
+            name='HamiltonianScores',
+            fields=[
+                ('apidataobject_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='api.apidataobject')),
+                ('project_id', models.CharField(blank=True, max_length=200)),
+                ('output_format', models.CharField(choices=[('csv', 'Csv'), ('npz', 'Npz')], default='csv', max_length=3)),
+                ('scores', models.FileField(null=True, upload_to=functools.partial(api.modelutils.get_user_spesific_path, *(), **{'subfolder': 'hamiltonian'}))),
+                ('count', models.IntegerField(default=0)),
+                ('dca', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.directcouplinganalysis')),
+                ('library', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.sequencelibrary')),
+            ],
+            bases=('api.apidataobject',),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_sequencelibrary_hamiltonianscores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='multiplesequencealignment',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:19
+
+import api.modelutils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_multiplesequencealignment_search_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='multiplesequencealignment',
+            name='kept_rows',
+            field=api.modelutils.NdarrayField(null=True),
+        ),
+        migrations.AddField(
+            model_name='multiplesequencealignment',
+            name='perc_identity',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='multiplesequencealignment',
+            name='unreduced_depth',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:20
+
+import api.modelutils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_multiplesequencealignment_redundancy_reduction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='max_depth',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='msa_rows',
+            field=api.modelutils.NdarrayField(null=True),
+        ),
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='subsample_seed',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='multiplesequencealignment',
+            name='max_depth',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='multiplesequencealignment',
+            name='subsample_seed',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:22
+
+import api.modelutils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_msa_subsampling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='column_map',
+            field=api.modelutils.NdarrayField(null=True),
+        ),
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='perc_max_col_gaps',
+            field=models.FloatField(null=True),
+        ),
+    ]
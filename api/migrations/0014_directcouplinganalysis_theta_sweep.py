@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_directcouplinganalysis_column_map'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='sweep',
+            field=models.UUIDField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='theta',
+            field=models.FloatField(null=True),
+        ),
+    ]
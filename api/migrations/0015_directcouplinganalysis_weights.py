@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:29
+
+import api.modelutils
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_directcouplinganalysis_theta_sweep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='weights',
+            field=api.modelutils.NdarrayField(null=True),
+        ),
+    ]
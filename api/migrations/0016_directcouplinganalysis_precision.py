@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_directcouplinganalysis_weights'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='precision',
+            field=models.CharField(choices=[('float64', 'Float64'), ('float32', 'Float32')], default='float64', max_length=7),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_directcouplinganalysis_precision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='engine',
+            field=models.CharField(choices=[('mean_field', 'Mean Field'), ('plm', 'Plm')], default='mean_field', max_length=10),
+        ),
+    ]
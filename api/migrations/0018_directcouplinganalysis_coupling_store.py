@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+import api.modelutils
+import functools
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_directcouplinganalysis_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='coupling_store',
+            field=models.FileField(null=True, upload_to=functools.partial(api.modelutils.get_user_spesific_path, *(), **{'subfolder': 'dca', 'suffix': '.dcac'})),
+        ),
+    ]
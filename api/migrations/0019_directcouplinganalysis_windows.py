@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:55
+
+import api.modelutils
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_directcouplinganalysis_coupling_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directcouplinganalysis',
+            name='windows',
+            field=api.modelutils.NdarrayField(null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_directcouplinganalysis_windows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mappeddi',
+            name='batch',
+            field=models.UUIDField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mappeddi',
+            name='chain1',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='mappeddi',
+            name='chain2',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_mappeddi_chains_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MsaSearchClaim',
+            fields=[
+                ('search_key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('task_id', models.UUIDField()),
+                ('claimed', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
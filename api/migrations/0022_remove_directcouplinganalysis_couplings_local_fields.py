@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:29
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_msasearchclaim'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='directcouplinganalysis',
+            name='couplings',
+        ),
+        migrations.RemoveField(
+            model_name='directcouplinganalysis',
+            name='local_fields',
+        ),
+    ]
@@ -1,7 +1,10 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
 import celery
+import io
+import numpy as np
 from functools import partial
 
 from .modelutils import (
@@ -10,6 +13,9 @@ from .modelutils import (
     get_random_uuid,
     get_future_date,
 )
+from .ProSSpeC.calculate_Hamiltonian import potts_tables_from_dca
+from .ProSSpeC.coupling_store import CouplingStore, write_coupling_store
+from .ProSSpeC.parameter_store import get_dca_model_cache
 
 
 class CeleryTaskMeta(models.Model):
@@ -22,11 +28,11 @@ class CeleryTaskMeta(models.Model):
     percent = models.FloatField(default=0)
     successful = models.BooleanField(default=False)
 
-    def wait_for_completion(self):
+    def wait_for_completion(self, timeout=None):
         if self.successful:
             return
         result = celery.current_app.AsyncResult(str(self.id))
-        result.get(disable_sync_subtasks=False)  # Not recommended! Not sure a better way...
+        result.get(timeout=timeout, disable_sync_subtasks=False)  # Not recommended! Not sure a better way...
 
 
 class APITaskMeta(CeleryTaskMeta):
@@ -83,14 +89,117 @@ class MultipleSequenceAlignment(APIDataObject):
     depth = models.IntegerField(default=0)
     cols = models.IntegerField(default=0)
     quality = models.IntegerField(choices=Qualities, default=Qualities.NA)
+    # Hash of the normalized seed and search parameters, shared by MSAs from identical searches
+    search_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    # Redundancy reduction and subsampling: their parameters, the depth before them and the rows of the filtered hits that were kept
+    perc_identity = models.FloatField(null=True)
+    max_depth = models.IntegerField(null=True)
+    subsample_seed = models.IntegerField(null=True)
+    unreduced_depth = models.IntegerField(null=True)
+    kept_rows = NdarrayField(null=True)
+
+
+# Marks the MSA search running for a search key, so identical requests wait for it instead of searching too
+class MsaSearchClaim(models.Model):
+    search_key = models.CharField(max_length=64, primary_key=True)
+    task_id = models.UUIDField()
+    claimed = models.DateTimeField(auto_now_add=True)
 
 
 class DirectCouplingAnalysis(APIDataObject):
+    class Precisions(models.TextChoices):
+        FLOAT64 = "float64"
+        FLOAT32 = "float32"
+
+    class Engines(models.TextChoices):
+        MEAN_FIELD = "mean_field"
+        PLM = "plm"
+
     msa = models.ForeignKey(MultipleSequenceAlignment, on_delete=models.SET_NULL, null=True)
     e_ij = NdarrayField(null=True)
     h_i = NdarrayField(null=True)
     ranked_di = NdarrayField(null=True)
     m_eff = models.IntegerField(null=True)
+    # Weight of each fitted sequence, reused by later DCAs of the same MSA rows and columns with the same theta
+    weights = NdarrayField(null=True)
+    # DCA method (see dcautils.DCA_ENGINES) and floating point type the couplings were fitted with.
+    # ranked_di holds direct information for mean_field and APC-corrected coupling norms for plm.
+    engine = models.CharField(max_length=10, choices=Engines, default=Engines.MEAN_FIELD)
+    precision = models.CharField(max_length=7, choices=Precisions, default=Precisions.FLOAT64)
+    # Sequence reweighting threshold, and for DCAs of a theta sweep the id of the sweep's task (also the id of its first DCA)
+    theta = models.FloatField(null=True)
+    sweep = models.UUIDField(null=True, db_index=True)
+    # Set when the MSA was subsampled before fitting: the depth limit, random seed and the MSA rows fitted on
+    max_depth = models.IntegerField(null=True)
+    subsample_seed = models.IntegerField(null=True)
+    msa_rows = NdarrayField(null=True)
+    # Set when gappy columns were trimmed before fitting: the parameter position of each MSA column, -1 if trimmed.
+    # ranked_di is stored with the original MSA positions.
+    perc_max_col_gaps = models.FloatField(null=True)
+    column_map = NdarrayField(null=True)
+    # Set for DCAs fitted in overlapping windows: the [start, stop) parameter positions of each window.
+    # Only pairs within a window have a DI and couplings.
+    windows = NdarrayField(null=True)
+    # Potts parameters: the norm of every coupling block, the local fields and the blocks of the strongest pairs
+    # (see ProSSpeC.coupling_store)
+    coupling_store = models.FileField(
+        upload_to=partial(get_user_spesific_path, subfolder="dca", suffix=".dcac"),
+        null=True,
+    )
+
+    def save_potts_parameters(self, couplings, local_fields, length, top_k=None, max_bytes=None):
+        """
+        Store the couplings and local fields of a DCA fit as a float32 coupling store, keeping the blocks of
+        the `top_k` strongest pairs within `max_bytes` (all pairs by default). See potts_tables_from_dca for the
+        accepted layouts.
+        """
+        tables = potts_tables_from_dca(couplings, local_fields, length, dtype=np.float32)
+        self.save_coupling_store(*tables, top_k=top_k, max_bytes=max_bytes)
+
+    def save_coupling_store(self, couplings, local_fields, **options):
+        """
+        Store Potts parameters already in the ProSSpeC table layout. See write_coupling_store for the options.
+        """
+        bytes_io = io.BytesIO()
+        write_coupling_store(bytes_io, couplings, local_fields, **options)
+        self.coupling_store.save(f"{self.id}_couplings", ContentFile(bytes_io.getvalue()), save=False)
+
+    def get_coupling_store(self):
+        if not self.coupling_store:
+            raise ValueError("This DCA has no coupling store.")
+        return CouplingStore(self.coupling_store.path)
+
+    def get_potts_model(self):
+        """
+        Memory-mapped PottsModel of the stored parameters, cached per process. Pairs whose couplings were
+        not kept have zero couplings.
+        """
+        create = lambda: self.get_coupling_store().potts_model(column_map=self.column_map)
+        return get_dca_model_cache().get_or_create(str(self.id), create)
+
+
+class SequenceLibrary(APIDataObject):
+    name = models.CharField(max_length=200)
+    fasta = models.FileField(
+        upload_to=partial(get_user_spesific_path, subfolder="libraries", suffix=".fasta")
+    )
+
+
+class HamiltonianScores(APIDataObject):
+    class OutputFormats(models.TextChoices):
+        CSV = "csv"
+        NPZ = "npz"
+
+    library = models.ForeignKey(SequenceLibrary, on_delete=models.SET_NULL, null=True)
+    dca = models.ForeignKey(DirectCouplingAnalysis, on_delete=models.SET_NULL, null=True)
+    project_id = models.CharField(max_length=200, blank=True)
+    output_format = models.CharField(max_length=3, choices=OutputFormats, default=OutputFormats.CSV)
+    # csv of (header, pottsH) rows, or a npz of headers and pottsH arrays in library order
+    scores = models.FileField(
+        upload_to=partial(get_user_spesific_path, subfolder="hamiltonian"),
+        null=True,
+    )
+    count = models.IntegerField(default=0)
 
 
 class MappedDi(APIDataObject):
@@ -98,6 +207,10 @@ class MappedDi(APIDataObject):
     seed = models.ForeignKey(SeedSequence, on_delete=models.CASCADE)
     dca = models.ForeignKey(DirectCouplingAnalysis, on_delete=models.CASCADE)
     mapped_di = NdarrayField()
+    chain1 = models.CharField(max_length=10, blank=True)
+    chain2 = models.CharField(max_length=10, blank=True)
+    # For the targets of a batch mapping, the id of the batch's task (also the id of the first target's MappedDi)
+    batch = models.UUIDField(null=True, db_index=True)
 
 
 class StructureContacts(APIDataObject):
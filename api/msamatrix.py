@@ -0,0 +1,311 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+import io
+import os
+
+import numpy as np
+import numpy.typing as npt
+
+GAP = ord("-")
+
+# Potts states in the order used by ProSSpeC. Characters outside it, like X, are read as gaps.
+STATES = "-ACDEFGHIKLMNPQRSTVWY"
+_STATE_LOOKUP = np.zeros(256, dtype=np.uint8)
+for _state, _char in enumerate(STATES):
+    _STATE_LOOKUP[ord(_char)] = _state
+
+# Insert positions in afa output: lowercase residues and "." gaps
+_INSERT_LOOKUP = np.zeros(256, dtype=bool)
+_INSERT_LOOKUP[ord(".")] = True
+_INSERT_LOOKUP[ord("a"):ord("z") + 1] = True
+
+
+class MSAMatrix:
+    """
+    Multiple sequence alignment held as a ``(depth, cols)`` uint8 matrix of residue characters and a list of headers.
+
+    Parameters
+    ----------
+    headers : list of str
+        Header of each row, without the leading ``">"``.
+    residues : numpy.ndarray
+        ``(depth, cols)`` uint8 matrix of the ASCII characters of each aligned row.
+    """
+    def __init__(self, headers: list[str], residues: npt.NDArray[np.uint8]):
+        if len(headers) != residues.shape[0]:
+            raise ValueError(f"{len(headers)} headers for {residues.shape[0]} rows")
+        self.headers = headers
+        self.residues = residues
+
+    @staticmethod
+    def load_from_file(msa_source: Union[str, Path, io.IOBase]) -> "MSAMatrix":
+        """
+        Load an MSA in aligned FASTA (``.afa``) format, with sequences on one or several lines.
+
+        Parameters
+        ----------
+        msa_source : str or pathlib.Path or io.BytesIO or io.TextIOBase
+            Filepath, or in-memory bytes or text stream, of the MSA. Streams are read from the beginning.
+
+        Returns
+        -------
+        MSAMatrix
+            The MSA, including insert positions. See remove_inserts.
+        """
+        if isinstance(msa_source, (str, Path)):
+            with open(msa_source, "rb") as fs:
+                data = fs.read()
+        elif isinstance(msa_source, io.BytesIO):
+            data = msa_source.getvalue()
+        elif isinstance(msa_source, io.TextIOBase):
+            msa_source.seek(0)
+            data = msa_source.read().encode()
+        else:
+            raise TypeError("msa_source is not bytesIO, a TextIO, or a filepath.")
+
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        headers = []
+        sequences = []
+        for entry in data.split(b">")[1:]:
+            header, _, rest = entry.partition(b"\n")
+            headers.append(header.decode())
+            sequences.append(rest.replace(b"\n", b""))
+
+        cols = len(sequences[0]) if sequences else 0
+        if any(len(sequence) != cols for sequence in sequences):
+            raise ValueError("Sequences of the MSA do not all have the same length.")
+        residues = np.frombuffer(b"".join(sequences), dtype=np.uint8).reshape(len(sequences), cols)
+        return MSAMatrix(headers, residues)
+
+    @property
+    def depth(self) -> int:
+        return self.residues.shape[0]
+
+    @property
+    def cols(self) -> int:
+        return self.residues.shape[1]
+
+    def __len__(self) -> int:
+        return self.depth
+
+    def select_rows(self, rows: npt.NDArray) -> "MSAMatrix":
+        """
+        Sub-alignment of the rows given by a boolean mask or an array of indices.
+        """
+        rows = np.flatnonzero(rows) if rows.dtype == bool else np.asarray(rows)
+        return MSAMatrix([self.headers[i] for i in rows], self.residues[rows])
+
+    def select_columns(self, columns: npt.NDArray) -> "MSAMatrix":
+        """
+        Sub-alignment of the columns given by a boolean mask or an array of indices.
+        """
+        return MSAMatrix(self.headers, np.ascontiguousarray(self.residues[:, columns]))
+
+    def remove_inserts(self) -> "MSAMatrix":
+        """
+        Remove insert positions (``"."`` and lowercase letters), as MSATools.filter_by_continuous_gaps does.
+
+        Raises
+        ------
+        ValueError
+            If rows are left with different lengths, i.e. the inserts are not aligned in columns.
+        """
+        inserts = _INSERT_LOOKUP[self.residues]
+        if self.depth and np.array_equal(inserts, np.broadcast_to(inserts[0], inserts.shape)):
+            # Inserts of searched alignments occupy whole columns
+            return self.select_columns(~inserts[0]) if inserts[0].any() else self
+        n_inserts = inserts.sum(axis=1)
+        if self.depth and np.any(n_inserts != n_inserts[0]):
+            raise ValueError("Insert positions are not aligned across the MSA.")
+        cols = self.cols - (int(n_inserts[0]) if self.depth else 0)
+        return MSAMatrix(self.headers, self.residues[~inserts].reshape(self.depth, cols))
+
+    def gaps(self) -> npt.NDArray[np.bool_]:
+        return self.residues == GAP
+
+    def max_continuous_gaps(self) -> npt.NDArray[np.int64]:
+        """
+        Length of the longest run of ``"-"`` in each row.
+        """
+        # Pad every row with a non-gap so runs end within their row, then find run bounds in the flattened matrix
+        padded = np.zeros((self.depth, self.cols + 2), dtype=np.int8)
+        padded[:, 1:-1] = self.gaps()
+        edges = np.diff(padded.ravel())
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        longest = np.zeros(self.depth, dtype=np.int64)
+        if len(starts):
+            lengths = ends - starts
+            rows = starts // (self.cols + 2)
+            first_run = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            longest[rows[first_run]] = np.maximum.reduceat(lengths, first_run)
+        return longest
+
+    def row_gap_fraction(self) -> npt.NDArray[np.float64]:
+        """
+        Fraction of ``"-"`` in each row.
+        """
+        return self.gaps().mean(axis=1) if self.cols else np.zeros(self.depth)
+
+    def column_gap_fraction(self) -> npt.NDArray[np.float64]:
+        """
+        Fraction of ``"-"`` in each column.
+        """
+        return self.gaps().mean(axis=0) if self.depth else np.zeros(self.cols)
+
+    def filter_by_continuous_gaps(self, max_gaps: Optional[int] = None) -> "MSAMatrix":
+        """
+        Keep the rows whose longest run of gaps is at most `max_gaps`, or every row if it is None.
+        """
+        if max_gaps is None:
+            return self
+        return self.select_rows(self.max_continuous_gaps() <= max_gaps)
+
+    def filter_rows_by_gap_fraction(self, max_fraction: float) -> "MSAMatrix":
+        """
+        Keep the rows with at most `max_fraction` gaps.
+        """
+        return self.select_rows(self.row_gap_fraction() <= max_fraction)
+
+    def filter_columns_by_gap_fraction(self, max_fraction: float) -> tuple["MSAMatrix", npt.NDArray[np.int64]]:
+        """
+        Keep the columns with at most `max_fraction` gaps.
+
+        Returns
+        -------
+        tuple of (MSAMatrix, numpy.ndarray)
+            The filtered MSA and the 0-based indices of the kept columns in this MSA.
+        """
+        kept = np.flatnonzero(self.column_gap_fraction() <= max_fraction)
+        return self.select_columns(kept), kept
+
+    def encode(self) -> npt.NDArray[np.uint8]:
+        """
+        ``(depth, cols)`` matrix of the states of each residue, indexed as in ``STATES``.
+        """
+        return _STATE_LOOKUP[self.residues]
+
+    def cluster_by_identity(self, identity: float, block_size: int = 1024, workers: Optional[int] = None) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        """
+        Greedy clustering of the rows by sequence identity, in row order.
+
+        A row becomes the representative of a new cluster unless it shares at least `identity` of its positions (gaps included) with an earlier representative,
+        in which case it joins the cluster of the most similar one. Identities are computed as one-hot matrix products between blocks of `block_size` rows and
+        chunks of the representatives, with the chunks spread over a pool of threads.
+
+        Parameters
+        ----------
+        identity : float
+            Fraction of identical positions, between 0 and 1, above which two rows are redundant.
+        block_size : int
+            Number of rows compared at once.
+        workers : int, optional
+            Number of threads. Defaults to the number of CPUs.
+
+        Returns
+        -------
+        tuple of (numpy.ndarray, numpy.ndarray)
+            Indices of the representatives, in increasing order, and the index of the representative of each row.
+        """
+        # Imported here as dcautils reads STATES from this module
+        from .dcautils import one_hot
+
+        codes = self.encode()
+        depth, cols = codes.shape
+        labels = np.arange(depth)
+        if depth == 0 or cols == 0:
+            return labels, labels
+        # Rows match if they have at least this many identical positions
+        min_matches = np.ceil(identity * cols - 1e-9)
+
+        def best_matches(block, chunk):
+            # Best identity of each block row against a chunk of representatives, and which one it is
+            matches = block @ one_hot(codes[chunk]).T
+            best = matches.argmax(axis=1)
+            return matches[np.arange(len(block)), best], chunk[best]
+
+        representatives = np.zeros(0, dtype=np.int64)
+        chunk_size = max(block_size, 1)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for start in range(0, depth, block_size):
+                rows = np.arange(start, min(start + block_size, depth))
+                block = one_hot(codes[rows])
+                best_score = np.full(len(rows), -1.0)
+                best_rep = np.full(len(rows), -1)
+                chunks = [representatives[i:i + chunk_size] for i in range(0, len(representatives), chunk_size)]
+                for score, rep in executor.map(lambda chunk: best_matches(block, chunk), chunks):
+                    better = score > best_score
+                    best_score[better] = score[better]
+                    best_rep[better] = rep[better]
+
+                # Rows left unassigned are clustered greedily among themselves
+                open_rows = np.flatnonzero(best_score < min_matches)
+                within = block[open_rows] @ block[open_rows].T
+                new_reps = []
+                for k, row in enumerate(open_rows):
+                    if new_reps:
+                        scores = within[k, new_reps]
+                        best = int(scores.argmax())
+                        if scores[best] >= min_matches:
+                            best_rep[row] = rows[open_rows[new_reps[best]]]
+                            continue
+                    new_reps.append(k)
+                    best_rep[row] = rows[row]
+
+                labels[rows] = best_rep
+                representatives = np.concatenate([representatives, rows[open_rows[new_reps]]])
+        return representatives, labels
+
+    def stratified_subsample(self, max_depth: int, identity: float = 0.8, seed: int = 0, workers: Optional[int] = None) -> npt.NDArray[np.int64]:
+        """
+        Rows of a subsample of at most `max_depth` rows, drawn evenly across the identity clusters of the MSA.
+
+        Rows are clustered with cluster_by_identity, the clusters the mean-field DCA sequence weights are computed over, and taken round-robin: one random row of
+        every cluster, then a second random row of every cluster with more than one, and so on. Small clusters are kept whole first, so the effective number
+        of sequences drops as little as possible.
+
+        Parameters
+        ----------
+        max_depth : int
+            Maximum number of rows kept.
+        identity : float
+            Identity threshold of the clusters, ``1 - theta`` of the DCA sequence weights.
+        seed : int
+            Seed of the random order within clusters. The same seed gives the same subsample.
+        workers : int, optional
+            Number of threads used for clustering.
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the kept rows, in increasing order. Every row is kept if the MSA has at most `max_depth` rows.
+        """
+        if self.depth <= max_depth:
+            return np.arange(self.depth)
+        _, labels = self.cluster_by_identity(identity, workers=workers)
+        priority = np.random.default_rng(seed).random(self.depth)
+        # Rank of each row within its cluster, in random order
+        order = np.lexsort((priority, labels))
+        sorted_labels = labels[order]
+        cluster_start = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        cluster_sizes = np.diff(np.r_[cluster_start, self.depth])
+        rank = np.empty(self.depth, dtype=np.int64)
+        rank[order] = np.arange(self.depth) - np.repeat(cluster_start, cluster_sizes)
+        return np.sort(np.lexsort((priority, rank))[:max_depth])
+
+    def sequences(self) -> list[str]:
+        return [row.tobytes().decode() for row in self.residues]
+
+    def write(self, destination: Union[str, Path, io.TextIOBase]) -> None:
+        """
+        Write the MSA in FASTA format, each header followed by its sequence on a single line.
+        """
+        lines = (f">{header}\n{row.tobytes().decode()}\n" for header, row in zip(self.headers, self.residues))
+        if isinstance(destination, (str, Path)):
+            with open(destination, "w") as fs:
+                fs.writelines(lines)
+        elif isinstance(destination, io.TextIOBase) and destination.writable():
+            destination.writelines(lines)
+        else:
+            raise TypeError(f"Destination supplied is either not a filepath or is not a writeable TextIO object (got {type(destination).__name__}).")
@@ -1,31 +1,34 @@
-from typing import Optional, Union
+from typing import Iterable, Iterator, Optional, Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from numpy import percentile
+import numpy as np
 import numpy.typing as npt
+import hashlib
+import itertools
 import io
+import json
 import os
+import tempfile
 import re
-from dcatoolkit import DirectInformationData, ResidueAlignment, StructureInformation
+from dcatoolkit import DirectInformationData, Pairs, ResidueAlignment
 from dcatoolkit import MSATools
-from pyhmmer.plan7 import Background, HMM, Profile, OptimizedProfile, HMMFile, Pipeline, Builder
-from pyhmmer.easel import MSA, TextMSA, MSAFile, Alphabet, TextSequence, SequenceFile
+import pyhmmer
+from pyhmmer.plan7 import Background, HMM, Profile, OptimizedProfile, HMMFile, Pipeline, Builder, TopHits
+from pyhmmer.easel import MSA, TextMSA, MSAFile, Alphabet, TextSequence, SequenceFile, DigitalSequence, DigitalSequenceBlock
 from pyhmmer.hmmer import hmmalign, hmmscan
+from .cacheutils import LRUCache
+from .msamatrix import MSAMatrix
+from .structureutils import fetch_structure
 
-def generate_hmm_and_profiles(seed_sequence_filepath: str, seed_name: str) -> tuple[Background, HMM, Profile, OptimizedProfile]:
-    """
-    Generate the background, the HMM, the HMM Profile, and a Pyhmmer Optimized HMM Profile from the seed sequence and name supplied.
+# Options passed to pyhmmer's Builder. They are part of the HMM cache key, so changing them invalidates cached HMMs.
+HMM_BUILDER_OPTIONS: dict = {}
 
-    Parameters
-    ----------
-    seed_sequence_filepath : str
-        Filepath of the seed sequence used to generate the HMM.
-    seed_name : str
-        The name of the seed supplied. Used to label the seed sequence in its aligned format.
+# Sequence length the Builder configures its profiles for
+_BUILDER_PROFILE_LENGTH = 200
 
-    Returns
-    -------
-    tuple[pyhmmer.plan7.Background, pyhmmer.plan7.HMM, pyhmmer.plan7.Profile, pyhmmer.plan7.OptimizedProfile]
-        Background, HMM, Profile, and OptimizedProfile. The background is characterized by the amino acid alphabet. The HMM and Profiles are built from pyhmmer.plan7.Builder.build_msa()
-    """
+
+def _build_hmm(seed_sequence_filepath: str, seed_name: str) -> tuple[Background, HMM, Profile, OptimizedProfile]:
     aa_alphabet = Alphabet.amino()
     seed_MSA_fname = seed_sequence_filepath
     
@@ -37,7 +40,7 @@ def generate_hmm_and_profiles(seed_sequence_filepath: str, seed_name: str) -> tu
             raise TypeError("The seed sequence(s) provided are not in the format of a text MSA")
         # Must convert to a digital MSA according to https://pyhmmer.readthedocs.io/en/stable/examples/msa_to_hmm.html
         loaded_seed_digital = loaded_seed_text.digitize(alphabet=aa_alphabet)
-        builder = Builder(alphabet=aa_alphabet)
+        builder = Builder(alphabet=aa_alphabet, **HMM_BUILDER_OPTIONS)
         background = Background(alphabet=aa_alphabet)
         loaded_seed_digital.name = f"{seed_name}_MSA".encode()
         hmm, profile, optimized_profile = builder.build_msa(loaded_seed_digital, background)
@@ -45,9 +48,95 @@ def generate_hmm_and_profiles(seed_sequence_filepath: str, seed_name: str) -> tu
     raise ValueError("Invalid hmm data produced.")
 
 
-def hmmsearch_from_seed(seed_sequence_filepath: str, seed_name: str, E: Optional[float], T: Optional[float] = None, database_path: str="/mfs/io/groups/morcos/uniprot_db/uniprot_sprot_trembl.fasta") -> TextMSA:
+class HMMCache:
     """
-    Generates an HMM and associated files needed and produces an MSA using hmmsearch functionality.
+    Content-addressed cache of the HMMs built from seed alignments.
+
+    HMMs are keyed by a hash of the seed file contents, the seed name and the builder options. They are
+    written to `cache_dir` in binary HMMER format and the built background, HMM and profiles are kept in a
+    per-process LRU of `max_entries`, so a seed is only built once and later calls skip the build entirely.
+
+    Parameters
+    ----------
+    cache_dir : str or pathlib.Path, optional
+        Directory the serialized HMMs are written to. Without it only the in-memory LRU is used.
+    max_entries : int
+        Number of HMMs kept in memory.
+    """
+    def __init__(self, cache_dir=None, max_entries=128):
+        self.cache_dir = cache_dir
+        self.memory = LRUCache(max_entries)
+
+    @staticmethod
+    def key(seed_sequence_filepath: str, seed_name: str) -> str:
+        digest = hashlib.sha256()
+        with open(seed_sequence_filepath, "rb") as fs:
+            for chunk in iter(lambda: fs.read(1 << 20), b""):
+                digest.update(chunk)
+        params = {"seed_name": seed_name, "builder": HMM_BUILDER_OPTIONS, "pyhmmer": pyhmmer.__version__}
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.h3m")
+
+    def _read(self, key: str) -> Optional[tuple[Background, HMM, Profile, OptimizedProfile]]:
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        aa_alphabet = Alphabet.amino()
+        with HMMFile(self._path(key)) as hmm_file:
+            hmm = hmm_file.read()
+        background = Background(alphabet=aa_alphabet)
+        profile = Profile(hmm.M, aa_alphabet)
+        profile.configure(hmm, background, L=_BUILDER_PROFILE_LENGTH)
+        return background, hmm, profile, profile.to_optimized()
+
+    def _write(self, key: str, hmm: HMM) -> None:
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fs:
+                hmm.write(fs, binary=True)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, seed_sequence_filepath: str, seed_name: str) -> tuple[Background, HMM, Profile, OptimizedProfile]:
+        """
+        Get copies of the background, HMM and profiles of a seed, building and caching them if needed.
+        """
+        key = self.key(seed_sequence_filepath, seed_name)
+        built = self.memory.get(key)
+        if built is None:
+            built = self._read(key)
+            if built is None:
+                built = _build_hmm(seed_sequence_filepath, seed_name)
+                self._write(key, built[1])
+            self.memory.put(key, built)
+        return tuple(obj.copy() for obj in built)
+
+
+_hmm_cache = None
+
+
+def get_hmm_cache() -> HMMCache:
+    global _hmm_cache
+    if _hmm_cache is None:
+        from django.conf import settings
+        if settings.configured:
+            _hmm_cache = HMMCache(getattr(settings, "HMM_CACHE_DIR", None), getattr(settings, "HMM_CACHE_ENTRIES", 128))
+        else:
+            _hmm_cache = HMMCache()
+    return _hmm_cache
+
+
+def generate_hmm_and_profiles(seed_sequence_filepath: str, seed_name: str) -> tuple[Background, HMM, Profile, OptimizedProfile]:
+    """
+    Generate the background, the HMM, the HMM Profile, and a Pyhmmer Optimized HMM Profile from the seed sequence and name supplied.
+    Results are cached by seed contents, see HMMCache.
 
     Parameters
     ----------
@@ -55,27 +144,282 @@ def hmmsearch_from_seed(seed_sequence_filepath: str, seed_name: str, E: Optional
         Filepath of the seed sequence used to generate the HMM.
     seed_name : str
         The name of the seed supplied. Used to label the seed sequence in its aligned format.
-    T : float, optional
-        The bit score value target sequences must meet. See hmmsearch from Eddy's lab and search_hmm from pyhmmer.
-    database_path:
-        Filepath of the full sequence database that the profile produced is searched against.
-    
+
     Returns
     -------
-    pyhmmer.easel.TextMSA
-        TextMSA representation of hits found via hmmsearch of HMM against the sequence database specified.
+    tuple[pyhmmer.plan7.Background, pyhmmer.plan7.HMM, pyhmmer.plan7.Profile, pyhmmer.plan7.OptimizedProfile]
+        Background, HMM, Profile, and OptimizedProfile. The background is characterized by the amino acid alphabet. The HMM and Profiles are built from pyhmmer.plan7.Builder.build_msa()
+    """
+    return get_hmm_cache().get(seed_sequence_filepath, seed_name)
+
+
+# Pre-digitized sequence databases loaded in this process, keyed by the FASTA filepath they were prepared from.
+_sequence_databases: dict[str, DigitalSequenceBlock] = {}
+
+_DATABASE_ARRAYS = {
+    "residues": np.uint8,
+    "sequence_offsets": np.int64,
+    "names": np.uint8,
+    "name_offsets": np.int64,
+    "descriptions": np.uint8,
+    "description_offsets": np.int64,
+}
+
+
+def _as_bytes(value: Union[str, bytes]) -> bytes:
+    return value.encode() if isinstance(value, str) else value
+
+
+def _file_signature(filepath: str) -> list[int]:
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def prepare_sequence_database(database_path: str, output_dir: str, batch_size: int = 100000) -> int:
+    """
+    Digitizes a FASTA sequence database once and writes it as flat binary arrays that can be memory-mapped.
+
+    Parameters
+    ----------
+    database_path : str
+        Filepath of the FASTA sequence database.
+    output_dir : str
+        Directory to write the digitized database to. Holds one raw array per entry of ``_DATABASE_ARRAYS``
+        (residues, names and descriptions concatenated, with offsets delimiting each sequence) and ``meta.json``.
+    batch_size : int
+        Number of sequences digitized at once.
+
+    Returns
+    -------
+    int
+        Number of sequences written.
     """
     aa_alphabet = Alphabet.amino()
-    background, hmm, _, _ = generate_hmm_and_profiles(seed_sequence_filepath, seed_name)
+    os.makedirs(output_dir, exist_ok=True)
+    # meta.json marks a complete database, so it is only written back once every array is
+    meta_path = os.path.join(output_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    files = {name: open(os.path.join(output_dir, f"{name}.bin"), "wb") for name in _DATABASE_ARRAYS}
+    totals = {"residues": 0, "names": 0, "descriptions": 0}
+    count = 0
+    try:
+        for offsets in ("sequence_offsets", "name_offsets", "description_offsets"):
+            files[offsets].write(np.int64(0).tobytes())
+        with SequenceFile(database_path, digital=True, alphabet=aa_alphabet) as seq_file:
+            while block := seq_file.read_block(sequences=batch_size):
+                for sequence in block:
+                    for name, offsets, data in (
+                        ("residues", "sequence_offsets", np.asarray(sequence.sequence, dtype=np.uint8).tobytes()),
+                        ("names", "name_offsets", _as_bytes(sequence.name)),
+                        ("descriptions", "description_offsets", _as_bytes(sequence.description)),
+                    ):
+                        files[name].write(data)
+                        totals[name] += len(data)
+                        files[offsets].write(np.int64(totals[name]).tobytes())
+                count += len(block)
+    finally:
+        for fs in files.values():
+            fs.close()
+    with open(meta_path, "w") as fs:
+        json.dump({"count": count, "source": _file_signature(database_path)}, fs)
+    return count
+
+
+def load_sequence_database(digitized_dir: str) -> DigitalSequenceBlock:
+    """
+    Loads a database written by prepare_sequence_database into a DigitalSequenceBlock. The arrays are read through memory maps, but the block holds its own copy of every sequence, so a process that loads it holds the whole database in memory.
+
+    Parameters
+    ----------
+    digitized_dir : str
+        Directory written by prepare_sequence_database.
+
+    Returns
+    -------
+    pyhmmer.easel.DigitalSequenceBlock
+        The database sequences, in FASTA order.
+    """
+    aa_alphabet = Alphabet.amino()
+    arrays = {
+        name: np.memmap(os.path.join(digitized_dir, f"{name}.bin"), dtype=dtype, mode="r")
+        for name, dtype in _DATABASE_ARRAYS.items()
+    }
+    residues, names, descriptions = arrays["residues"], arrays["names"], arrays["descriptions"]
+    seq_offsets, name_offsets, desc_offsets = arrays["sequence_offsets"], arrays["name_offsets"], arrays["description_offsets"]
+    return DigitalSequenceBlock(aa_alphabet, (
+        DigitalSequence(
+            aa_alphabet,
+            name=names[name_offsets[i]:name_offsets[i + 1]].tobytes(),
+            description=descriptions[desc_offsets[i]:desc_offsets[i + 1]].tobytes(),
+            sequence=residues[seq_offsets[i]:seq_offsets[i + 1]],
+        )
+        for i in range(len(seq_offsets) - 1)
+    ))
+
+
+def is_sequence_database_current(database_path: str, digitized_dir: str) -> bool:
+    """
+    True if the digitized database exists and was prepared from the current FASTA database (or the FASTA is no longer present).
+    """
+    meta_path = os.path.join(digitized_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    if not os.path.exists(database_path):
+        return True
+    with open(meta_path) as fs:
+        return json.load(fs)["source"] == _file_signature(database_path)
+
+
+def sequence_database_size(digitized_dir: str) -> int:
+    """
+    Number of sequences in a database written by prepare_sequence_database.
+    """
+    with open(os.path.join(digitized_dir, "meta.json")) as fs:
+        return json.load(fs)["count"]
+
+
+def preload_sequence_database(database_path: str, digitized_dir: str) -> Optional[DigitalSequenceBlock]:
+    """
+    Loads the digitized form of a FASTA database into this process so hmmsearch_from_seed searches it instead of re-reading the FASTA.
+
+    Parameters
+    ----------
+    database_path : str
+        Filepath of the FASTA database that hmmsearch_from_seed is called with.
+    digitized_dir : str
+        Directory written by prepare_sequence_database from that FASTA.
+
+    Returns
+    -------
+    pyhmmer.easel.DigitalSequenceBlock or None
+        The loaded sequences, or None if the digitized database is missing or out of date.
+    """
+    if not is_sequence_database_current(str(database_path), str(digitized_dir)):
+        return None
+    sequences = load_sequence_database(str(digitized_dir))
+    _sequence_databases[str(database_path)] = sequences
+    return sequences
+
+
+def msa_search_key(seed: str, E: Optional[float], T: Optional[float], perc_max_gaps: Optional[float], database_version: str, **options) -> str:
+    """
+    Content address of an MSA search. Seeds differing only in case or whitespace produce the same key.
+
+    Parameters
+    ----------
+    seed : str
+        Seed sequence searched with.
+    E, T : float, optional
+        Reporting thresholds, as in hmmsearch_from_seed.
+    perc_max_gaps : float, optional
+        Gap filter applied to the hits, as in filter_by_consecutive_gaps.
+    database_version : str
+        Identifies the contents of the searched database, see sequence_database_version.
+    **options
+        Other processing parameters of the MSA. Options set to None are left out, so adding one keeps existing keys valid.
+
+    Returns
+    -------
+    str
+        Hex sha256 digest.
+    """
+    params = {
+        "seed": "".join(seed.split()).upper(),
+        "E": E,
+        "T": T,
+        "perc_max_gaps": perc_max_gaps,
+        "database": database_version,
+    }
+    params.update((name, value) for name, value in options.items() if value is not None)
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def sequence_database_version(database_path: str) -> str:
+    """
+    Version string of a FASTA database from its size and modification time.
+    """
+    size, mtime_ns = _file_signature(database_path) if os.path.exists(database_path) else (0, 0)
+    return f"{os.path.basename(database_path)}:{size}:{mtime_ns}"
+
+
+def get_sequence_database(database_path: str) -> Optional[DigitalSequenceBlock]:
+    """
+    The sequences of a database preloaded in this process with preload_sequence_database, or None.
+    """
+    return _sequence_databases.get(str(database_path))
+
+
+def _pipeline_options(E: Optional[float], T: Optional[float]) -> dict:
     if E:
-        pipeline = Pipeline(alphabet=aa_alphabet, background=background, E=E)
+        return {"E": E}
     elif T:
-        pipeline = Pipeline(alphabet=aa_alphabet, background=background, T=T)
+        return {"T": T}
+    return {}
+
+
+def iter_sequence_shards(database_path: str, shard_size: int) -> Iterator[DigitalSequenceBlock]:
+    """
+    Splits a sequence database into consecutive blocks of at most `shard_size` sequences, slicing the preloaded database if there is one and reading the FASTA otherwise.
+    """
+    aa_alphabet = Alphabet.amino()
+    preloaded_sequences = get_sequence_database(database_path)
+    if preloaded_sequences is not None:
+        for start in range(0, len(preloaded_sequences), shard_size):
+            yield preloaded_sequences[start:start + shard_size]
     else:
-        pipeline = Pipeline(alphabet=aa_alphabet, background=background)
-    hits = None
-    with SequenceFile(database_path, digital=True, alphabet=aa_alphabet) as seq_file:
-        hits = pipeline.search_hmm(hmm, seq_file)
+        with SequenceFile(database_path, digital=True, alphabet=aa_alphabet) as seq_file:
+            while block := seq_file.read_block(sequences=shard_size):
+                yield block
+
+
+def search_hmm_shards(hmm: HMM, background: Background, shards: Iterable[DigitalSequenceBlock], cpus: int, E: Optional[float] = None, T: Optional[float] = None) -> TopHits:
+    """
+    Searches an HMM against database shards on a pool of threads and merges the hits.
+
+    Each shard is searched by its own Pipeline with the database size detected from the shard. TopHits.merge then sums the sizes and recomputes E-values and
+    thresholds over the whole database, so the merged hits are the ones a single search over every shard would report.
+
+    Parameters
+    ----------
+    hmm : pyhmmer.plan7.HMM
+        The query HMM.
+    background : pyhmmer.plan7.Background
+        Background the HMM was built with.
+    shards : iterable of pyhmmer.easel.DigitalSequenceBlock
+        Consecutive blocks of the sequence database. At most twice `cpus` shards are held in memory at once.
+    cpus : int
+        Number of shards searched concurrently.
+    E, T : float, optional
+        Reporting thresholds, as in hmmsearch_from_seed.
+
+    Returns
+    -------
+    pyhmmer.plan7.TopHits
+        Merged hits, in database order before sorting.
+    """
+    aa_alphabet = Alphabet.amino()
+    options = _pipeline_options(E, T)
+
+    def search(shard):
+        return Pipeline(alphabet=aa_alphabet, background=background.copy(), **options).search_hmm(hmm, shard)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, cpus)) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(search, shard))
+            if len(pending) >= 2 * max(1, cpus):
+                results.append(pending.popleft().result())
+        results.extend(future.result() for future in pending)
+    return TopHits.merge(*results)
+
+
+def hits_to_text_msa(hits: TopHits) -> TextMSA:
+    """
+    Aligns the included hits of an hmmsearch into a TextMSA, raising ValueError if there are none.
+    """
+    aa_alphabet = Alphabet.amino()
     if hits:
         produced_msa: MSA = hits.to_msa(alphabet=aa_alphabet, digitize=False)
         if isinstance(produced_msa, TextMSA):
@@ -86,6 +430,50 @@ def hmmsearch_from_seed(seed_sequence_filepath: str, seed_name: str, E: Optional
         raise ValueError("No hits found.")
 
 
+def hmmsearch_from_seed(seed_sequence_filepath: str, seed_name: str, E: Optional[float], T: Optional[float] = None, database_path: str="/mfs/io/groups/morcos/uniprot_db/uniprot_sprot_trembl.fasta", cpus: int = 1, shard_size: Optional[int] = None) -> TextMSA:
+    """
+    Generates an HMM and associated files needed and produces an MSA using hmmsearch functionality.
+
+    Parameters
+    ----------
+    seed_sequence_filepath : str
+        Filepath of the seed sequence used to generate the HMM.
+    seed_name : str
+        The name of the seed supplied. Used to label the seed sequence in its aligned format.
+    T : float, optional
+        The bit score value target sequences must meet. See hmmsearch from Eddy's lab and search_hmm from pyhmmer.
+    database_path:
+        Filepath of the full sequence database that the profile produced is searched against.
+    cpus : int
+        Number of threads searching database shards concurrently. With 1 and no `shard_size`, the database is searched in one pass.
+    shard_size : int, optional
+        Number of sequences per shard. Defaults to splitting the preloaded database into `cpus` shards, or 100000 sequences when reading the FASTA.
+    
+    Returns
+    -------
+    pyhmmer.easel.TextMSA
+        TextMSA representation of hits found via hmmsearch of HMM against the sequence database specified.
+    """
+    aa_alphabet = Alphabet.amino()
+    background, hmm, _, _ = generate_hmm_and_profiles(seed_sequence_filepath, seed_name)
+    if cpus > 1 or shard_size:
+        if not shard_size:
+            preloaded_sequences = get_sequence_database(database_path)
+            shard_size = -(-len(preloaded_sequences) // cpus) if preloaded_sequences else 100000
+        hits = search_hmm_shards(hmm, background, iter_sequence_shards(database_path, shard_size), cpus, E=E, T=T)
+        return hits_to_text_msa(hits)
+
+    pipeline = Pipeline(alphabet=aa_alphabet, background=background, **_pipeline_options(E, T))
+    hits = None
+    preloaded_sequences = get_sequence_database(database_path)
+    if preloaded_sequences is not None:
+        hits = pipeline.search_hmm(hmm, preloaded_sequences)
+    else:
+        with SequenceFile(database_path, digital=True, alphabet=aa_alphabet) as seq_file:
+            hits = pipeline.search_hmm(hmm, seq_file)
+    return hits_to_text_msa(hits)
+
+
 def produce_alignment_to_protein(protein_sequence: str, seed_sequence_filepath: str, seed_name: str, protein_name: str) -> ResidueAlignment:
     """
     Produces a ResidueAlignment object that represents the alignment between the MSA generated from an HMM and a specified target protein sequence.
@@ -113,7 +501,52 @@ def produce_alignment_to_protein(protein_sequence: str, seed_sequence_filepath:
     # Queries refers to the protein sequence, which yields the target of the alignment.
     # Profiles refers to the domain's profile HMM generated from the domain / full protein's seed sequence. The same HMM used to generate an MSA.
     best_alignment = hits[0][0].best_domain.alignment
-    return ResidueAlignment(best_alignment.hmm_name.decode(), best_alignment.target_name.decode(), best_alignment.hmm_from, best_alignment.target_from, best_alignment.hmm_sequence, best_alignment.target_sequence)
+    # Names are bytes before pyhmmer 0.11
+    hmm_name, target_name = (name.decode() if isinstance(name, bytes) else name for name in (best_alignment.hmm_name, best_alignment.target_name))
+    return ResidueAlignment(hmm_name, target_name, best_alignment.hmm_from, best_alignment.target_from, best_alignment.hmm_sequence, best_alignment.target_sequence)
+
+
+_alignment_cache = None
+
+
+def get_alignment_cache() -> LRUCache:
+    """
+    Per-process LRU of the ResidueAlignments of protein sequences to seed HMMs, keyed by seed (see HMMCache.key) and sequence.
+    """
+    global _alignment_cache
+    if _alignment_cache is None:
+        from django.conf import settings
+        if settings.configured:
+            _alignment_cache = LRUCache(getattr(settings, "RESIDUE_ALIGNMENT_CACHE_ENTRIES", 256))
+        else:
+            _alignment_cache = LRUCache(256)
+    return _alignment_cache
+
+
+def align_chains(protein_sequences: list[str], seed_sequence_filepath: str, seed_name: str, protein_name: str) -> list[ResidueAlignment]:
+    """
+    ResidueAlignments of several protein sequences, usually structure chains, to the HMM of a seed. See produce_alignment_to_protein.
+
+    Alignments are cached by seed and sequence, so identical chains, e.g. of a homodimer, are aligned once. The HMM is built once and the
+    distinct sequences that are not cached are scanned concurrently. The alignments returned are shared and must not be modified.
+
+    Returns
+    -------
+    list of dcatoolkit.analytics.ResidueAlignment
+        Alignment of each sequence, in the order of `protein_sequences`.
+    """
+    cache = get_alignment_cache()
+    seed_key = get_hmm_cache().key(seed_sequence_filepath, seed_name)
+    alignments = {sequence: cache.get((seed_key, sequence)) for sequence in protein_sequences}
+    missing = [sequence for sequence, alignment in alignments.items() if alignment is None]
+    if missing:
+        # Builds or loads the HMM before the scans share it through the HMM cache
+        generate_hmm_and_profiles(seed_sequence_filepath, seed_name)
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            aligned = executor.map(lambda sequence: produce_alignment_to_protein(sequence, seed_sequence_filepath, seed_name, protein_name), missing)
+            for sequence, alignment in zip(missing, aligned):
+                alignments[sequence] = cache.put((seed_key, sequence), alignment)
+    return [alignments[sequence] for sequence in protein_sequences]
 
 
 def align_sequences_with_hmm(sequences: Union[list[str], str, io.IOBase], 
@@ -210,14 +643,14 @@ def combine_easel_TextMSA(text_msa1: TextMSA, text_msa2: TextMSA):
         print(sequence)
 
 
-def get_mapped_residues(DI_arr: npt.NDArray, rcsb_pdb_id: str, seed_sequence_filepath: str, seed_name: str, protein_name: str, chain1: str, chain2: str, pairs_only: bool=False, auth_chain_id_supplied: bool=False) -> npt.NDArray:
+def get_mapped_residues(DI_arr: Union[npt.NDArray, DirectInformationData], rcsb_pdb_id: str, seed_sequence_filepath: str, seed_name: str, protein_name: str, chain1: str, chain2: str, pairs_only: bool=False, auth_chain_id_supplied: bool=False) -> npt.NDArray:
     """
     Get the residues supplied mapped to the protein structure indexed at the RCSB PDB id supplied. The elements of pairs are mapped to chain1 and chain2 supplied respectively.
 
     Parameters
     ----------
-    DI_arr : numpy.ndarray
-        Array of DI pairs and their values represented as a 3-column ndarray.
+    DI_arr : numpy.ndarray or dcatoolkit.DirectInformationData
+        Array of DI pairs and their values represented as a 3-column ndarray, or already loaded as DirectInformationData.
     rcsb_pdb_id : str
         The PDB ID of the protein structure of interest that will be fetched from RCSB.
     seed_sequence_filepath : str
@@ -240,14 +673,305 @@ def get_mapped_residues(DI_arr: npt.NDArray, rcsb_pdb_id: str, seed_sequence_fil
     mapped_residues : numpy.ndarray
         The residues corresponding to the MSA generated from the HMM profile mapped to the structure supplied.
     """
-    structure = StructureInformation.fetch_pdb(rcsb_pdb_id)
-    res_align = produce_alignment_to_protein(structure.get_non_missing_sequence(chain1, auth_chain_id_supplied=auth_chain_id_supplied), seed_sequence_filepath=seed_sequence_filepath, seed_name=seed_name, protein_name=protein_name)
-    res_align = produce_alignment_to_protein(structure.get_non_missing_sequence(chain2, auth_chain_id_supplied=auth_chain_id_supplied), seed_sequence_filepath=seed_sequence_filepath, seed_name=seed_name, protein_name=protein_name)
-    DI_data = DirectInformationData.load_as_ndarray(DI_arr)
-    mapped_residues = DI_data.get_ranked_mapped_pairs(res_align, res_align, pairs_only=pairs_only)
+    structure = fetch_structure(rcsb_pdb_id)
+    chain_sequences = [structure.get_non_missing_sequence(chain, auth_chain_id_supplied=auth_chain_id_supplied) for chain in (chain1, chain2)]
+    res_align1, res_align2 = align_chains(chain_sequences, seed_sequence_filepath, seed_name, protein_name)
+    DI_data = DI_arr if isinstance(DI_arr, DirectInformationData) else DirectInformationData.load_as_ndarray(DI_arr)
+    mapped_residues = map_ranked_pairs(DI_data, res_align1, res_align2, pairs_only=pairs_only)
     return mapped_residues
 
 
+def residue_lookup(res_align: ResidueAlignment) -> npt.NDArray:
+    """
+    Protein residue of each MSA column (domain index) of a ResidueAlignment as an array indexed by column, -1 for columns that are not mapped.
+    """
+    domain_indices = np.fromiter(res_align.domain_to_protein.keys(), dtype=np.int64, count=len(res_align.domain_to_protein))
+    protein_indices = np.fromiter(res_align.domain_to_protein.values(), dtype=np.int64, count=len(res_align.domain_to_protein))
+    lookup = np.full(domain_indices.max(initial=0) + 1, -1, dtype=np.int64)
+    lookup[domain_indices] = protein_indices
+    return lookup
+
+
+def map_ranked_pairs(DI_data: DirectInformationData, res_align1: ResidueAlignment, res_align2: ResidueAlignment, pairs_only: bool=True, mirror: bool=False, number: Optional[int]=None) -> npt.NDArray:
+    """
+    Same result as DirectInformationData.get_ranked_mapped_pairs, mapping every pair at once through lookup arrays of the ResidueAlignments
+    instead of one pair at a time.
+
+    Pairs within 4 residues of each other and pairs with a residue that is not mapped are dropped, and the others are ranked by
+    decreasing DI (ties by decreasing residues) and mapped.
+    """
+    pairs = DI_data.DI_data
+    residue1, residue2 = pairs["residue1"], pairs["residue2"]
+    lookup1, lookup2 = residue_lookup(res_align1), residue_lookup(res_align2)
+    in_range = (residue1 >= 0) & (residue1 < len(lookup1)) & (residue2 >= 0) & (residue2 < len(lookup2))
+    mapped1 = np.where(in_range, lookup1[np.where(in_range, residue1, 0)], -1)
+    mapped2 = np.where(in_range, lookup2[np.where(in_range, residue2, 0)], -1)
+    kept = np.flatnonzero((np.abs(residue1 - residue2) > 4) & (mapped1 >= 0) & (mapped2 >= 0))
+
+    # Only the kept pairs are ranked. np.sort(order="DI") breaks ties with the other fields in dtype order, reversed for decreasing DI.
+    kept = kept[np.lexsort((residue2[kept], residue1[kept], pairs["DI"][kept]))[::-1]]
+    mapped_pairs = pairs[kept]
+    mapped_pairs["residue1"] = mapped1[kept]
+    mapped_pairs["residue2"] = mapped2[kept]
+    if pairs_only:
+        return Pairs.get_pairs(mapped_pairs[["residue1", "residue2"]], mirror=mirror, number=number)
+    return Pairs.get_pairs(mapped_pairs, mirror=False, number=number)
+
+
+def iter_batch_mapped_residues(DI_arr: npt.NDArray, targets: list[tuple[str, str, str]], seed_sequence_filepath: str, seed_name: str, pairs_only: bool=False, auth_chain_id_supplied: bool=False, max_workers: Optional[int]=None) -> Iterator[tuple[int, npt.NDArray]]:
+    """
+    Map the same DI pairs to several structures and chain pairs, see get_mapped_residues.
+
+    The DI pairs are loaded and the HMM is built once for every target, and structures and chain alignments are shared through their
+    caches. Targets are mapped concurrently by a pool of `max_workers` threads.
+
+    Parameters
+    ----------
+    DI_arr : numpy.ndarray
+        The DI pairs, as in get_mapped_residues.
+    targets : list of tuple of str
+        ``(pdb_id, chain1, chain2)`` of each target. The PDB id is also used as the protein name.
+
+    Yields
+    ------
+    index, mapped_residues : tuple[int, numpy.ndarray]
+        Index of a target in `targets` and its mapped residues, in the order the targets complete.
+
+    Raises
+    ------
+    ValueError
+        If a target cannot be mapped. The remaining targets are cancelled.
+    """
+    DI_data = DirectInformationData.load_as_ndarray(DI_arr)
+    generate_hmm_and_profiles(seed_sequence_filepath, seed_name)
+
+    def map_target(target):
+        pdb_id, chain1, chain2 = target
+        try:
+            return get_mapped_residues(DI_data, pdb_id, seed_sequence_filepath, seed_name, pdb_id, chain1, chain2, pairs_only=pairs_only, auth_chain_id_supplied=auth_chain_id_supplied)
+        except Exception as e:
+            raise ValueError(f"Could not map {pdb_id} chains {chain1} and {chain2}: {e}") from e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(map_target, target): k for k, target in enumerate(targets)}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def iter_fasta_records(fasta_path: str) -> Iterator[tuple[str, str]]:
+    """
+    Stream the records of a FASTA file one at a time.
+
+    Parameters
+    ----------
+    fasta_path : str
+        Filepath of the FASTA file.
+
+    Yields
+    ------
+    header, sequence : tuple[str, str]
+        Header without the leading ">" and the sequence joined onto a single line.
+    """
+    header = None
+    lines: list[str] = []
+    with open(fasta_path) as fs:
+        for line in fs:
+            line = line.strip()
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(lines)
+                header = line[1:]
+                lines = []
+            elif line:
+                lines.append(line)
+    if header is not None:
+        yield header, "".join(lines)
+
+
+def count_fasta_records(fasta_path: str, block_size: int = 1 << 20) -> int:
+    """
+    Count the records of a FASTA file without parsing it.
+
+    Parameters
+    ----------
+    fasta_path : str
+        Filepath of the FASTA file.
+    block_size : int
+        Number of bytes read at once.
+
+    Returns
+    -------
+    int
+        Number of lines starting with ">".
+    """
+    count = 0
+    previous = b"\n"
+    with open(fasta_path, "rb") as fs:
+        while block := fs.read(block_size):
+            count += (previous + block).count(b"\n>")
+            previous = block[-1:]
+    return count
+
+
+def _iter_text_msa_records(msa: TextMSA) -> Iterator[tuple[str, str]]:
+    # Headers as written by TextMSA.write in afa format, paired with aligned rows read one at a time
+    sequences = msa.sequences
+    alignment = msa.alignment
+    for i, name in enumerate(msa.names):
+        name = name.decode() if isinstance(name, bytes) else name
+        description = sequences[i].description
+        description = description.decode() if isinstance(description, bytes) else description
+        yield (f"{name} {description}" if description else name), alignment[i]
+
+
+def postprocess_msa(msa: TextMSA, output_source: Union[str, io.TextIOBase], perc_max_gaps: Optional[float], block_size: int = 4096) -> tuple[int, int]:
+    """
+    Cleans and gap filters the hits of a search in blocks of rows, writing the result and collecting its statistics.
+    Produces the same file as writing the MSA in afa format, filtering it with filter_by_consecutive_gaps and reading it back with get_msa_stats,
+    while holding at most `block_size` rows of the alignment in an MSAMatrix at a time.
+
+    Parameters
+    ----------
+    msa : pyhmmer.easel.TextMSA
+        MSA produced by hmmsearch_from_seed.
+    output_source : str or io.TextIOBase
+        Output filepath or writable text stream for the filtered MSA in FASTA format.
+    perc_max_gaps : float, optional
+        Maximum continuous gaps allowed in a sequence, as a percentage of the alignment length before insert positions are removed. If None, sequences are only cleaned.
+    block_size : int
+        Number of rows filtered at once.
+
+    Returns
+    -------
+    rows, cols : tuple[int, int]
+        Number of rows and number of columns in the filtered MSA.
+    """
+    records = _iter_text_msa_records(msa)
+    rows, cols = 0, 0
+    max_gaps = None
+
+    def write(fs):
+        nonlocal rows, cols, max_gaps
+        while chunk := list(itertools.islice(records, max(block_size, 1))):
+            headers, sequences = zip(*chunk)
+            if max_gaps is None and perc_max_gaps:
+                max_gaps = int((perc_max_gaps / 100) * len(sequences[0]))
+            residues = np.frombuffer("".join(sequences).encode(), dtype=np.uint8).reshape(len(sequences), -1)
+            block = MSAMatrix(list(headers), residues).remove_inserts().filter_by_continuous_gaps(max_gaps)
+            if block.depth:
+                if rows == 0:
+                    cols = block.cols
+                rows += block.depth
+                block.write(fs)
+
+    if isinstance(output_source, str):
+        with open(output_source, "w") as fs:
+            write(fs)
+    else:
+        write(output_source)
+    return rows, cols
+
+
+def reduce_msa_redundancy(msa_path: str, perc_identity: float, workers: Optional[int] = None) -> npt.NDArray[np.int64]:
+    """
+    Rewrites an MSA keeping one representative of every cluster of sequences sharing at least `perc_identity` percent of their positions. See MSAMatrix.cluster_by_identity.
+
+    Parameters
+    ----------
+    msa_path : str
+        Filepath of the MSA in FASTA format, replaced by the reduced MSA.
+    perc_identity : float
+        Percentage of identical positions above which sequences are redundant.
+    workers : int, optional
+        Number of threads computing identities.
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices of the kept rows in the original MSA.
+    """
+    msa = MSAMatrix.load_from_file(msa_path)
+    representatives, _ = msa.cluster_by_identity(perc_identity / 100, workers=workers)
+    msa.select_rows(representatives).write(msa_path)
+    return representatives
+
+
+def subsample_msa(msa_path: str, output_path: str, max_depth: int, identity: float = 0.8, seed: int = 0, workers: Optional[int] = None) -> npt.NDArray[np.int64]:
+    """
+    Writes a stratified subsample of at most `max_depth` sequences of an MSA. See MSAMatrix.stratified_subsample.
+
+    Parameters
+    ----------
+    msa_path : str
+        Filepath of the MSA in FASTA format.
+    output_path : str
+        Filepath to write the subsample to. May be `msa_path`.
+    max_depth : int
+        Maximum number of sequences kept.
+    identity : float
+        Identity threshold, between 0 and 1, of the clusters sampled across.
+    seed : int
+        Random seed, the same seed gives the same subsample.
+    workers : int, optional
+        Number of threads used for clustering.
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices of the kept rows in the original MSA.
+    """
+    msa = MSAMatrix.load_from_file(msa_path)
+    kept = msa.stratified_subsample(max_depth, identity=identity, seed=seed, workers=workers)
+    msa.select_rows(kept).write(output_path)
+    return kept
+
+
+def prepare_dca_matrix(msa: MSAMatrix, max_depth: Optional[int] = None, perc_max_col_gaps: Optional[float] = None, identity: float = 0.8, seed: int = 0, workers: Optional[int] = None) -> tuple[MSAMatrix, Optional[npt.NDArray[np.int64]], Optional[npt.NDArray[np.int64]]]:
+    """
+    Prepares the MSA a DCA is fitted on: columns with too many gaps are trimmed, then the rows are subsampled to at most `max_depth`.
+
+    Parameters
+    ----------
+    msa : MSAMatrix
+        The MSA, without insert positions.
+    max_depth : int, optional
+        Maximum number of sequences kept, see MSAMatrix.stratified_subsample. If None, every sequence is kept.
+    perc_max_col_gaps : float, optional
+        Columns with more than this percentage of gaps are dropped. If None, every column is kept.
+    identity, seed, workers
+        Subsampling parameters, as in subsample_msa.
+
+    Returns
+    -------
+    msa, rows, column_map : tuple of (MSAMatrix, numpy.ndarray or None, numpy.ndarray or None)
+        The prepared MSA, the indices of the kept rows, or None if none were dropped, and for each column of the MSA its column in the prepared MSA or
+        -1 if it was trimmed, or None if no column was trimmed.
+
+    Raises
+    ------
+    ValueError
+        If fewer than two columns are left.
+    """
+    column_map = None
+    if perc_max_col_gaps is not None:
+        trimmed, kept_columns = msa.filter_columns_by_gap_fraction(perc_max_col_gaps / 100)
+        if len(kept_columns) < 2:
+            raise ValueError(f"Only {len(kept_columns)} columns have at most {perc_max_col_gaps}% gaps.")
+        if len(kept_columns) < msa.cols:
+            column_map = np.full(msa.cols, -1, dtype=np.int64)
+            column_map[kept_columns] = np.arange(len(kept_columns))
+            msa = trimmed
+    rows = None
+    if max_depth and msa.depth > max_depth:
+        rows = msa.stratified_subsample(max_depth, identity=identity, seed=seed, workers=workers)
+        msa = msa.select_rows(rows)
+    return msa, rows, column_map
+
+
 def filter_by_consecutive_gaps(input_source: Union[str, io.IOBase], output_source: Union[str, io.IOBase], perc_max_gaps: Optional[int]) -> None:
     """
     Filters specified input source by the number of maximum continuous gaps supplied and writes to output source.
@@ -265,13 +989,12 @@ def filter_by_consecutive_gaps(input_source: Union[str, io.IOBase], output_sourc
     -------
     None
     """
-    input_MSA = MSATools.load_from_file(input_source)
-    input_MSA_cols = len(input_MSA.MSA[0][1])
+    input_MSA = MSAMatrix.load_from_file(input_source)
     if perc_max_gaps:
-        max_gaps = int((perc_max_gaps / 100) * input_MSA_cols)
+        max_gaps = int((perc_max_gaps / 100) * input_MSA.cols)
     else:
         max_gaps = None
-    output_MSA = MSATools(input_MSA.filter_by_continuous_gaps(max_gaps))
+    output_MSA = input_MSA.remove_inserts().filter_by_continuous_gaps(max_gaps)
     output_MSA.write(output_source)
 
     
@@ -289,7 +1012,5 @@ def get_msa_stats(msa_path: str) -> tuple[int, int]:
     rows, cols : tuple[int, int]
         Number of rows and number of columns in the MSA.
     """
-    msa = MSATools.load_from_file(msa_path)
-    rows = len(msa)
-    cols = len(msa.MSA[0][1])
-    return rows, cols
\ No newline at end of file
+    msa = MSAMatrix.load_from_file(msa_path)
+    return msa.depth, msa.cols
\ No newline at end of file
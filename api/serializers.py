@@ -9,6 +9,7 @@ from .models import (
     MultipleSequenceAlignment,
     DirectCouplingAnalysis,
     StructureContacts,
+    HamiltonianScores,
 )
 
 
@@ -73,20 +74,34 @@ class MSASerializer(serializers.ModelSerializer):
             "depth",
             "cols",
             "quality",
+            "perc_identity",
+            "max_depth",
+            "subsample_seed",
+            "unreduced_depth",
         ]
         read_only_fields = ["id", "user", "created", "expires"]
 
 
 class DCASerializer(serializers.ModelSerializer):
     ranked_di = NdarraySerializerField(required=False)
+    column_map = NdarraySerializerField(required=False)
+    windows = NdarraySerializerField(required=False)
+    sweep_dcas = serializers.SerializerMethodField()
 
     class Meta:
         model = DirectCouplingAnalysis
-        fields = ["id", "user", "created", "expires", "m_eff", "ranked_di"]
+        fields = ["id", "user", "created", "expires", "m_eff", "ranked_di", "engine", "precision", "theta", "sweep", "sweep_dcas", "max_depth", "subsample_seed", "perc_max_col_gaps", "column_map", "windows"]
+
+    def get_sweep_dcas(self, obj) -> list[str]:
+        # Ids of every DCA of the same theta sweep, in the order of its thetas
+        if obj.sweep is None:
+            return []
+        return [str(id) for id in DirectCouplingAnalysis.objects.filter(sweep=obj.sweep).order_by("created").values_list("id", flat=True)]
 
 
 class MappedDiSerializer(serializers.ModelSerializer):
     mapped_di = NdarraySerializerField(required=False)
+    batch_mapped_dis = serializers.SerializerMethodField()
 
     class Meta:
         model = MappedDi
@@ -96,11 +111,21 @@ class MappedDiSerializer(serializers.ModelSerializer):
             "created",
             "expires",
             "protein_name",
+            "chain1",
+            "chain2",
             "seed",
             "dca",
             "mapped_di",
+            "batch",
+            "batch_mapped_dis",
         ]
 
+    def get_batch_mapped_dis(self, obj) -> list[str]:
+        # Ids of every MappedDi of the same batch mapping
+        if obj.batch is None:
+            return []
+        return [str(id) for id in MappedDi.objects.filter(batch=obj.batch).order_by("created").values_list("id", flat=True)]
+
 
 class StructureContactsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -117,15 +142,58 @@ class StructureContactsSerializer(serializers.ModelSerializer):
         ]
 
 
+class HamiltonianScoresSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = HamiltonianScores
+        fields = [
+            "id",
+            "user",
+            "created",
+            "expires",
+            "library",
+            "dca",
+            "project_id",
+            "output_format",
+            "scores",
+            "count",
+        ]
+
+
 class GenerateMSASerializer(serializers.Serializer):
     seed = serializers.CharField(max_length=700)
     msa_name = serializers.CharField(max_length=255, required=False)
     E = serializers.FloatField(required=False)
     perc_max_gaps = serializers.FloatField(required=False)
+    perc_identity = serializers.FloatField(required=False, min_value=0, max_value=100)
+    max_depth = serializers.IntegerField(required=False, min_value=1)
+    subsample_seed = serializers.IntegerField(required=False, min_value=0)
 
 class ComputeDCASerializer(serializers.Serializer):
     msa_id = serializers.UUIDField()
     theta = serializers.FloatField(required=False)
+    # Computes one DCA per theta, sharing the MSA processing between them
+    thetas = serializers.ListField(child=serializers.FloatField(min_value=0, max_value=1), required=False, allow_empty=False)
+    max_depth = serializers.IntegerField(required=False, min_value=1)
+    subsample_seed = serializers.IntegerField(required=False, min_value=0)
+    perc_max_col_gaps = serializers.FloatField(required=False, min_value=0, max_value=100)
+    # float32 halves the memory of the fit, for long families
+    precision = serializers.ChoiceField(choices=DirectCouplingAnalysis.Precisions.choices, default=DirectCouplingAnalysis.Precisions.FLOAT64)
+    engine = serializers.ChoiceField(choices=DirectCouplingAnalysis.Engines.choices, default=DirectCouplingAnalysis.Engines.MEAN_FIELD)
+    # Longer alignments are fitted in windows of this many columns overlapping by window_overlap (a quarter of the window by default),
+    # optionally cut at the domain boundaries of the hits. Only pairs within a window are scored.
+    window_size = serializers.IntegerField(required=False, min_value=8)
+    window_overlap = serializers.IntegerField(required=False, min_value=0)
+    domain_windows = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        if data["engine"] != DirectCouplingAnalysis.Engines.MEAN_FIELD and data["precision"] != DirectCouplingAnalysis.Precisions.FLOAT64:
+            raise serializers.ValidationError("Only the mean_field engine supports float32 precision.")
+        if data.get("window_overlap") is not None:
+            if not data.get("window_size"):
+                raise serializers.ValidationError("window_overlap needs a window_size.")
+            if data["window_overlap"] >= data["window_size"] // 2:
+                raise serializers.ValidationError("window_overlap must be less than half of window_size.")
+        return data
 
 class MapResiduesSerializer(serializers.Serializer):
     dca_id = serializers.UUIDField()
@@ -135,19 +203,58 @@ class MapResiduesSerializer(serializers.Serializer):
     auth_chain_id_supplied = serializers.BooleanField()
 
 
+class MapResiduesTargetSerializer(serializers.Serializer):
+    pdb_id = serializers.CharField(max_length=8)
+    chain1 = serializers.CharField(max_length=10)
+    chain2 = serializers.CharField(max_length=10)
+
+
+class MapResiduesBatchSerializer(serializers.Serializer):
+    dca_id = serializers.UUIDField()
+    targets = serializers.ListField(child=MapResiduesTargetSerializer(), allow_empty=False, max_length=200)
+    auth_chain_id_supplied = serializers.BooleanField(required=False, default=False)
+
+
 class GenerateContactsSerializer(serializers.Serializer):
     pdb_id = serializers.CharField(max_length=8)
     ca_only = serializers.BooleanField(required=False)
     threshold = serializers.FloatField(required=False)
     is_cif = serializers.BooleanField(required=False)
 
-class CalculateHamiltonianSerializer(serializers.Serializer):
+class PottsParametersSerializer(serializers.Serializer):
     project_id = serializers.CharField(required=False, allow_null=True) # used to pull precomputed couplings and local fields
-    sequences = serializers.JSONField(required =True)  # headers are keys and sequences are values
+    dca_id = serializers.UUIDField(required=False, allow_null=True)  # used to pull the couplings and local fields of a stored DCA
     local_fields = serializers.FileField(required=False, allow_null=True)  # must be csv w/no headers or indices
     couplings = serializers.FileField(required=False, allow_null=True)  # must be csv w/no headers or indices
+
+class CalculateHamiltonianSerializer(PottsParametersSerializer):
+    sequences = serializers.JSONField(required =True)  # headers are keys and sequences are values
     pottsH = serializers.JSONField(required=False, allow_null=True)  # headers are keys and Hamiltonian value is the values
 
+class HamiltonianJobSerializer(serializers.Serializer):
+    sequences = serializers.FileField()  # fasta, headers are kept in the scores
+    name = serializers.CharField(max_length=200, required=False)
+    project_id = serializers.CharField(required=False, allow_null=True)
+    dca_id = serializers.UUIDField(required=False, allow_null=True)
+    output_format = serializers.ChoiceField(choices=HamiltonianScores.OutputFormats.choices, default=HamiltonianScores.OutputFormats.CSV)
+
+    def validate(self, data):
+        if bool(data.get("project_id")) == bool(data.get("dca_id")):
+            raise serializers.ValidationError("Supply exactly one of project_id or dca_id.")
+        return data
+
+class DCACouplingsSerializer(serializers.Serializer):
+    dca_id = serializers.UUIDField()
+    # 1-based MSA positions, e.g. [[3, 40]]. Without pairs the norms of every pair are returned instead.
+    pairs = serializers.ListField(
+        child=serializers.ListField(child=serializers.IntegerField(min_value=1), min_length=2, max_length=2),
+        required=False,
+    )
+
+class MutationalScanSerializer(PottsParametersSerializer):
+    wild_type = serializers.CharField()
+    double_mutants = serializers.ListField(child=serializers.CharField(), required=False)  # e.g. ["A12G:K30R"], 1-based positions
+
 class Align2HMMSerializer(serializers.Serializer):
     json_input = serializers.JSONField(required=False, allow_null=True)  # headers are keys and sequences are values
     fasta_input = serializers.FileField(required=False, allow_null=True)  # file must be fasta format
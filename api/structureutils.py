@@ -0,0 +1,267 @@
+import gzip
+import io
+import os
+import pickle
+import re
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Union
+
+import dcatoolkit
+import numpy as np
+import numpy.typing as npt
+from biotite.database import rcsb
+from dcatoolkit import MMCIFInformation, PDBInformation, StructureInformation
+from scipy.spatial import KDTree
+
+from .cacheutils import LRUCache
+
+_PDB_ID_RE = re.compile(r"^[A-Za-z0-9_]{4,12}$")
+_EXTENSIONS = {"mmcif": "cif", "pdb": "pdb"}
+
+
+class StructureRepository:
+    """
+    Local repository of the structures of PDB entries, in front of downloads from RCSB.
+
+    Structures are looked up in a per-process LRU of parsed structures, then in the parsed structures pickled in `cache_dir`, then as a file in
+    `mirror_dir` and finally as a file in `cache_dir`, which is downloaded from RCSB first unless the repository is `offline`. Mirrors may be flat
+    (``1abc.cif``) or use the PDB's divided layout (``ab/1abc.cif``), and files may be gzipped. Parsing a file writes its pickle, so each entry is
+    downloaded and parsed once per cache directory.
+
+    The structures returned are shared between callers and must not be modified.
+
+    Parameters
+    ----------
+    cache_dir : str or pathlib.Path, optional
+        Directory downloaded files and pickled structures are written to. Without it only the in-memory LRU is used.
+    mirror_dir : str or pathlib.Path, optional
+        Read-only directory of pre-populated structure files.
+    max_entries : int
+        Number of parsed structures kept in memory.
+    offline : bool
+        Raise FileNotFoundError instead of downloading entries that are neither cached nor mirrored.
+    """
+    def __init__(self, cache_dir=None, mirror_dir=None, max_entries=32, offline=False):
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.mirror_dir = None if mirror_dir is None else Path(mirror_dir)
+        self.offline = offline
+        self.memory = LRUCache(max_entries)
+        self._locks = defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+
+    @staticmethod
+    def check_pdb_id(pdb_id: str) -> str:
+        if not _PDB_ID_RE.match(pdb_id):
+            raise ValueError(f"Invalid PDB id {pdb_id!r}")
+        return pdb_id.lower()
+
+    @staticmethod
+    def extension(struc_format: str) -> str:
+        if struc_format not in _EXTENSIONS:
+            raise ValueError(f"struc_format {struc_format} is not valid, expected one of {list(_EXTENSIONS)}")
+        return _EXTENSIONS[struc_format]
+
+    def _mirror_path(self, pdb_id: str, struc_format: str) -> Optional[Path]:
+        if self.mirror_dir is None:
+            return None
+        name = f"{pdb_id}.{self.extension(struc_format)}"
+        for directory in (self.mirror_dir, self.mirror_dir / pdb_id[1:3]):
+            for path in (directory / name, directory / f"{name}.gz"):
+                if path.exists():
+                    return path
+        return None
+
+    def _pickle_path(self, pdb_id: str, struc_format: str, model_num: int) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        # Pickles of another dcatoolkit version may not load, so they are kept apart
+        return self.cache_dir / f"{pdb_id}.{self.extension(struc_format)}.{model_num}.dcatoolkit-{dcatoolkit.__version__}.pkl"
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fs:
+                fs.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def structure_path(self, pdb_id: str, struc_format: str = "mmcif") -> Union[Path, io.StringIO]:
+        """
+        Path of the structure file of an entry, from the mirror or the cache, downloading it into the cache if needed. Without a cache directory
+        downloads are returned in memory.
+        """
+        pdb_id = self.check_pdb_id(pdb_id)
+        mirrored = self._mirror_path(pdb_id, struc_format)
+        if mirrored is not None:
+            return mirrored
+        cached = None if self.cache_dir is None else self.cache_dir / f"{pdb_id}.{self.extension(struc_format)}"
+        if cached is not None and cached.exists():
+            return cached
+        if self.offline:
+            raise FileNotFoundError(f"{pdb_id} is not in the structure mirror or cache")
+        fetched = rcsb.fetch(pdb_id, struc_format)
+        if fetched is None:
+            raise TypeError("RCSB fetch failed. Try fetch again.")
+        if cached is None:
+            return fetched
+        self._write(cached, fetched.getvalue().encode())
+        return cached
+
+    @staticmethod
+    def parse(source: Union[str, Path, io.IOBase], struc_format: str = "mmcif", model_num: int = 1) -> Union[MMCIFInformation, PDBInformation]:
+        """
+        Parse a structure file, which may be gzipped, into StructureInformation.
+        """
+        read = StructureInformation.read_mmCIF_file if struc_format == "mmcif" else StructureInformation.read_pdb_file
+        if isinstance(source, (str, Path)) and str(source).endswith(".gz"):
+            with gzip.open(source, "rt") as fs:
+                return read(fs, model_num)
+        return read(str(source) if isinstance(source, Path) else source, model_num)
+
+    def _load(self, pdb_id: str, struc_format: str, model_num: int) -> Union[MMCIFInformation, PDBInformation]:
+        pickle_path = self._pickle_path(pdb_id, struc_format, model_num)
+        if pickle_path is not None and pickle_path.exists():
+            try:
+                with open(pickle_path, "rb") as fs:
+                    return pickle.load(fs)
+            except Exception:
+                # Unreadable pickles are parsed again and replaced
+                pass
+        structure = self.parse(self.structure_path(pdb_id, struc_format), struc_format, model_num)
+        if pickle_path is not None:
+            self._write(pickle_path, pickle.dumps(structure, protocol=pickle.HIGHEST_PROTOCOL))
+        return structure
+
+    def get(self, pdb_id: str, struc_format: str = "mmcif", model_num: int = 1) -> Union[MMCIFInformation, PDBInformation]:
+        """
+        Parsed structure of a PDB entry, as returned by StructureInformation.fetch_pdb.
+        """
+        pdb_id = self.check_pdb_id(pdb_id)
+        key = (pdb_id, self.extension(struc_format), model_num)
+        structure = self.memory.get(key)
+        if structure is None:
+            # Concurrent requests for the same entry wait for a single download and parse
+            with self._locks_lock:
+                lock = self._locks[key]
+            with lock:
+                structure = self.memory.get(key)
+                if structure is None:
+                    structure = self.memory.put(key, self._load(pdb_id, struc_format, model_num))
+        return structure
+
+
+_structure_repository = None
+
+
+def get_structure_repository() -> StructureRepository:
+    """
+    Per-process StructureRepository configured by the STRUCTURE_* settings. It is rebuilt if the settings change.
+    """
+    global _structure_repository
+    from django.conf import settings
+    config = (None, None, 32, False)
+    if settings.configured:
+        config = (
+            getattr(settings, "STRUCTURE_CACHE_DIR", None),
+            getattr(settings, "STRUCTURE_MIRROR_DIR", None),
+            getattr(settings, "STRUCTURE_CACHE_ENTRIES", 32),
+            getattr(settings, "STRUCTURE_OFFLINE", False),
+        )
+    if _structure_repository is None or _structure_repository[0] != config:
+        _structure_repository = (config, StructureRepository(*config))
+    return _structure_repository[1]
+
+
+def fetch_structure(pdb_id: str, struc_format: str = "mmcif", model_num: int = 1) -> Union[MMCIFInformation, PDBInformation]:
+    """
+    StructureInformation.fetch_pdb through the structure repository.
+    """
+    return get_structure_repository().get(pdb_id, struc_format, model_num)
+
+
+def _close_atom_pairs(tree: KDTree, coord: npt.NDArray, atom_chain: npt.NDArray, n_chains: int, threshold: float, max_workers: int) -> npt.NDArray:
+    # Pairs of atoms within the threshold, once each with the lower index first. Each worker queries the atoms of a chain against
+    # every atom, which finds the pairs of different chains twice but lets the chains be queried in parallel.
+    def chain_pairs(chain):
+        atoms = np.flatnonzero(atom_chain == chain)
+        pairs = KDTree(coord[atoms]).sparse_distance_matrix(tree, threshold, output_type="ndarray")
+        pairs = np.column_stack([atoms[pairs["i"]], pairs["j"]])
+        return pairs[pairs[:, 0] < pairs[:, 1]]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return np.concatenate([np.zeros((0, 2), dtype=np.int64)] + list(executor.map(chain_pairs, range(n_chains))))
+
+
+def get_all_contacts(structure: Union[MMCIFInformation, PDBInformation], ca_only: bool = False, threshold: float = 8, max_workers: int = 1, parallel_atoms: Optional[int] = None) -> dict[tuple[str, str], npt.NDArray]:
+    """
+    Residue contacts of every ordered pair of chains of a structure, the same as StructureInformation.get_contacts of each pair.
+
+    A single KD-tree over the atoms of every chain is queried once for all pairs of atoms within the threshold, and the contacts of both
+    orders of a pair of chains are filled from the same atom pairs. Structures of at least `parallel_atoms` atoms are queried one chain
+    at a time by `max_workers` threads instead.
+
+    Parameters
+    ----------
+    structure : dcatoolkit.MMCIFInformation or dcatoolkit.PDBInformation
+        Structure whose ``unique_chains`` are paired.
+    ca_only : bool
+        Only consider alpha-carbon to alpha-carbon distances.
+    threshold : float
+        Maximum distance, in Angstroms, between two atoms for their residues to be in contact (inclusive).
+    max_workers : int
+        Number of threads querying chains in parallel for large structures.
+    parallel_atoms : int, optional
+        Number of atoms from which chains are queried in parallel. Never by default.
+
+    Returns
+    -------
+    dict of {(str, str) : numpy.ndarray}
+        Sorted ``(n, 2)`` residue ids of the contacts of each ordered pair of chains, in the order of ``unique_chains``. Contacts within a
+        chain have the lower residue first and no residue is in contact with itself.
+    """
+    chains = list(structure.unique_chains)
+    atoms = structure.structure[~structure.structure.hetero]
+    if ca_only:
+        atoms = atoms[atoms.atom_name == "CA"]
+    atom_chain = np.full(len(atoms), -1, dtype=np.int64)
+    for k, chain in enumerate(chains):
+        atom_chain[atoms.chain_id == chain] = k
+    in_chains = atom_chain >= 0
+    atoms, atom_chain = atoms[in_chains], atom_chain[in_chains]
+    res_id = atoms.res_id.astype(np.int64)
+
+    tree = KDTree(atoms.coord)
+    if parallel_atoms is not None and len(atoms) >= parallel_atoms and max_workers > 1:
+        pairs = _close_atom_pairs(tree, atoms.coord, atom_chain, len(chains), threshold, max_workers)
+    else:
+        pairs = tree.query_pairs(threshold, output_type="ndarray")
+    chain1, chain2 = atom_chain[pairs[:, 0]], atom_chain[pairs[:, 1]]
+    res1, res2 = res_id[pairs[:, 0]], res_id[pairs[:, 1]]
+
+    # Contacts within a chain are kept once with the lower residue first, contacts between chains in both orders
+    same = chain1 == chain2
+    intra = same & (res1 != res2)
+    contacts = np.concatenate([
+        np.column_stack([chain1[intra], chain1[intra], np.minimum(res1, res2)[intra], np.maximum(res1, res2)[intra]]),
+        np.column_stack([chain1[~same], chain2[~same], res1[~same], res2[~same]]),
+        np.column_stack([chain2[~same], chain1[~same], res2[~same], res1[~same]]),
+    ])
+    # Unique contacts, sorted by chain pair and residues, through a single integer key per contact
+    first_res = res_id.min(initial=0)
+    span = int(res_id.max(initial=0) - first_res + 1)
+    keys = np.unique(((contacts[:, 0] * len(chains) + contacts[:, 1]) * span + contacts[:, 2] - first_res) * span + contacts[:, 3] - first_res)
+    chain_pair, residues = np.divmod(keys, span * span)
+    contacts = np.column_stack(np.divmod(residues, span)) + first_res
+    bounds = np.searchsorted(chain_pair, np.arange(len(chains) ** 2 + 1))
+    return {
+        (chain_1, chain_2): contacts[bounds[k * len(chains) + l]:bounds[k * len(chains) + l + 1]]
+        for k, chain_1 in enumerate(chains)
+        for l, chain_2 in enumerate(chains)
+    }
@@ -1,16 +1,29 @@
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.core.files import File
 from django.core.files.base import ContentFile
-from celery import shared_task
+from celery import shared_task, group
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from celery.signals import worker_init, worker_process_init
+from celery.utils.log import get_task_logger
 import time
+from datetime import timedelta
 from typing import Union, TextIO
 import tempfile
 from dca import dca_class
 import numpy as np
+import csv
+import itertools
+import base64
+import pickle
 import json
 import os
 import io
+import shutil
+import zipfile
+from pathlib import Path
 
 from .models import (
     APITaskMeta,
@@ -21,59 +34,345 @@ from .models import (
     SeedSequence,
     MappedDi,
     StructureContacts,
+    SequenceLibrary,
+    HamiltonianScores,
+    MsaSearchClaim,
 )
+from .modelutils import get_random_uuid
+from .ProSSpeC.calculate_Hamiltonian import potts_tables_from_dca
+from .ProSSpeC.coupling_store import CouplingStore, write_coupling_store
+from .ProSSpeC.parameter_store import get_project_store
 from .taskutils import APITaskBase
+from .msamatrix import MSAMatrix
+from .structureutils import fetch_structure, get_all_contacts
+from .dcautils import DCA_ENGINES, DEFAULT_THETA, alignment_boundaries, dca_windows, merge_window_fits
 from .msautils import (
     hmmsearch_from_seed,
-    filter_by_consecutive_gaps,
+    generate_hmm_and_profiles,
+    get_sequence_database,
+    search_hmm_shards,
+    hits_to_text_msa,
+    sequence_database_size,
+    sequence_database_version,
+    msa_search_key,
+    postprocess_msa,
+    reduce_msa_redundancy,
+    subsample_msa,
+    prepare_dca_matrix,
     get_mapped_residues,
-    get_msa_stats,
+    iter_batch_mapped_residues,
+    iter_fasta_records,
+    count_fasta_records,
+    preload_sequence_database,
 )
-from dcatoolkit import StructureInformation
+from pyhmmer.easel import Alphabet
+from pyhmmer.plan7 import Background, HMMFile, TopHits
+
+logger = get_task_logger(__name__)
+
+
+@worker_init.connect
+@worker_process_init.connect
+def preload_hmm_database(**kwargs):
+    # Load the search database once instead of once per generate_msa_task. worker_init runs in the main worker process
+    # before the prefork pool is forked, so pool processes share its pages copy-on-write rather than each loading a copy;
+    # worker_process_init only loads it in pool processes that did not inherit it (non-fork pools).
+    # Only workers started with HMM_DATABASE_PRELOAD load it, so workers that never search do not hold the database.
+    if settings.HMM_DATABASE_PRELOAD and settings.HMM_DATABASE_DIGITIZED and get_sequence_database(settings.HMM_DATABASE) is None:
+        preload_sequence_database(settings.HMM_DATABASE, settings.HMM_DATABASE_DIGITIZED)
+
+
+@shared_task
+def hmmsearch_shard_task(hmm_data, start, stop, E=None, T=None):
+    # Searches sequences [start, stop) of the digitized database; the hits are returned pickled since they are merged by the caller
+    sequences = get_sequence_database(settings.HMM_DATABASE)
+    if sequences is None:
+        sequences = preload_sequence_database(settings.HMM_DATABASE, settings.HMM_DATABASE_DIGITIZED)
+    if sequences is None:
+        raise RuntimeError("Sharded hmmsearch needs the digitized database, run `manage.py prepare_hmm_database`")
+
+    with HMMFile(io.BytesIO(base64.b64decode(hmm_data))) as hmm_file:
+        hmm = hmm_file.read()
+    shard_size = settings.HMMSEARCH_SHARD_SIZE or -(-(stop - start) // settings.HMMSEARCH_CPUS)
+    shards = (sequences[i:min(i + shard_size, stop)] for i in range(start, stop, shard_size))
+    hits = search_hmm_shards(hmm, Background(Alphabet.amino()), shards, settings.HMMSEARCH_CPUS, E=E, T=T)
+    return base64.b64encode(pickle.dumps(hits)).decode()
+
+
+def distributed_hmmsearch(seed_sequence_filepath, seed_name, n_shards, E=None, T=None):
+    # hmmsearch_from_seed with the database split across n_shards hmmsearch_shard_tasks
+    _, hmm, _, _ = generate_hmm_and_profiles(seed_sequence_filepath, seed_name)
+    hmm_file = io.BytesIO()
+    hmm.write(hmm_file, binary=True)
+    hmm_data = base64.b64encode(hmm_file.getvalue()).decode()
+
+    size = sequence_database_size(settings.HMM_DATABASE_DIGITIZED)
+    bounds = np.linspace(0, size, n_shards + 1).astype(int)
+    shards = group(
+        hmmsearch_shard_task.s(hmm_data, int(start), int(stop), E=E, T=T).set(queue=settings.HMMSEARCH_SHARD_QUEUE)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+        if stop > start
+    )
+    results = shards.apply_async().get(disable_sync_subtasks=False)
+    return hits_to_text_msa(TopHits.merge(*(pickle.loads(base64.b64decode(result)) for result in results)))
+
+
+def run_hmmsearch(seed_sequence_filepath, seed_name, E=None):
+    if settings.HMMSEARCH_CELERY_SHARDS > 1:
+        return distributed_hmmsearch(seed_sequence_filepath, seed_name, settings.HMMSEARCH_CELERY_SHARDS, E=E)
+    return hmmsearch_from_seed(
+        seed_sequence_filepath,
+        seed_name,
+        database_path=settings.HMM_DATABASE,
+        E=E,
+        cpus=settings.HMMSEARCH_CPUS,
+        shard_size=settings.HMMSEARCH_SHARD_SIZE,
+    )
+
+
+def find_msa_result(search_key, exclude_id=None):
+    # Newest unexpired, finished MSA from an identical search
+    return MultipleSequenceAlignment.objects.filter(
+        search_key=search_key, expires__gt=timezone.now()
+    ).exclude(id=exclude_id).exclude(quality=MultipleSequenceAlignment.Qualities.NA).order_by("-created").first()
+
+
+def claim_msa_search(search_key, task_id):
+    # Claims the search of search_key for task_id. Returns None once claimed, or the id of the task already running it.
+    # Claims older than MSA_SEARCH_TIMEOUT or held by tasks that ended are given up.
+    stale = timezone.now() - timedelta(seconds=settings.MSA_SEARCH_TIMEOUT)
+    ended = CeleryTaskMeta.objects.filter(time_ended__isnull=False).values("id")
+    with transaction.atomic():
+        MsaSearchClaim.objects.filter(search_key=search_key).filter(
+            Q(claimed__lt=stale) | Q(task_id__in=ended)
+        ).delete()
+        claim, created = MsaSearchClaim.objects.get_or_create(search_key=search_key, defaults={"task_id": task_id})
+    return None if created or str(claim.task_id) == str(task_id) else str(claim.task_id)
+
+
+def find_or_claim_msa_search(task, search_key):
+    # Result of an identical search, waiting for one that is running, or None once task holds the claim to search itself.
+    # Waits end when the running search finishes, or when its claim is released or goes stale (see claim_msa_search).
+    task_id = task.get_task_id()
+    while (existing := find_msa_result(search_key, exclude_id=task_id)) is None:
+        running = claim_msa_search(search_key, task_id)
+        if running is None:
+            return None
+        task.set_progress(message="Waiting for identical search", percent=10)
+        try:
+            CeleryTaskMeta.objects.get(id=running).wait_for_completion(timeout=settings.MSA_SEARCH_POLL_INTERVAL)
+        except CeleryTaskMeta.DoesNotExist:
+            # The running task has not recorded its progress yet
+            time.sleep(settings.MSA_SEARCH_POLL_INTERVAL)
+        except CeleryTimeoutError:
+            pass
+        except Exception:
+            # The identical search failed, and gave up its claim
+            logger.exception("Identical MSA search %s failed", running)
+    return existing
 
 
 @shared_task(base=APITaskBase, bind=True)
-def generate_msa_task(self, seed, msa_name=None, E=None, perc_max_gaps=None):
+def generate_msa_task(self, seed, msa_name=None, E=None, perc_max_gaps=None, perc_identity=None, max_depth=None, subsample_seed=0):
     self.set_progress(message="Starting...", percent=0)
     if msa_name is None:
         msa_name = self.get_task_id()
 
     seed = seed.replace("\n", "")
 
+    database_version = settings.HMM_DATABASE_VERSION or sequence_database_version(str(settings.HMM_DATABASE))
+    search_key = msa_search_key(seed, E, None, perc_max_gaps, database_version, perc_identity=perc_identity, max_depth=max_depth, subsample_seed=subsample_seed if max_depth else None)
+
+    existing = find_or_claim_msa_search(self, search_key)
+
     f = ContentFile(f">{msa_name}\n{seed}", name=msa_name)
     seedObj = SeedSequence.objects.create(
         name=msa_name, fasta=f
     )
+    expires = timezone.now() + settings.DATA_EXPIRATION
 
-    self.set_progress(message="Doing HMM search...", percent=10)
-
-    preprocessed_msa = hmmsearch_from_seed(seedObj.fasta.path, msa_name, database_path=settings.HMM_DATABASE, E=E)
-
-    self.set_progress(message="Filtering!", percent=90)
+    if existing is not None:
+        self.set_progress(message="Copying previous result", percent=90)
+        msa = MultipleSequenceAlignment(
+            id=self.get_task_id(),
+            user=self.get_user(),
+            expires=expires,
+            seed=seedObj,
+            depth=existing.depth,
+            cols=existing.cols,
+            quality=existing.quality,
+            search_key=search_key,
+            perc_identity=existing.perc_identity,
+            max_depth=existing.max_depth,
+            subsample_seed=existing.subsample_seed,
+            unreduced_depth=existing.unreduced_depth,
+            kept_rows=existing.kept_rows,
+        )
+        with existing.fasta.open("rb") as fs:
+            msa.fasta.save(msa_name, File(fs), save=False)
+        msa.save()
+        self.set_progress(message="", percent=100)
+        return
 
     msa = MultipleSequenceAlignment.objects.create(
         id=self.get_task_id(),
         user=self.get_user(),
-        expires=timezone.now() + settings.DATA_EXPIRATION,
+        expires=expires,
         seed=seedObj,
-        fasta=ContentFile("", msa_name)
+        fasta=ContentFile("", msa_name),
+        search_key=search_key,
     )
 
-    preprocessed_file = io.BytesIO()
-    preprocessed_msa.write(preprocessed_file, "afa")
-    filter_by_consecutive_gaps(preprocessed_file, msa.fasta.path, perc_max_gaps)
+    try:
+        self.set_progress(message="Doing HMM search...", percent=10)
+
+        preprocessed_msa = run_hmmsearch(seedObj.fasta.path, msa_name, E=E)
+
+        self.set_progress(message="Filtering!", percent=90)
+
+        rows, cols = postprocess_msa(preprocessed_msa, msa.fasta.path, perc_max_gaps)
+
+        kept_rows = np.arange(rows)
+        if perc_identity and rows:
+            self.set_progress(message="Removing redundant sequences", percent=95)
+            msa.perc_identity = perc_identity
+            kept_rows = reduce_msa_redundancy(msa.fasta.path, perc_identity, workers=settings.MSA_PROCESSING_CPUS)
+        if max_depth and len(kept_rows) > max_depth:
+            self.set_progress(message="Subsampling", percent=97)
+            msa.max_depth = max_depth
+            msa.subsample_seed = subsample_seed
+            subsample = subsample_msa(msa.fasta.path, msa.fasta.path, max_depth, seed=subsample_seed, workers=settings.MSA_PROCESSING_CPUS)
+            kept_rows = kept_rows[subsample]
+        if len(kept_rows) < rows:
+            msa.unreduced_depth = rows
+            msa.kept_rows = kept_rows
+            rows = len(kept_rows)
 
-    msa.quality = MultipleSequenceAlignment.Qualities.GOOD
-    rows, cols = get_msa_stats(msa.fasta.path)
-    msa.depth = rows
-    msa.cols = cols
-    msa.save()
+        msa.quality = MultipleSequenceAlignment.Qualities.GOOD
+        msa.depth = rows
+        msa.cols = cols
+        msa.save()
+    except Exception:
+        msa.delete()
+        raise
+    finally:
+        # Released once the result can be found, so identical requests either find it or search themselves
+        MsaSearchClaim.objects.filter(search_key=search_key, task_id=self.get_task_id()).delete()
 
     self.set_progress(message="", percent=100)
 
 
+def rank_di(di, column_map=None):
+    # Limit to top 5000
+    if column_map is not None:
+        # Report the 1-based positions of the untrimmed MSA
+        di = di.copy()
+        di[:, :2] = np.flatnonzero(column_map >= 0)[di[:, :2].astype(int) - 1] + 1
+    di = di[di[:, 2].argsort()[::-1]]
+    return di[:5000]
+
+
+def save_dca_fit(dca, protein_family, column_map=None):
+    length = int(round((1 + np.sqrt(1 + 8 * len(protein_family.DI))) / 2))  # DI holds every pair i < j
+
+    # Stored as a float32 coupling store rather than e_ij / h_i, which take a lot of space in the database
+    dca.save_potts_parameters(
+        protein_family.couplings, protein_family.localfields, length,
+        top_k=settings.DCA_COUPLING_TOP_K, max_bytes=settings.DCA_COUPLING_STORE_BYTES,
+    )
+    dca.m_eff = protein_family.Meff
+    dca.ranked_di = rank_di(protein_family.DI, column_map)
+    dca.save()
+
+
+def dca_fit_options(engine, precision):
+    # Mean-field fits in the requested precision, plmDCA fits its sites in parallel processes
+    return {"dtype": np.dtype(precision)} if engine == "mean_field" else {"workers": settings.DCA_CPUS}
+
+
+@shared_task
+def dca_window_task(work_dir, start, stop, engine, precision):
+    # Fits columns [start, stop) of the alignment and sequence weights saved in work_dir by fit_dca_windows, and writes the window's
+    # coupling store and pair scores next to them
+    work_dir = Path(work_dir)
+    codes = np.load(work_dir / "codes.npy", mmap_mode="r")[:, start:stop]
+    fit = DCA_ENGINES[engine](codes).fit(np.load(work_dir / "weights.npy"), **dca_fit_options(engine, precision))
+    with open(work_dir / f"{start}_{stop}.dcac", "wb") as fs:
+        write_coupling_store(fs, *potts_tables_from_dca(fit.couplings, fit.localfields, stop - start, dtype=np.float32))
+    np.save(work_dir / f"{start}_{stop}_di.npy", fit.DI[:, 2])
+
+
+def fit_dca_windows(work_dir, length, weights, windows, engine, precision):
+    # Fits the windows of the alignment saved in work_dir with dca_window_task and merges their fits, see merge_window_fits.
+    # Windows are fitted in this process unless DCA_WINDOW_CELERY sends them to the workers of the DCA_WINDOW_QUEUE queue.
+    # The merged couplings are read from the window stores, so they must be saved before work_dir is removed.
+    np.save(work_dir / "weights.npy", weights)
+    if settings.DCA_WINDOW_CELERY:
+        fits = group(
+            dca_window_task.s(str(work_dir), int(start), int(stop), engine, precision).set(queue=settings.DCA_WINDOW_QUEUE)
+            for start, stop in windows
+        )
+        fits.apply_async().get(timeout=settings.DCA_WINDOW_TIMEOUT, disable_sync_subtasks=False)
+    else:
+        for start, stop in windows:
+            dca_window_task(str(work_dir), int(start), int(stop), engine, precision)
+    stores = [CouplingStore(work_dir / f"{start}_{stop}.dcac") for start, stop in windows]
+    return merge_window_fits(
+        length,
+        windows,
+        [np.load(work_dir / f"{start}_{stop}_di.npy", mmap_mode="r") for start, stop in windows],
+        [store.norms for store in stores],
+        [store.local_fields for store in stores],
+        [store.blocks for store in stores],
+    )
+
+
+def save_windowed_dca_fit(dca, windows, weights, merged, column_map=None):
+    DI, norms, local_fields, pairs, blocks = merged
+    dca.windows = np.array(windows)
+    dca.save_coupling_store(
+        blocks, local_fields, pairs=pairs, norms=norms,
+        top_k=settings.DCA_COUPLING_TOP_K, max_bytes=settings.DCA_COUPLING_STORE_BYTES,
+    )
+    dca.m_eff = weights.sum()
+    dca.ranked_di = rank_di(DI, column_map)
+    dca.save()
+
+
+def fit_py_mfdca(msa, matrix, msa_rows, column_map, theta):
+    # Mean-field DCA with py-mfdca, which reads the MSA from a FASTA file and computes its own sequence weights.
+    # A prepared MSA that differs from the stored one is written to a temporary file for it.
+    msa_path = msa.fasta.path
+    if msa_rows is not None or column_map is not None:
+        with tempfile.NamedTemporaryFile(suffix=".fasta", delete=False) as fs:
+            msa_path = fs.name
+        matrix.write(msa_path)
+    try:
+        protein_family = dca_class.dca(msa_path)
+        protein_family.mean_field(theta=theta)
+    finally:
+        if msa_path != msa.fasta.path:
+            os.remove(msa_path)
+    return protein_family
+
+
+def find_sequence_weights(msa, theta, msa_rows=None, column_map=None):
+    # Sequence weights of an earlier DCA fitted on the same rows and columns of the MSA with the same theta
+    candidates = DirectCouplingAnalysis.objects.filter(
+        msa=msa, theta=theta, weights__isnull=False
+    ).only("msa_rows", "column_map", "weights").order_by("-created")
+
+    def same(stored, prepared):
+        return (stored is None and prepared is None) or (stored is not None and prepared is not None and np.array_equal(stored, prepared))
+
+    for dca in candidates:
+        if same(dca.msa_rows, msa_rows) and same(dca.column_map, column_map):
+            return dca.weights
+    return None
+
+
 @shared_task(base=APITaskBase, bind=True)
-def compute_dca_task(self, msa_id, theta=None, wait=True):
+def compute_dca_task(self, msa_id, theta=None, wait=True, max_depth=None, subsample_seed=0, perc_max_col_gaps=None, thetas=None, precision="float64", engine="mean_field", window_size=None, window_overlap=None, domain_windows=False):
     prev_task = CeleryTaskMeta.objects.filter(id=msa_id)
     if prev_task.exists() and wait:
         self.set_progress(message="Waiting for MSA", percent=0)
@@ -81,35 +380,97 @@ def compute_dca_task(self, msa_id, theta=None, wait=True):
 
     msa = MultipleSequenceAlignment.objects.get(id=msa_id)
 
-    self.set_progress(message="Running DCA", percent=10)
-    protein_family = dca_class.dca(msa.fasta.path)
-
-    if theta:
-        protein_family.mean_field(theta=theta)
-    else:
-        protein_family.mean_field()
+    # A theta sweep fits one DCA per theta, all sharing the parsed and encoded MSA and a single pass over the sequence identities.
+    # The first DCA has the id of the task and every DCA of the sweep has it as its sweep.
+    sweep = bool(thetas)
+    thetas = list(dict.fromkeys(thetas)) if sweep else [theta or DEFAULT_THETA]
 
-    dca = DirectCouplingAnalysis.objects.create(
-        id=self.get_task_id(),
-        user=self.get_user(),
-        expires=timezone.now() + settings.DATA_EXPIRATION,
-        msa=msa
+    self.set_progress(message="Preparing MSA", percent=5)
+    # Subsampling clusters at the identity of the strictest sequence weights, 1 - theta
+    matrix, msa_rows, column_map = prepare_dca_matrix(
+        MSAMatrix.load_from_file(msa.fasta.path),
+        max_depth=max_depth,
+        perc_max_col_gaps=perc_max_col_gaps,
+        identity=1 - min(thetas),
+        seed=subsample_seed,
+        workers=settings.MSA_PROCESSING_CPUS,
     )
+    windowed = bool(window_size and matrix.cols > window_size)
 
-    # Limit to top 5000
-    di = protein_family.DI
-    di = di[di[:, 2].argsort()[::-1]]
-    di = di[:5000]
+    # Single, unwindowed mean-field DCAs in double precision are fitted with py-mfdca. Sweeps, the other engines and precisions,
+    # and windowed DCAs are fitted with the engines of dcautils, whose sequence weights are stored and reused
+    py_mfdca = not sweep and not windowed and engine == "mean_field" and precision == "float64"
+    weights = dict.fromkeys(thetas)
+    if not py_mfdca:
+        model = DCA_ENGINES[engine](matrix.encode())
 
-    # Not currently used, takes a lot of space
-    # dca.e_ij = protein_family.couplings
-    # dca.h_i = protein_family.localfields
-    dca.m_eff = protein_family.Meff
-    dca.ranked_di = di
-    dca.save()
+        # Weights are reused from earlier DCAs of the same MSA, and the missing ones computed together
+        self.set_progress(message="Computing sequence weights", percent=10)
+        weights = {theta: find_sequence_weights(msa, theta, msa_rows, column_map) for theta in thetas}
+        missing = [theta for theta, theta_weights in weights.items() if theta_weights is None]
+        if missing:
+            weights.update(zip(missing, model.sequence_weights(missing, block_bytes=settings.DCA_WEIGHTS_BLOCK_BYTES, workers=settings.DCA_CPUS)))
+
+    # Alignments longer than window_size are fitted in overlapping windows, optionally cut at the domain boundaries of the hits,
+    # so the memory of each fit depends on the window size rather than the length
+    windows = None
+    if windowed:
+        overlap = window_size // 4 if window_overlap is None else window_overlap
+        windows = dca_windows(model.length, window_size, overlap, alignment_boundaries(model.codes) if domain_windows else None)
+        work_dir = Path(settings.DCA_WINDOW_DIR or Path(settings.MEDIA_ROOT) / "dca_windows")
+        work_dir.mkdir(parents=True, exist_ok=True)
+        work_dir = Path(tempfile.mkdtemp(dir=work_dir, prefix=f"{self.get_task_id()}-"))
+        np.save(work_dir / "codes.npy", model.codes)
+
+    try:
+        for k, theta in enumerate(thetas):
+            message = f"Running DCA for theta {theta} ({k + 1} of {len(thetas)})" if sweep else "Running DCA"
+            if windows:
+                message += f" in {len(windows)} windows"
+            self.set_progress(message=message, percent=20 + 80 * k / len(thetas))
+            if windows:
+                merged = fit_dca_windows(work_dir, model.length, weights[theta], windows, engine, precision)
+            elif py_mfdca:
+                protein_family = fit_py_mfdca(msa, matrix, msa_rows, column_map, theta)
+            else:
+                protein_family = model.fit(weights[theta], **dca_fit_options(engine, precision))
+            dca = DirectCouplingAnalysis.objects.create(
+                id=self.get_task_id() if k == 0 else get_random_uuid(),
+                user=self.get_user(),
+                expires=timezone.now() + settings.DATA_EXPIRATION,
+                msa=msa,
+                theta=theta,
+                sweep=self.get_task_id() if sweep else None,
+                weights=weights[theta],
+                engine=engine,
+                precision=precision,
+                max_depth=max_depth if msa_rows is not None else None,
+                subsample_seed=subsample_seed if msa_rows is not None else None,
+                msa_rows=msa_rows,
+                perc_max_col_gaps=perc_max_col_gaps if column_map is not None else None,
+                column_map=column_map,
+            )
+            if windows:
+                save_windowed_dca_fit(dca, windows, weights[theta], merged, column_map)
+            else:
+                save_dca_fit(dca, protein_family, column_map)
+    finally:
+        if windows:
+            shutil.rmtree(work_dir, ignore_errors=True)
     self.set_progress(message="", percent=100)
 
 
+def get_dca_seed(dca):
+    # The seed of the DCA's MSA, or without one the MSA itself as a seed
+    # assert dca.msa and dca.msa.seed, "The DCA must have a seed"
+    if dca.msa.seed:
+        return dca.msa.seed
+    return SeedSequence.objects.create(
+        name="Not a great seed name",
+        fasta=dca.msa.fasta
+    )
+
+
 @shared_task(base=APITaskBase, bind=True)
 def map_residues_task(self, dca_id, pdb_id, chain1, chain2, auth_chain_id_supplied, wait=True):
     prev_task = CeleryTaskMeta.objects.filter(id=dca_id)
@@ -118,17 +479,10 @@ def map_residues_task(self, dca_id, pdb_id, chain1, chain2, auth_chain_id_suppli
         prev_task.first().wait_for_completion()
 
     dca = DirectCouplingAnalysis.objects.get(id=dca_id)
-    # assert dca.msa and dca.msa.seed, "The DCA must have a seed"
-    if dca.msa.seed:
-        seed = dca.msa.seed
-    else:
-        seed = SeedSequence.objects.create(
-            name="Not a great seed name",
-            fasta=dca.msa.fasta
-        )
+    seed = get_dca_seed(dca)
     
     self.set_progress(message="Mapping residues", percent=10)
-    # StructureInformation.fetch_pdb(pdb_id) # Called in get_mapped_residues
+    # The structure is fetched through the structure repository in get_mapped_residues
     mapped_di = get_mapped_residues(
         dca.ranked_di, pdb_id, seed.fasta.path, seed.name, pdb_id, chain1, chain2, auth_chain_id_supplied=auth_chain_id_supplied
     )
@@ -139,40 +493,71 @@ def map_residues_task(self, dca_id, pdb_id, chain1, chain2, auth_chain_id_suppli
         seed=seed,
         dca=dca,
         mapped_di=mapped_di,
+        chain1=chain1,
+        chain2=chain2,
     )
     self.set_progress(message="", percent=100)
 
 
+@shared_task(base=APITaskBase, bind=True)
+def map_residues_batch_task(self, dca_id, targets, auth_chain_id_supplied=False, wait=True):
+    # Maps one DCA to a list of (pdb_id, chain1, chain2) targets, sharing the DI pairs, the HMM and the structure and alignment caches.
+    # Every MappedDi has the id of the task as its batch, and the first target's has the id of the task.
+    prev_task = CeleryTaskMeta.objects.filter(id=dca_id)
+    if prev_task.exists() and wait:
+        self.set_progress(message="Waiting for DCA", percent=0)
+        prev_task.first().wait_for_completion()
+
+    dca = DirectCouplingAnalysis.objects.get(id=dca_id)
+    seed = get_dca_seed(dca)
+    targets = [tuple(target) for target in targets]
+
+    self.set_progress(message=f"Mapping residues to {len(targets)} targets", percent=10)
+    mapped_dis = [None] * len(targets)
+    mapped = iter_batch_mapped_residues(
+        dca.ranked_di, targets, seed.fasta.path, seed.name, auth_chain_id_supplied=auth_chain_id_supplied, max_workers=settings.MAP_RESIDUES_WORKERS
+    )
+    for done, (k, mapped_di) in enumerate(mapped, start=1):
+        mapped_dis[k] = mapped_di
+        self.set_progress(message=f"Mapped {done} of {len(targets)} targets", percent=10 + 85 * done / len(targets))
+
+    # MappedDi inherits APIDataObject's table, which bulk_create does not support, so the batch is saved in one transaction instead
+    with transaction.atomic():
+        for k, ((pdb_id, chain1, chain2), mapped_di) in enumerate(zip(targets, mapped_dis)):
+            MappedDi.objects.create(
+                id=self.get_task_id() if k == 0 else get_random_uuid(),
+                user=self.get_user(),
+                expires=timezone.now() + settings.DATA_EXPIRATION,
+                protein_name=pdb_id,
+                seed=seed,
+                dca=dca,
+                mapped_di=mapped_di,
+                chain1=chain1,
+                chain2=chain2,
+                batch=self.get_task_id(),
+            )
+    self.set_progress(message="", percent=100)
+
+
 @shared_task(base=APITaskBase, bind=True)
 def generate_contacts_task(
     self, pdb_id: str, ca_only: bool = False, threshold: float = 8, is_cif: bool = True
 ):
     self.set_progress(message="Generating contacts", percent=0)
 
+    structure_info = fetch_structure(pdb_id) if is_cif else fetch_structure(pdb_id, 'pdb')
+    # Contacts of every pair of chains come from a single neighbor search over the structure
+    all_contacts = get_all_contacts(
+        structure_info, ca_only, threshold, max_workers=settings.CONTACTS_WORKERS, parallel_atoms=settings.CONTACTS_PARALLEL_ATOMS
+    )
     contacts_dict = {}
-    if is_cif:
-        structure_info = StructureInformation.fetch_pdb(pdb_id)
-        for chain_id_1 in structure_info.unique_chains:
-            for chain_id_2 in structure_info.unique_chains:
-                contacts_name = f"{chain_id_1} [auth {structure_info.chain_auth_dict[chain_id_1]}], {chain_id_2} [auth {structure_info.chain_auth_dict[chain_id_2]}]"
-                contacts = structure_info.get_contacts(
-                    ca_only, threshold, chain_id_1, chain_id_2
-                )
-                contacts = [(int(a), int(b)) for a, b in contacts] # sets and np ints not JSON serializable
-                contacts_dict[contacts_name] = contacts
-    else:
-        structure_info = StructureInformation.fetch_pdb(pdb_id, 'pdb')
-        for chain_id_1 in structure_info.unique_chains:
-            for chain_id_2 in structure_info.unique_chains:
-                contacts_name = f"{chain_id_1}, {chain_id_2}"
-                contacts = structure_info.get_contacts(
-                    ca_only, threshold, chain_id_1, chain_id_2
-                )
-                contacts = [(int(a), int(b)) for a, b in contacts] # sets and np ints not JSON serializable
-                contacts_dict[contacts_name] = contacts
-    
-    
-            
+    for (chain_id_1, chain_id_2), contacts in all_contacts.items():
+        if is_cif:
+            contacts_name = f"{chain_id_1} [auth {structure_info.chain_auth_dict[chain_id_1]}], {chain_id_2} [auth {structure_info.chain_auth_dict[chain_id_2]}]"
+        else:
+            contacts_name = f"{chain_id_1}, {chain_id_2}"
+        contacts_dict[contacts_name] = contacts.tolist() # np ints not JSON serializable
+
     StructureContacts.objects.create(
         id=self.get_task_id(),
         pdb_id=pdb_id,
@@ -183,6 +568,105 @@ def generate_contacts_task(
     self.set_progress(message="", percent=100)
 
 
+def write_scores_npz(path, headers_path, pottsH_path, count, header_length):
+    """
+    Bundle streamed Hamiltonian scores and their sequence headers into one npz.
+
+    Parameters
+    ----------
+    path : str
+        Destination of the npz, holding a ``headers`` and a ``pottsH`` array in library order.
+    headers_path : Path
+        Text file with one header per line.
+    pottsH_path : Path
+        npy file of the scores.
+    count : int
+        Number of scored sequences.
+    header_length : int
+        Length of the longest header, used as the width of the ``headers`` array.
+    """
+    dtype = np.dtype(f"<U{header_length}")
+    with zipfile.ZipFile(path, "w", allowZip64=True) as zf:
+        with zf.open("pottsH.npy", "w", force_zip64=True) as dest, open(pottsH_path, "rb") as src:
+            shutil.copyfileobj(src, dest)
+        with zf.open("headers.npy", "w", force_zip64=True) as dest, open(headers_path) as src:
+            np.lib.format.write_array_header_2_0(
+                dest, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (count,)}
+            )
+            lines = (line.rstrip("\n") for line in src)
+            while chunk := list(itertools.islice(lines, settings.HAMILTONIAN_TASK_CHUNK_SIZE)):
+                dest.write(np.array(chunk, dtype=dtype).tobytes())
+
+
+@shared_task(base=APITaskBase, bind=True)
+def calculate_hamiltonian_task(self, library_id, dca_id=None, project_id=None, output_format="csv", wait=True):
+    if dca_id is not None:
+        prev_task = CeleryTaskMeta.objects.filter(id=dca_id)
+        if prev_task.exists() and wait:
+            self.set_progress(message="Waiting for DCA", percent=0)
+            prev_task.first().wait_for_completion()
+
+    self.set_progress(message="Loading couplings and local fields", percent=0)
+    if dca_id is not None:
+        dca = DirectCouplingAnalysis.objects.get(id=dca_id)
+        potts_model = dca.get_potts_model()
+    else:
+        dca = None
+        potts_model = get_project_store().get(project_id)
+
+    library = SequenceLibrary.objects.get(id=library_id)
+    total = count_fasta_records(library.fasta.path)
+
+    scores = HamiltonianScores.objects.create(
+        id=self.get_task_id(),
+        user=self.get_user(),
+        expires=timezone.now() + settings.DATA_EXPIRATION,
+        library=library,
+        dca=dca,
+        project_id=project_id or "",
+        output_format=output_format,
+        scores=ContentFile("", f"{library.name}_pottsH.{output_format}"),
+    )
+
+    # Only one chunk of sequences is held in memory at a time
+    def score_chunks():
+        records = iter_fasta_records(library.fasta.path)
+        done = 0
+        while chunk := list(itertools.islice(records, settings.HAMILTONIAN_TASK_CHUNK_SIZE)):
+            headers, sequences = zip(*chunk)
+            yield done, headers, potts_model.hamiltonian(sequences)
+            done += len(chunk)
+            self.set_progress(message=f"Scored {done} of {total} sequences", percent=100 * done / total)
+
+    done = 0
+    if output_format == HamiltonianScores.OutputFormats.NPZ:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pottsH_path = Path(tmpdir) / "pottsH.npy"
+            headers_path = Path(tmpdir) / "headers.txt"
+            out = np.lib.format.open_memmap(pottsH_path, mode="w+", dtype=np.float64, shape=(total,))
+            header_length = 1
+            with open(headers_path, "w") as fh:
+                for start, headers, pottsH in score_chunks():
+                    out[start:start + len(pottsH)] = pottsH
+                    fh.writelines(f"{header}\n" for header in headers)
+                    header_length = max(header_length, *map(len, headers))
+                    done = start + len(pottsH)
+            out.flush()
+            del out
+            write_scores_npz(scores.scores.path, headers_path, pottsH_path, done, header_length)
+    else:
+        with open(scores.scores.path, "w", newline="") as fs:
+            writer = csv.writer(fs)
+            writer.writerow(["header", "pottsH"])
+            for start, headers, pottsH in score_chunks():
+                writer.writerows(zip(headers, pottsH.tolist()))
+                done = start + len(pottsH)
+
+    scores.count = done
+    scores.save()
+    self.set_progress(message="", percent=100)
+
+
 @shared_task
 def cleanup_expired_data():
     old_tasks = APITaskMeta.objects.filter(expires__lte=timezone.now())
@@ -1,18 +1,61 @@
 from django.test import TestCase
 from django.core.files.base import ContentFile
+from django.utils import timezone
 import numpy as np
+import pandas as pd
+import gzip
+import shutil
+import tempfile
+import types
+import re
+from pathlib import Path
+import biotite.structure as struc
+from biotite.sequence import ProteinSequence
+from biotite.structure.io import pdbx
+from .ProSSpeC.calculate_Hamiltonian import PottsModel, calc_Hamiltonian, aa2num, pack_couplings
+from .ProSSpeC.coupling_store import CouplingStore, write_coupling_store
+from .ProSSpeC.mutational_scan import ALPHABET, single_mutant_scan, double_mutant_scan
+from .ProSSpeC.parameter_store import ProjectParameterStore
+from .msautils import (
+    prepare_sequence_database,
+    load_sequence_database,
+    is_sequence_database_current,
+    hmmsearch_from_seed,
+    HMMCache,
+    postprocess_msa,
+    filter_by_consecutive_gaps,
+    get_msa_stats,
+    align_chains,
+    get_mapped_residues,
+    map_ranked_pairs,
+)
+import io
+from .msamatrix import MSAMatrix
+from .modelutils import get_random_uuid
+from .structureutils import StructureRepository, get_all_contacts
+from .dcautils import MeanFieldDCA, PseudoLikelihoodDCA, alignment_boundaries, dca_windows
+from pyhmmer.easel import Alphabet, SequenceFile, TextMSA, TextSequence
+from dcatoolkit import DirectInformationData, ResidueAlignment
 from .tasks import (
     generate_msa_task,
     compute_dca_task,
     map_residues_task,
+    map_residues_batch_task,
     generate_contacts_task,
+    calculate_hamiltonian_task,
+    claim_msa_search,
+    find_or_claim_msa_search,
 )
 from .models import (
+    CeleryTaskMeta,
     SeedSequence,
     MultipleSequenceAlignment,
     DirectCouplingAnalysis,
     MappedDi,
     StructureContacts,
+    SequenceLibrary,
+    HamiltonianScores,
+    MsaSearchClaim,
 )
 
 
@@ -28,6 +71,168 @@ class GenerateMsaTest(TestCase):
         msa = MultipleSequenceAlignment.objects.filter(id=task.id)
         self.assertTrue(msa.exists())
 
+    def test_identical_search_reuses_result(self):
+        seed = "MRGAGAILRPAARGARDLNPRRDISSWLAQWFPRTPARSVVALKTPIKVELVAGKTYRWCVCGRSKKQPFCDGSHFFQRTGLSPLKFKAQETRMVALCTCKATQRPPYCDGTHRSERVQKAEVGSPL"
+        first = MultipleSequenceAlignment.objects.get(id=generate_msa_task.test(seed, msa_name="first").id)
+        second = MultipleSequenceAlignment.objects.get(id=generate_msa_task.test(seed.lower() + "\n", msa_name="second").id)
+        self.assertEqual(second.search_key, first.search_key)
+        self.assertNotEqual(second.seed_id, first.seed_id)
+        self.assertEqual(second.seed.name, "second")
+        self.assertEqual(second.depth, first.depth)
+        with first.fasta.open("r") as a, second.fasta.open("r") as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_claim_search(self):
+        first, second = get_random_uuid(), get_random_uuid()
+        self.assertIsNone(claim_msa_search("key", first))
+        self.assertIsNone(claim_msa_search("key", first))
+        self.assertEqual(claim_msa_search("key", second), first)
+        # A claim held by a task that ended is given up
+        CeleryTaskMeta.objects.create(id=first, time_ended=timezone.now())
+        self.assertIsNone(claim_msa_search("key", second))
+        # And so is one older than MSA_SEARCH_TIMEOUT
+        with self.settings(MSA_SEARCH_TIMEOUT=-1):
+            self.assertIsNone(claim_msa_search("key", first))
+
+    def test_waits_for_claim(self):
+        # A claim whose task never recorded its progress is waited on until it goes stale, then taken over
+        running, waiting = get_random_uuid(), get_random_uuid()
+        self.assertIsNone(claim_msa_search("key", running))
+        task = types.SimpleNamespace(get_task_id=lambda: waiting, set_progress=lambda **kwargs: None)
+        with self.settings(MSA_SEARCH_TIMEOUT=0.2, MSA_SEARCH_POLL_INTERVAL=0.05):
+            self.assertIsNone(find_or_claim_msa_search(task, "key"))
+        self.assertEqual(str(MsaSearchClaim.objects.get(search_key="key").task_id), waiting)
+
+
+class SequenceDatabaseTest(TestCase):
+    def test_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fasta = Path(tmp) / "db.fasta"
+            fasta.write_text(">seq1 first sequence\nMKVLAT\n>seq2\nGGHW\n>seq3 third\nACDEFGHIKLMNPQRSTVWY\n")
+            digitized = Path(tmp) / "db.digitized"
+            self.assertFalse(is_sequence_database_current(str(fasta), str(digitized)))
+            self.assertEqual(prepare_sequence_database(str(fasta), str(digitized), batch_size=2), 3)
+            self.assertTrue(is_sequence_database_current(str(fasta), str(digitized)))
+
+            with SequenceFile(str(fasta), digital=True, alphabet=Alphabet.amino()) as seq_file:
+                expected = seq_file.read_block()
+            loaded = load_sequence_database(str(digitized))
+            self.assertEqual(len(loaded), len(expected))
+            for seq, ref in zip(loaded, expected):
+                self.assertEqual(seq.name, ref.name)
+                self.assertEqual(seq.description, ref.description)
+                self.assertEqual(list(seq.sequence), list(ref.sequence))
+
+
+class ShardedHmmsearchTest(TestCase):
+    def test_matches_serial_search(self):
+        seed = "MRGAGAILRPAARGARDLNPRRDISSWLAQWFPRTPARSVVALKTPIKVELVAGKTYRWCVCGRSKKQPFCDGSHFFQRTGLSPLKFKAQETRMVALCTCKATQRPPYCDGTHRSERVQKAEVGSPL"
+        rng = np.random.default_rng(0)
+        records = []
+        for i in range(40):
+            if i % 4 == 0:
+                seq = "".join(c if rng.random() > 0.2 else rng.choice(list("ACDEFGHIKLMNPQRSTVWY")) for c in seed)
+            else:
+                seq = "".join(rng.choice(list("ACDEFGHIKLMNPQRSTVWY"), size=120))
+            records.append(f">seq{i}\n{seq}\n")
+        with tempfile.TemporaryDirectory() as tmp:
+            seed_path = Path(tmp) / "seed.fasta"
+            seed_path.write_text(f">seed\n{seed}\n")
+            fasta = Path(tmp) / "db.fasta"
+            fasta.write_text("".join(records))
+
+            serial = hmmsearch_from_seed(str(seed_path), "seed", E=1e-3, database_path=str(fasta))
+            sharded = hmmsearch_from_seed(str(seed_path), "seed", E=1e-3, database_path=str(fasta), cpus=3, shard_size=7)
+            self.assertEqual(list(sharded.names), list(serial.names))
+            self.assertEqual(list(sharded.alignment), list(serial.alignment))
+
+
+class PostprocessMsaTest(TestCase):
+    def test_matches_filter_and_stats(self):
+        msa = TextMSA(name=b"hits", sequences=[
+            TextSequence(name=b"a", description=b"first hit", sequence="MK.v--LA-.T"),
+            TextSequence(name=b"b", sequence="MK.a-----.T"),
+            TextSequence(name=b"c", description=b"third", sequence="--..-MKLAtT"),
+        ])
+        for perc_max_gaps in (None, 20, 40):
+            afa = io.BytesIO()
+            msa.write(afa, "afa")
+            expected = io.StringIO()
+            filter_by_consecutive_gaps(afa, expected, perc_max_gaps)
+
+            for block_size in (1, 2, 4096):
+                with tempfile.TemporaryDirectory() as tmp:
+                    output = str(Path(tmp) / "msa.fasta")
+                    rows, cols = postprocess_msa(msa, output, perc_max_gaps, block_size=block_size)
+                    with open(output) as fs:
+                        self.assertEqual(fs.read(), expected.getvalue())
+                    self.assertEqual((rows, cols), get_msa_stats(output))
+
+
+class MSAMatrixTest(TestCase):
+    def setUp(self):
+        self.msa = MSAMatrix.load_from_file(io.StringIO(">a first\nMK.v--\nLA-.T\n>b\nMK.a-----.T\n>c third\n--..-MKLAtT\n"))
+
+    def test_load(self):
+        self.assertEqual((self.msa.depth, self.msa.cols), (3, 11))
+        self.assertEqual(self.msa.headers, ["a first", "b", "c third"])
+
+    def test_continuous_gaps(self):
+        cleaned = self.msa.remove_inserts()
+        self.assertEqual(cleaned.sequences(), ["MK--LA-T", "MK-----T", "---MKLAT"])
+        np.testing.assert_array_equal(cleaned.max_continuous_gaps(), [2, 5, 3])
+        self.assertEqual(cleaned.filter_by_continuous_gaps(3).headers, ["a first", "c third"])
+
+    def test_gap_fractions(self):
+        cleaned = self.msa.remove_inserts()
+        np.testing.assert_allclose(cleaned.row_gap_fraction(), [3 / 8, 5 / 8, 3 / 8])
+        self.assertEqual(cleaned.filter_rows_by_gap_fraction(0.5).headers, ["a first", "c third"])
+        filtered, kept = cleaned.filter_columns_by_gap_fraction(0.5)
+        np.testing.assert_array_equal(kept, [0, 1, 4, 5, 7])
+        self.assertEqual(filtered.sequences(), ["MKLAT", "MK--T", "--KLT"])
+
+
+class MSAClusteringTest(TestCase):
+    def test_cluster_by_identity(self):
+        msa = MSAMatrix(
+            ["a", "b", "c", "d", "e"],
+            np.frombuffer(b"ACDEFGHIKL" b"ACDEFGHIKV" b"WYWYWYWYWY" b"ACDEFGHIVV" b"WYWYWYWYWA", dtype=np.uint8).reshape(5, 10),
+        )
+        for block_size in (1, 2, 1024):
+            representatives, labels = msa.cluster_by_identity(0.9, block_size=block_size, workers=2)
+            np.testing.assert_array_equal(representatives, [0, 2, 3])
+            np.testing.assert_array_equal(labels, [0, 0, 2, 3, 2])
+
+    def test_stratified_subsample(self):
+        rows = [b"ACDEFGHIKL"] * 6 + [b"WYWYWYWYWY"] * 3 + [b"MNPQRSTVMN"]
+        msa = MSAMatrix([str(i) for i in range(len(rows))], np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(len(rows), 10))
+        kept = msa.stratified_subsample(4, identity=0.8, seed=1)
+        self.assertEqual(len(kept), 4)
+        # Every cluster is represented before any gets a second row
+        self.assertIn(9, kept)
+        self.assertTrue(np.any(kept < 6) and np.any((kept >= 6) & (kept < 9)))
+        np.testing.assert_array_equal(kept, msa.stratified_subsample(4, identity=0.8, seed=1))
+        np.testing.assert_array_equal(msa.stratified_subsample(20), np.arange(10))
+
+
+class HMMCacheTest(TestCase):
+    def test_reuses_built_hmm(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            seed_path = Path(tmp) / "seed.fasta"
+            seed_path.write_text(">seed\nMRGAGAILRPAARGARDLNPRRDISSWLAQWFPRTPARSVVALKTPIKVELVAGKTYRWCVCGRSKKQPFCDGSHFF\n")
+            cache_dir = Path(tmp) / "hmm"
+
+            _, hmm, profile, _ = HMMCache(cache_dir).get(str(seed_path), "seed")
+            self.assertEqual(len(list(cache_dir.glob("*.h3m"))), 1)
+
+            # A new process-level cache reads the HMM back from disk instead of rebuilding it
+            _, cached_hmm, cached_profile, _ = HMMCache(cache_dir).get(str(seed_path), "seed")
+            self.assertEqual(cached_hmm, hmm)
+            self.assertEqual(cached_profile, profile)
+
+            HMMCache(cache_dir).get(str(seed_path), "other_seed")
+            self.assertEqual(len(list(cache_dir.glob("*.h3m"))), 2)
+
 
 class ComputeDcaTest(TestCase):
     def setUp(self):
@@ -57,7 +262,98 @@ class ComputeDcaTest(TestCase):
         task = compute_dca_task.test(self.msa.id)
         dca = DirectCouplingAnalysis.objects.filter(id=task.id)
         self.assertTrue(dca.exists())
-        self.assertEqual(dca.first().ranked_di.shape, (127 * 126 // 2, 3))
+        # Only the 5000 highest ranked of the 127 * 126 / 2 pairs are kept, see rank_di
+        self.assertEqual(dca.first().ranked_di.shape, (5000, 3))
+
+    def test_theta_sweep(self):
+        task = compute_dca_task.test(self.msa.id, thetas=[0.2, 0.5])
+        dcas = DirectCouplingAnalysis.objects.filter(sweep=task.id).order_by("created")
+        self.assertEqual([dca.theta for dca in dcas], [0.2, 0.5])
+        self.assertEqual(str(dcas[0].id), str(task.id))
+        self.assertEqual(dcas[0].ranked_di.shape, (5000, 3))
+        # Wider neighbourhoods can only lower the sequence weights
+        self.assertGreaterEqual(dcas[0].m_eff, dcas[1].m_eff)
+
+    def test_plm_engine(self):
+        task = compute_dca_task.test(self.msa.id, engine="plm")
+        dca = DirectCouplingAnalysis.objects.get(id=task.id)
+        self.assertEqual(dca.engine, "plm")
+        self.assertEqual(dca.ranked_di.shape, (5000, 3))
+        self.assertEqual(dca.get_potts_model().length, 127)
+
+    def test_reuses_sequence_weights(self):
+        # py-mfdca computes its own weights, so they are stored for the dcautils engines only
+        first = DirectCouplingAnalysis.objects.get(id=compute_dca_task.test(self.msa.id, theta=0.3, precision="float32").id)
+        self.assertEqual(len(first.weights), 6)
+        first.weights = np.full(6, 0.5)
+        first.save()
+        second = DirectCouplingAnalysis.objects.get(id=compute_dca_task.test(self.msa.id, theta=0.3, precision="float32").id)
+        np.testing.assert_array_equal(second.weights, first.weights)
+        self.assertEqual(second.m_eff, 3)
+
+    def test_windows(self):
+        task = compute_dca_task.test(self.msa.id, window_size=60, window_overlap=10)
+        dca = DirectCouplingAnalysis.objects.get(id=task.id)
+        windows = dca.windows.tolist()
+        self.assertEqual(windows, [[0, 60], [50, 110], [100, 127]])
+        self.assertEqual(dca.get_potts_model().length, 127)
+        # Every pair is scored by a window holding it, and pairs only in the first window by its fit
+        i, j = dca.ranked_di[:, 0] - 1, dca.ranked_di[:, 1] - 1
+        self.assertTrue(np.any([(i >= start) & (j < stop) for start, stop in windows], axis=0).all())
+        first = (j < 50) & (i < j)
+        model = MeanFieldDCA(MSAMatrix.load_from_file(self.msa.fasta.path).encode()[:, :60])
+        fit = model.fit(dca.weights)
+        expected = {(int(a), int(b)): di for a, b, di in fit.DI}
+        np.testing.assert_allclose(dca.ranked_di[first, 2], [expected[int(a), int(b)] for a, b in dca.ranked_di[first, :2]])
+
+
+class DCAWindowsTest(TestCase):
+    def test_windows(self):
+        self.assertEqual(dca_windows(1000, 300, 60), [(0, 300), (240, 540), (480, 780), (720, 1000)])
+        self.assertEqual(dca_windows(250, 300, 60), [(0, 250)])
+        # Windows end past the last boundary in their second half
+        self.assertEqual(dca_windows(1000, 300, 60, [100, 240, 700]), [(0, 270), (210, 510), (450, 730), (670, 970), (910, 1000)])
+        self.assertRaises(ValueError, dca_windows, 1000, 300, 150)
+
+    def test_alignment_boundaries(self):
+        codes = np.ones((20, 30), dtype=np.uint8)
+        codes[:8, 12:] = 0
+        codes[8:15, :12] = 0
+        codes[19, 5:] = 0
+        np.testing.assert_array_equal(alignment_boundaries(codes, min_fraction=0.2), [12])
+
+
+class MeanFieldDCATest(TestCase):
+    def test_sequence_weights(self):
+        codes = np.random.default_rng(0).integers(0, 3, size=(40, 6)).astype(np.uint8)
+        distances = (codes[:, None] != codes[None]).mean(axis=2)
+        weights = MeanFieldDCA(codes).sequence_weights([0.2, 0.5, 0], block_bytes=4096, workers=2)
+        for theta, theta_weights in zip([0.2, 0.5], weights):
+            np.testing.assert_allclose(theta_weights, 1 / (distances < theta).sum(axis=1))
+        np.testing.assert_array_equal(weights[2], np.ones(40))
+
+    def test_float32_fit(self):
+        rng = np.random.default_rng(0)
+        codes = np.where(rng.random((200, 12)) < 0.3, rng.integers(0, 21, (200, 12)), rng.integers(0, 21, 12)).astype(np.uint8)
+        codes[:, 6] = codes[:, 2]
+        model = MeanFieldDCA(codes)
+        weights = model.sequence_weights([0.2])[0]
+        fit64 = model.fit(weights)
+        fit32 = model.fit(weights, dtype=np.float32)
+        self.assertEqual(fit32.couplings.dtype, np.float32)
+        np.testing.assert_allclose(fit32.DI, fit64.DI, atol=1e-4)
+        np.testing.assert_array_equal(np.argsort(-fit32.DI[:, 2])[:12], np.argsort(-fit64.DI[:, 2])[:12])
+
+
+class PseudoLikelihoodDCATest(TestCase):
+    def test_finds_coupled_pair(self):
+        rng = np.random.default_rng(0)
+        codes = np.where(rng.random((300, 10)) < 0.4, rng.integers(0, 21, (300, 10)), rng.integers(0, 21, 10)).astype(np.uint8)
+        codes[:, 6] = codes[:, 2]
+        model = PseudoLikelihoodDCA(codes)
+        fit = model.fit(model.sequence_weights([0.2])[0], workers=2)
+        self.assertEqual(fit.couplings.shape, (10, 10, 21, 21))
+        np.testing.assert_array_equal(fit.DI[fit.DI[:, 2].argmax(), :2], [3, 7])
 
 
 class MapResiduesTest(TestCase):
@@ -85,6 +381,105 @@ class MapResiduesTest(TestCase):
             )
         )
 
+    def test_heterodimer(self):
+        # Chains covering different parts of the seed map each side of a pair through their own alignment
+        seed_sequence = self.seed.fasta.open("r").read().splitlines()[1]
+        self.seed.fasta.close()
+        mirror_dir = tempfile.mkdtemp()
+        write_test_structure(Path(mirror_dir) / "1het.cif", {"A": seed_sequence[20:80], "B": seed_sequence[50:120]})
+        ranked_di = np.array([[30, 70, 5.0], [40, 60, 2.0]])
+        with self.settings(STRUCTURE_MIRROR_DIR=mirror_dir, STRUCTURE_CACHE_DIR=None, STRUCTURE_OFFLINE=True):
+            mapped_di = get_mapped_residues(ranked_di, "1het", self.seed.fasta.path, "map_residues_test", "1het", "A", "B")
+        self.assertTrue(np.allclose(mapped_di.tolist(), [(10, 20, 5.0), (20, 10, 2.0)]))
+
+        alignments = align_chains([seed_sequence[20:80], seed_sequence[20:80]], self.seed.fasta.path, "map_residues_test", "1het")
+        self.assertIs(alignments[0], alignments[1])
+        self.assertIs(align_chains([seed_sequence[20:80]], self.seed.fasta.path, "map_residues_test", "1het")[0], alignments[0])
+
+    def test_map_ranked_pairs(self):
+        res_align1 = ResidueAlignment("seed", "protein", 3, 10, "ACD-EFGHIK.LMNPQRSTVW", "AC-WEFG.IKLLMNPQRS-V")
+        res_align2 = ResidueAlignment("seed", "protein", 1, 1, "ACDEFGHIKLMNPQRSTVWY", "ACDEF-HIKLMNPQRSTVWY", list(enumerate("ACDEFHIKLMNPQRSTVWY", start=5)))
+        rng = np.random.default_rng(0)
+        pair_i, pair_j = np.triu_indices(25, k=1)
+        # Rounded DIs have ties, and residue 0 is outside both alignments
+        ranked_di = np.column_stack([pair_i, pair_j + 1, np.round(rng.random(len(pair_i)), 1)])[rng.permutation(len(pair_i))]
+        DI_data = DirectInformationData.load_as_ndarray(ranked_di)
+        for options in ({"pairs_only": True}, {"pairs_only": False}, {"pairs_only": True, "mirror": True, "number": 10}):
+            expected = DI_data.get_ranked_mapped_pairs(res_align1, res_align2, **options)
+            mapped = map_ranked_pairs(DI_data, res_align1, res_align2, **options)
+            self.assertEqual(mapped.dtype, expected.dtype)
+            self.assertTrue(np.array_equal(mapped, expected))
+
+    def test_batch(self):
+        seed_sequence = self.seed.fasta.open("r").read().splitlines()[1]
+        self.seed.fasta.close()
+        self.seed.name = "map_residues_test"
+        self.seed.save()
+        mirror_dir = tempfile.mkdtemp()
+        write_test_structure(Path(mirror_dir) / "1het.cif", {"A": seed_sequence[20:80], "B": seed_sequence[50:120]})
+        write_test_structure(Path(mirror_dir) / "2het.cif", {"C": seed_sequence[10:90]})
+        msa = MultipleSequenceAlignment.objects.create(seed=self.seed)
+        dca = DirectCouplingAnalysis.objects.create(msa=msa, ranked_di=np.array([[30, 70, 5.0], [40, 60, 2.0]]))
+        targets = [("1het", "A", "B"), ("1het", "B", "A"), ("2het", "C", "C")]
+        with self.settings(STRUCTURE_MIRROR_DIR=mirror_dir, STRUCTURE_CACHE_DIR=None, STRUCTURE_OFFLINE=True):
+            task = map_residues_batch_task.test(dca.id, targets)
+
+        mapped_dis = {(m.protein_name, m.chain1, m.chain2): m for m in MappedDi.objects.filter(batch=task.id)}
+        self.assertEqual(set(mapped_dis), set(targets))
+        self.assertEqual(MappedDi.objects.get(id=task.id).chain1, "A")
+        self.assertTrue(np.allclose(mapped_dis["1het", "A", "B"].mapped_di.tolist(), [(10, 20, 5.0), (20, 10, 2.0)]))
+        # Chain B starts after the first residue of both pairs
+        self.assertEqual(mapped_dis["1het", "B", "A"].mapped_di.tolist(), [])
+        self.assertTrue(np.allclose(mapped_dis["2het", "C", "C"].mapped_di.tolist(), [(20, 60, 5.0), (30, 50, 2.0)]))
+
+
+def write_test_structure(path, chains):
+    """
+    Write an mmCIF stand-in for a PDB entry: straight backbones of the given {chain id: sequence}, 3.8 A between residues and 6 A between chains.
+    """
+    atoms = []
+    for c, (chain_id, sequence) in enumerate(chains.items()):
+        for k, aa in enumerate(sequence):
+            for name, element, offset in (("N", "N", -1.2), ("CA", "C", 0.0), ("C", "C", 1.2)):
+                atoms.append(struc.Atom(
+                    [3.8 * k + offset, 6.0 * c, 0.0], chain_id=chain_id, res_id=k + 1,
+                    res_name=ProteinSequence.convert_letter_1to3(aa), atom_name=name, element=element,
+                ))
+    array = struc.array(atoms)
+    array.add_annotation("b_factor", dtype=float)
+    cif = pdbx.CIFFile()
+    pdbx.set_structure(cif, array)
+    cif.block["entity_poly"] = pdbx.CIFCategory({
+        "entity_id": [str(i + 1) for i in range(len(chains))],
+        "type": ["polypeptide(L)"] * len(chains),
+        "pdbx_seq_one_letter_code_can": list(chains.values()),
+        "pdbx_strand_id": list(chains),
+    })
+    cif.write(str(path))
+
+
+class StructureRepositoryTest(TestCase):
+    def setUp(self):
+        self.mirror_dir = Path(tempfile.mkdtemp())
+        self.cache_dir = Path(tempfile.mkdtemp())
+        (self.mirror_dir / "ts").mkdir()
+        write_test_structure(self.mirror_dir / "test.cif", {"A": "MKVLAT", "B": "GSHM"})
+        with open(self.mirror_dir / "test.cif", "rb") as src, gzip.open(self.mirror_dir / "ts" / "1tst.cif.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    def test_offline_mirror(self):
+        repository = StructureRepository(self.cache_dir, self.mirror_dir, offline=True)
+        structure = repository.get("1TST")
+        self.assertEqual(structure.get_full_sequence("A"), "MKVLAT")
+        self.assertIs(repository.get("1tst"), structure)
+        self.assertRaises(FileNotFoundError, repository.get, "2tst")
+        self.assertRaises(ValueError, repository.get, "../1tst")
+
+        # Other processes load the pickled structure without the mirror
+        shutil.rmtree(self.mirror_dir)
+        reloaded = StructureRepository(self.cache_dir, offline=True).get("1tst")
+        self.assertEqual(reloaded.get_non_missing_sequence("B"), "GSHM")
+
 
 class GenerateContactsTest(TestCase):
     def setUp(self):
@@ -96,3 +491,214 @@ class GenerateContactsTest(TestCase):
         )
         mappedDi = StructureContacts.objects.filter(id=task.id)
         self.assertTrue(mappedDi.exists())
+
+    def test_local_structure(self):
+        mirror_dir = Path(tempfile.mkdtemp())
+        write_test_structure(mirror_dir / "1tst.cif", {"A": "MKVLAT", "B": "GSHM"})
+        with self.settings(STRUCTURE_MIRROR_DIR=mirror_dir, STRUCTURE_CACHE_DIR=Path(tempfile.mkdtemp()), STRUCTURE_OFFLINE=True):
+            task = generate_contacts_task.test("1tst", ca_only=True, threshold=7)
+        contacts = StructureContacts.objects.get(id=task.id).contacts
+        self.assertEqual(sorted(contacts["A [auth A], B [auth B]"]), [[1, 1], [2, 2], [3, 3], [4, 4]])
+        self.assertEqual(sorted(contacts["A [auth A], A [auth A]"]), [[k, k + 1] for k in range(1, 6)])
+
+    def test_all_contacts(self):
+        path = Path(tempfile.mkdtemp()) / "1tst.cif"
+        write_test_structure(path, {"A": "MKVLATGSHM", "B": "GSHMKV", "C": "MKVLAT"})
+        structure = StructureRepository.parse(path)
+        for ca_only in (False, True):
+            expected = {
+                (chain1, chain2): structure.get_contacts(ca_only, 8, chain1, chain2)
+                for chain1 in structure.unique_chains for chain2 in structure.unique_chains
+            }
+            # A single pass, and one chain at a time
+            for parallel_atoms in (None, 1):
+                contacts = get_all_contacts(structure, ca_only, 8, max_workers=2, parallel_atoms=parallel_atoms)
+                self.assertEqual(list(contacts), list(expected))
+                self.assertEqual({chains: set(map(tuple, pairs.tolist())) for chains, pairs in contacts.items()}, expected)
+
+
+class CalculateHamiltonianTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.L = 12
+        self.couplings = rng.normal(size=(21 * self.L, 21 * self.L))
+        self.local_fields = rng.normal(size=(21, self.L))
+        alphabet = list(aa2num)
+        self.sequences = ["".join(rng.choice(alphabet, self.L)) for _ in range(20)]
+
+    def test_matches_per_pair_sum(self):
+        expected = []
+        for seq in self.sequences:
+            nums = [aa2num[aa] for aa in seq]
+            H = np.sum([self.local_fields[num, pos] for pos, num in enumerate(nums)])
+            H += np.sum([
+                self.couplings[21 * i + nums[i], 21 * j + nums[j]]
+                for i in range(self.L) for j in range(i + 1, self.L)
+            ])
+            expected.append(-H)
+        pottsH = calc_Hamiltonian(self.sequences, self.couplings, self.local_fields, chunk_size=3)
+        self.assertTrue(np.array_equal(pottsH, expected))
+
+    def test_unknown_residues(self):
+        # Non-ASCII residues are reported like any other unknown residue
+        for sequence, bad in (("ACDEFGHIKLMX", "['X']"), ("ACDEFGHIKLMé", "['é']"), ("ACDEFGHIKLMΩ", "['Ω']")):
+            with self.assertRaisesRegex(KeyError, re.escape(bad)):
+                calc_Hamiltonian([sequence], self.couplings, self.local_fields)
+
+
+class ProjectParameterStoreTest(TestCase):
+    def setUp(self):
+        self.projects_dir = Path(tempfile.mkdtemp())
+        (self.projects_dir / "local_fields").mkdir()
+        (self.projects_dir / "couplings").mkdir()
+        rng = np.random.default_rng(1)
+        L = 8
+        self.couplings = rng.normal(size=(21 * L, 21 * L))
+        self.local_fields = rng.normal(size=(21, L))
+        pd.DataFrame(self.couplings).to_csv(self.projects_dir / "couplings" / "test.csv", header=False, index=False)
+        pd.DataFrame(self.local_fields).to_csv(self.projects_dir / "local_fields" / "test.csv", header=False, index=False)
+        self.sequences = ["".join(rng.choice(list(aa2num), L)) for _ in range(5)]
+        self.store = ProjectParameterStore(self.projects_dir, self.projects_dir / "store", 2 ** 30)
+
+    def test_store(self):
+        expected = calc_Hamiltonian(
+            self.sequences,
+            pd.read_csv(self.projects_dir / "couplings" / "test.csv", header=None),
+            pd.read_csv(self.projects_dir / "local_fields" / "test.csv", header=None),
+        )
+        model = self.store.get("test")
+        self.assertTrue(self.store.is_built("test"))
+        self.assertTrue(np.array_equal(model.hamiltonian(self.sequences), expected))
+        self.assertIs(self.store.get("test"), model)
+
+        self.store.invalidate("test")
+        self.assertFalse(self.store.is_built("test"))
+        self.assertIsNot(self.store.get("test"), model)
+        self.assertRaises(ValueError, self.store.get, "../test")
+
+
+class CouplingStoreTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.L = 9
+        self.couplings = pack_couplings(rng.normal(size=(21 * self.L, 21 * self.L))).astype(np.float32)
+        # Pairs get increasingly strong couplings
+        self.couplings *= (np.arange(1, len(self.couplings) + 1) / np.linalg.norm(self.couplings, axis=(1, 2)))[:, None, None]
+        self.local_fields = rng.normal(size=(21, self.L)).astype(np.float32)
+        self.sequences = ["".join(rng.choice(list(aa2num), self.L)) for _ in range(6)]
+
+    def write(self, **kwargs):
+        path = Path(tempfile.mkdtemp()) / "couplings.dcac"
+        with open(path, "wb") as fs:
+            write_coupling_store(fs, self.couplings, self.local_fields, **kwargs)
+        return CouplingStore(path)
+
+    def test_all_pairs(self):
+        store = self.write()
+        self.assertTrue(store.complete)
+        dense = PottsModel(self.couplings, self.local_fields)
+        self.assertTrue(np.allclose(store.potts_model().hamiltonian(self.sequences), dense.hamiltonian(self.sequences)))
+        self.assertTrue(np.allclose(store.pair_norms(2, 0), np.linalg.norm(self.couplings[1])))
+
+    def test_top_pairs(self):
+        store = self.write(top_k=5)
+        n_pairs = len(self.couplings)
+        self.assertEqual(store.n_blocks, 5)
+        self.assertTrue(np.array_equal(store.pairs, np.arange(n_pairs - 5, n_pairs)))
+        self.assertTrue(np.allclose(store.norms, np.linalg.norm(self.couplings, axis=(1, 2))))
+
+        blocks, stored = store.pair_blocks([7, 0, 8], [8, 1, 6])
+        self.assertTrue(np.array_equal(stored, [True, False, True]))
+        self.assertTrue(np.array_equal(blocks[0], self.couplings[-1]))
+        self.assertFalse(blocks[1].any())
+        self.assertTrue(np.array_equal(blocks[2], self.couplings[-2].T))
+
+        # Missing pairs have zero couplings
+        sparse = self.couplings.copy()
+        sparse[:-5] = 0
+        expected = PottsModel(sparse, self.local_fields)
+        model = store.potts_model()
+        self.assertTrue(np.allclose(model.hamiltonian(self.sequences), expected.hamiltonian(self.sequences)))
+        self.assertTrue(np.allclose(single_mutant_scan(model, self.sequences[0]), single_mutant_scan(expected, self.sequences[0])))
+
+    def test_byte_budget(self):
+        full = self.write()
+        store = self.write(max_bytes=Path(full.norms.filename).stat().st_size - 3 * 21 * 21 * 4)
+        self.assertLess(store.n_blocks, len(self.couplings) - 2)
+        self.assertGreater(store.n_blocks, 0)
+        self.assertEqual(len(self.write(top_k=0).pairs), 0)
+
+
+class MutationalScanTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        L = 10
+        self.model = PottsModel(rng.normal(size=(21 * L, 21 * L)), rng.normal(size=(21, L)))
+        self.wild_type = "".join(rng.choice(list(ALPHABET[1:]), L))
+
+    def mutate(self, sequence, position, residue):
+        return sequence[:position] + residue + sequence[position + 1:]
+
+    def test_single_mutants(self):
+        dH = single_mutant_scan(self.model, self.wild_type)
+        wt_H = self.model.hamiltonian([self.wild_type])[0]
+        mutants = [self.mutate(self.wild_type, i, aa) for i in range(len(self.wild_type)) for aa in ALPHABET]
+        expected = (self.model.hamiltonian(mutants) - wt_H).reshape(len(self.wild_type), len(ALPHABET))
+        self.assertTrue(np.allclose(dH, expected))
+
+    def test_double_mutants(self):
+        wt = self.wild_type
+        dH = double_mutant_scan(self.model, wt, [(f"{wt[1]}2G", f"{wt[6]}7W")])
+        mutant = self.mutate(self.mutate(wt, 1, "G"), 6, "W")
+        expected = self.model.hamiltonian([mutant])[0] - self.model.hamiltonian([wt])[0]
+        self.assertTrue(np.allclose(dH, [expected]))
+
+    def test_trimmed_columns(self):
+        # Parameters fitted without columns 1 and 4 score full-length sequences, ignoring those columns
+        column_map = np.array([0, -1, 1, 2, -1, 3, 4, 5, 6, 7, 8, 9])
+        trimmed = PottsModel(self.model.couplings, self.model.local_fields, column_map=column_map)
+        wt = self.wild_type[:1] + "A" + self.wild_type[1:3] + "C" + self.wild_type[3:]
+        self.assertTrue(np.allclose(trimmed.hamiltonian([wt]), self.model.hamiltonian([self.wild_type])))
+
+        dH = single_mutant_scan(trimmed, wt)
+        self.assertTrue(np.allclose(dH[[1, 4]], 0))
+        self.assertTrue(np.allclose(dH[column_map >= 0], single_mutant_scan(self.model, self.wild_type)))
+        double = double_mutant_scan(trimmed, wt, [(f"{wt[0]}1G", f"{wt[6]}7W"), ("A2G", f"{wt[6]}7W")])
+        expected = double_mutant_scan(self.model, self.wild_type, [(f"{wt[0]}1G", f"{wt[6]}5W")])
+        self.assertTrue(np.allclose(double, [expected[0], dH[6, ALPHABET.index("W")]]))
+
+
+class CalculateHamiltonianTaskTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        L = 6
+        self.couplings = rng.normal(size=(21 * L, 21 * L))
+        self.local_fields = rng.normal(size=(21, L))
+        self.dca = DirectCouplingAnalysis.objects.create()
+        self.dca.save_potts_parameters(self.couplings, self.local_fields.T, L)
+        self.dca.save()
+        self.sequences = {f"seq{i}": "".join(rng.choice(list(aa2num), L)) for i in range(7)}
+        self.library = SequenceLibrary.objects.create(
+            name="library_test",
+            fasta=ContentFile("".join(f">{k}\n{v}\n" for k, v in self.sequences.items()), "library_test"),
+        )
+
+    def test_task(self):
+        with self.settings(HAMILTONIAN_TASK_CHUNK_SIZE=3):
+            task = calculate_hamiltonian_task.test(self.library.id, dca_id=self.dca.id, output_format="csv")
+        scores = HamiltonianScores.objects.get(id=task.id)
+        self.assertEqual(scores.count, len(self.sequences))
+        table = pd.read_csv(scores.scores.path)
+        expected = calc_Hamiltonian(self.sequences.values(), self.couplings, self.local_fields)
+        self.assertEqual(table["header"].tolist(), list(self.sequences))
+        self.assertTrue(np.allclose(table["pottsH"], expected, atol=1e-4))
+
+    def test_npz(self):
+        with self.settings(HAMILTONIAN_TASK_CHUNK_SIZE=3):
+            task = calculate_hamiltonian_task.test(self.library.id, dca_id=self.dca.id, output_format="npz")
+        scores = HamiltonianScores.objects.get(id=task.id)
+        self.assertEqual(scores.count, len(self.sequences))
+        expected = calc_Hamiltonian(self.sequences.values(), self.couplings, self.local_fields)
+        with np.load(scores.scores.path) as table:
+            self.assertEqual(table["headers"].tolist(), list(self.sequences))
+            self.assertTrue(np.allclose(table["pottsH"], expected, atol=1e-4))
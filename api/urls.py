@@ -14,11 +14,16 @@ from .views import (
     DCAViewSet,
     MappedDiViewSet,
     StructureContactsViewSet,
+    HamiltonianScoresViewSet,
     GenerateMsa,
     ComputeDca,
     MapResidues,
+    MapResiduesBatch,
     GenerateContacts,
     CalculateHamiltonian,
+    CalculateHamiltonianJob,
+    MutationalScan,
+    DcaCouplings,
     AlignSequences2HMM
 )
 
@@ -37,8 +42,12 @@ urlpatterns = [
     path("generate-msa/", GenerateMsa.as_view()),
     path("compute-dca/", ComputeDca.as_view()),
     path("map-residues/", MapResidues.as_view()),
+    path("map-residues-batch/", MapResiduesBatch.as_view()),
     path("generate-contacts/", GenerateContacts.as_view()),
     path("hamiltonian/", CalculateHamiltonian.as_view()),
+    path("hamiltonian-job/", CalculateHamiltonianJob.as_view()),
+    path("mutational-scan/", MutationalScan.as_view()),
+    path("dca-couplings/", DcaCouplings.as_view()),
     path("align2hmm/", AlignSequences2HMM.as_view())
 ]
 
@@ -50,5 +59,6 @@ router.register("msas", MSAViewSet, basename='msa')
 router.register("dcas", DCAViewSet, basename='dca')
 router.register("mapped-dis", MappedDiViewSet, basename='mapped-di')
 router.register("structure-contacts", StructureContactsViewSet, basename='structure-contact')
+router.register("hamiltonian-scores", HamiltonianScoresViewSet, basename='hamiltonian-score')
 
 urlpatterns += router.urls
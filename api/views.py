@@ -6,7 +6,10 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, parsers, mixins, viewsets
 from drf_spectacular.utils import extend_schema
-from .ProSSpeC.calculate_Hamiltonian import calc_Hamiltonian
+from .ProSSpeC.calculate_Hamiltonian import PottsModel
+from .ProSSpeC.parameter_store import get_project_store
+from .ProSSpeC.mutational_scan import ALPHABET, single_mutant_scan, double_mutant_scan
+import numpy as np
 import pandas as pd
 from io import BytesIO
 import json
@@ -23,8 +26,13 @@ from .serializers import (
     ComputeDCASerializer,
     DCASerializer,
     MapResiduesSerializer,
+    MapResiduesBatchSerializer,
     MappedDiSerializer,
     CalculateHamiltonianSerializer,
+    MutationalScanSerializer,
+    DCACouplingsSerializer,
+    HamiltonianJobSerializer,
+    HamiltonianScoresSerializer,
     Align2HMMSerializer
 )
 from .models import (
@@ -35,12 +43,16 @@ from .models import (
     MultipleSequenceAlignment,
     DirectCouplingAnalysis,
     StructureContacts,
+    SequenceLibrary,
+    HamiltonianScores,
 )
 from .tasks import (
     generate_contacts_task,
     generate_msa_task,
     compute_dca_task,
     map_residues_task,
+    map_residues_batch_task,
+    calculate_hamiltonian_task,
 )
 from .viewutils import (
     # UsersReadOnlyModelViewSet,
@@ -103,6 +115,11 @@ class StructureContactsViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSe
     queryset = StructureContacts.objects.all()
 
 
+class HamiltonianScoresViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = HamiltonianScoresSerializer
+    queryset = HamiltonianScores.objects.all()
+
+
 class GenerateMsa(APIView):
     serializer_class = GenerateMSASerializer
     throttle_scope = "long_task"
@@ -120,6 +137,9 @@ class GenerateMsa(APIView):
                 params.validated_data.get("msa_name"),
                 params.validated_data.get("E"),
                 params.validated_data.get("perc_max_gaps"),
+                perc_identity=params.validated_data.get("perc_identity"),
+                max_depth=params.validated_data.get("max_depth"),
+                subsample_seed=params.validated_data.get("subsample_seed", 0),
                 user=get_request_user(request),
                 session_key=get_request_session(request),
             )
@@ -144,6 +164,15 @@ class ComputeDca(APIView):
             task = compute_dca_task.start(
                 params.validated_data.get("msa_id"),
                 params.validated_data.get("theta"),
+                max_depth=params.validated_data.get("max_depth"),
+                subsample_seed=params.validated_data.get("subsample_seed", 0),
+                perc_max_col_gaps=params.validated_data.get("perc_max_col_gaps"),
+                thetas=params.validated_data.get("thetas"),
+                precision=params.validated_data.get("precision"),
+                engine=params.validated_data.get("engine"),
+                window_size=params.validated_data.get("window_size"),
+                window_overlap=params.validated_data.get("window_overlap"),
+                domain_windows=params.validated_data.get("domain_windows"),
                 user=get_request_user(request),
                 session_key=get_request_session(request),
             )
@@ -180,6 +209,31 @@ class MapResidues(APIView):
         return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MapResiduesBatch(APIView):
+    serializer_class = MapResiduesBatchSerializer
+    throttle_scope = "long_task"
+
+    @extend_schema(
+        request=MapResiduesBatchSerializer,
+        responses={202: TaskSerializer},
+    )
+    def post(self, request, format=None):
+        params = MapResiduesBatchSerializer(data=request.data)
+
+        if params.is_valid():
+            task = map_residues_batch_task.start(
+                params.validated_data.get("dca_id"),
+                [(target["pdb_id"], target["chain1"], target["chain2"]) for target in params.validated_data.get("targets")],
+                params.validated_data.get("auth_chain_id_supplied"),
+                user=get_request_user(request),
+                session_key=get_request_session(request),
+            )
+
+            resp = TaskSerializer(task)
+            return Response(resp.data, status=status.HTTP_202_ACCEPTED)
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 class GenerateContacts(APIView):
     serializer_class = GenerateContactsSerializer
     throttle_scope = "long_task"
@@ -206,6 +260,37 @@ class GenerateContacts(APIView):
         return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def load_potts_model(validated_data):
+    """
+    Potts parameters of a PottsParametersSerializer request: a stored DCA, a precomputed project or uploaded CSVs.
+    """
+    project_id = validated_data.get("project_id")
+    dca_id = validated_data.get("dca_id")
+    if dca_id:
+        try:
+            return DirectCouplingAnalysis.objects.get(id=dca_id).get_potts_model()
+        except Exception as e:
+            raise ValueError(str(e)+ "Could not load DCA couplings and local fields")
+
+    elif project_id:
+        try:
+            return get_project_store().get(project_id)
+        except Exception as e:
+            raise ValueError(str(e)+ "Could not load project files")
+
+    else:
+        local_fields = validated_data.get("local_fields")
+        couplings = validated_data.get("couplings")
+
+        try:
+            lf = pd.read_csv(local_fields, header=None)
+            coup = pd.read_csv(couplings, header=None)
+            return PottsModel(coup, lf)
+
+        except Exception as e:
+            raise ValueError(str(e)+ "Could not read local fields or couplings")
+
+
 class CalculateHamiltonian(APIView):
     serializer_class = CalculateHamiltonianSerializer
 
@@ -220,31 +305,17 @@ class CalculateHamiltonian(APIView):
             sequences = request.data.get("sequences")
         
         
-        params = CalculateHamiltonianSerializer(data={"sequences":sequences, "local_fields": request.data.get("local_fields"), "couplings": request.data.get("couplings"),'pottsH':None, 'project_id': request.data.get("project_id")})
+        params = CalculateHamiltonianSerializer(data={"sequences":sequences, "local_fields": request.data.get("local_fields"), "couplings": request.data.get("couplings"),'pottsH':None, 'project_id': request.data.get("project_id"), 'dca_id': request.data.get("dca_id")})
 
         if params.is_valid():
             sequences = params.validated_data.get("sequences")
-            project_id = params.validated_data.get("project_id")
-            if project_id:
-                try:
-                    lf = pd.read_csv(f"data/local_fields/{project_id}.csv", header=None)
-                    coup = pd.read_csv(f"data/couplings/{project_id}.csv", header=None)
-                except Exception as e:
-                    return Response({"Error": str(e)+ "Could not load project files"},status=status.HTTP_400_BAD_REQUEST)
-
-            else:
-                local_fields = params.validated_data.get("local_fields")
-                couplings = params.validated_data.get("couplings")
-            
-                try:
-                    lf = pd.read_csv(local_fields, header=None)
-                    coup = pd.read_csv(couplings, header=None)
-                
-                except Exception as e:
-                    return Response({"Error": str(e)+ "Could not read local fields or couplings"},status=status.HTTP_400_BAD_REQUEST)
+            try:
+                potts_model = load_potts_model(params.validated_data)
+            except ValueError as e:
+                return Response({"Error": str(e)},status=status.HTTP_400_BAD_REQUEST)
 
             try:
-                pottsH = calc_Hamiltonian(sequences.values(), coupling_tbl=coup, lf_tbl=lf)
+                pottsH = potts_model.hamiltonian(sequences.values())
                 results = {}
                 for idx, item in enumerate(sequences):
                     results[item] = pottsH[idx]
@@ -257,6 +328,117 @@ class CalculateHamiltonian(APIView):
                 return Response({"Error": str(e)},status=status.HTTP_400_BAD_REQUEST)
 
 
+class CalculateHamiltonianJob(APIView):
+    serializer_class = HamiltonianJobSerializer
+    parser_classes = [parsers.MultiPartParser]
+    throttle_scope = "long_task"
+
+    @extend_schema(
+        request=HamiltonianJobSerializer,
+        responses={202: TaskSerializer},
+    )
+    def post(self, request, format=None):
+        params = HamiltonianJobSerializer(data=request.data)
+
+        if params.is_valid():
+            fasta = params.validated_data.get("sequences")
+            user = get_request_user(request)
+            session_key = get_request_session(request)
+            library = SequenceLibrary.objects.create(
+                user=user,
+                session_key=session_key,
+                name=params.validated_data.get("name", fasta.name),
+                fasta=fasta,
+            )
+            dca_id = params.validated_data.get("dca_id")
+            task = calculate_hamiltonian_task.start(
+                str(library.id),
+                None if dca_id is None else str(dca_id),
+                params.validated_data.get("project_id"),
+                params.validated_data.get("output_format"),
+                user=user,
+                session_key=session_key,
+            )
+
+            resp = TaskSerializer(task)
+            return Response(resp.data, status=status.HTTP_202_ACCEPTED)
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MutationalScan(APIView):
+    serializer_class = MutationalScanSerializer
+
+    def post(self, request):
+        params = MutationalScanSerializer(data=request.data)
+
+        if params.is_valid():
+            wild_type = params.validated_data.get("wild_type").strip().upper()
+            double_mutants = params.validated_data.get("double_mutants", [])
+            try:
+                potts_model = load_potts_model(params.validated_data)
+            except ValueError as e:
+                return Response({"Error": str(e)},status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                single_mutants = single_mutant_scan(potts_model, wild_type)
+                mutation_pairs = [tuple(pair.split(":")) for pair in double_mutants]
+                if any(len(pair) != 2 for pair in mutation_pairs):
+                    raise ValueError("Double mutants must be two mutations separated by ':'")
+                double_dH = double_mutant_scan(potts_model, wild_type, mutation_pairs, single_mutants)
+                return Response({
+                    "wild_type": wild_type,
+                    "alphabet": ALPHABET,
+                    "single_mutants": single_mutants.tolist(),
+                    "double_mutants": dict(zip(double_mutants, double_dH.tolist())),
+                }, status=status.HTTP_200_OK)
+
+            except Exception as e:
+                return Response({"Error": str(e)},status=status.HTTP_400_BAD_REQUEST)
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class DcaCouplings(APIView):
+    serializer_class = DCACouplingsSerializer
+
+    def post(self, request):
+        params = DCACouplingsSerializer(data=request.data)
+
+        if params.is_valid():
+            try:
+                dca = DirectCouplingAnalysis.objects.get(id=params.validated_data.get("dca_id"))
+                store = dca.get_coupling_store()
+            except (DirectCouplingAnalysis.DoesNotExist, ValueError) as e:
+                return Response({"Error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # MSA position of each parameter position, 1-based
+            if dca.column_map is None:
+                positions = np.arange(1, store.length + 1)
+            else:
+                positions = np.flatnonzero(dca.column_map >= 0) + 1
+            response = {"alphabet": ALPHABET, "stored_pairs": store.n_blocks}
+
+            pairs = params.validated_data.get("pairs")
+            if pairs is None:
+                # Norms of the pairs of positions[i] < positions[j], in numpy.triu_indices order
+                response["positions"] = positions.tolist()
+                response["norms"] = np.asarray(store.norms).tolist()
+                return Response(response, status=status.HTTP_200_OK)
+
+            try:
+                pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+                model_pos = dca.column_map[pairs - 1] if dca.column_map is not None else pairs - 1
+                blocks, stored = store.pair_blocks(model_pos[:, 0], model_pos[:, 1])
+                norms = store.pair_norms(model_pos[:, 0], model_pos[:, 1])
+            except (IndexError, ValueError):
+                return Response({"Error": "Pairs must be of two different fitted MSA positions"}, status=status.HTTP_400_BAD_REQUEST)
+            response["pairs"] = [
+                {"i": int(i), "j": int(j), "norm": float(norm), "couplings": block.tolist() if kept else None}
+                for (i, j), norm, block, kept in zip(pairs, norms, blocks, stored)
+            ]
+            return Response(response, status=status.HTTP_200_OK)
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 class AlignSequences2HMM(APIView):
     serializer_class = Align2HMMSerializer
 
@@ -178,4 +178,50 @@ DATA_EXPIRATION = timedelta(days=1)
 TASK_EXPIRATION = timedelta(days=1)
 DELETE_EXPIRED_DATA = False
 HMM_DATABASE = BASE_DIR / 'databases/uniprot_sprot.fasta'
+HMM_DATABASE_DIGITIZED = BASE_DIR / 'databases/uniprot_sprot.digitized'  # written by `manage.py prepare_hmm_database`
+# Load HMM_DATABASE_DIGITIZED into memory when a worker starts; set for the workers running generate_msa_task and hmmsearch_shard_task
+HMM_DATABASE_PRELOAD = os.getenv('HMM_DATABASE_PRELOAD', '') == '1'
+# Identifies the database contents in MSA search keys; defaults to the size and modification time of HMM_DATABASE
+HMM_DATABASE_VERSION = os.getenv('HMM_DATABASE_VERSION')
+CACHE_DIR = Path(os.getenv('CACHE_DIR', MEDIA_ROOT / 'cache'))  # on-disk caches of derived data, safe to delete
+HMM_CACHE_DIR = CACHE_DIR / 'hmm'  # HMMs built from seed alignments, keyed by seed contents
+HMM_CACHE_ENTRIES = 128  # HMMs kept in memory per process
+STRUCTURE_CACHE_DIR = CACHE_DIR / 'structures'  # structure files downloaded from RCSB and their parsed, pickled structures
+STRUCTURE_MIRROR_DIR = os.getenv('STRUCTURE_MIRROR_DIR')  # pre-populated structure files (1abc.cif or ab/1abc.cif, optionally gzipped)
+STRUCTURE_CACHE_ENTRIES = 32  # parsed structures kept in memory per process
+STRUCTURE_OFFLINE = os.getenv('STRUCTURE_OFFLINE', '') == '1'  # never download structures that are not mirrored or cached
+CONTACTS_WORKERS = 4  # threads finding the contacts of large structures one chain at a time
+CONTACTS_PARALLEL_ATOMS = 200000  # structures with fewer atoms are searched in a single pass
+RESIDUE_ALIGNMENT_CACHE_ENTRIES = 256  # alignments of structure chains to seed HMMs kept in memory per process
+MAP_RESIDUES_WORKERS = 4  # threads mapping the targets of a batch residue mapping
+MSA_PROCESSING_CPUS = int(os.getenv('MSA_PROCESSING_CPUS', os.cpu_count() or 1))  # threads clustering MSA sequences
+# Longest an MSA search may hold its search key. Identical requests wait this long for it, then search themselves.
+MSA_SEARCH_TIMEOUT = 6 * 60 * 60
+MSA_SEARCH_POLL_INTERVAL = 10  # seconds between checks on an identical search being waited for
+HMMSEARCH_CPUS = int(os.getenv('HMMSEARCH_CPUS', 1))  # threads searching database shards in one worker
+HMMSEARCH_SHARD_SIZE = None  # sequences per shard, defaults to HMMSEARCH_CPUS equal shards of the preloaded database
+# Split each search across this many Celery tasks on the HMMSEARCH_SHARD_QUEUE queue (0 searches in the calling worker).
+# Every worker consuming that queue needs the digitized database, and the queue needs its own workers so
+# generate_msa_task cannot occupy every slot while waiting on its shards.
+HMMSEARCH_CELERY_SHARDS = int(os.getenv('HMMSEARCH_CELERY_SHARDS', 0))
+HMMSEARCH_SHARD_QUEUE = 'hmmsearch'
+DCA_CPUS = int(os.getenv('DCA_CPUS', os.cpu_count() or 1))  # threads computing DCA sequence weights, and processes fitting plmDCA sites
+DCA_WEIGHTS_BLOCK_BYTES = 256 * 1024 * 1024  # memory of each sequence weights thread
+# Coupling blocks kept per DCA, by decreasing norm: at most DCA_COUPLING_TOP_K pairs (None for all) in a file of at
+# most DCA_COUPLING_STORE_BYTES. Hamiltonians of DCAs that did not keep every pair ignore the missing couplings.
+DCA_COUPLING_TOP_K = None
+DCA_COUPLING_STORE_BYTES = 512 * 1024 * 1024
+# Windows of windowed DCAs are fitted one after another in the calling worker, or with DCA_WINDOW_CELERY=1 as Celery tasks
+# on the DCA_WINDOW_QUEUE queue, which needs its own workers so compute_dca_task cannot occupy every slot while waiting on
+# them (the celery-dca-windows service of docker-compose). compute_dca_task gives up on them after DCA_WINDOW_TIMEOUT seconds.
+# They exchange the alignment and their fits through DCA_WINDOW_DIR (defaults to MEDIA_ROOT/dca_windows), which must be
+# shared by those workers.
+DCA_WINDOW_CELERY = os.getenv('DCA_WINDOW_CELERY', '') == '1'
+DCA_WINDOW_QUEUE = 'dca_windows'
+DCA_WINDOW_TIMEOUT = 12 * 60 * 60
+DCA_WINDOW_DIR = os.getenv('DCA_WINDOW_DIR')
+HAMILTONIAN_PROJECTS_DIR = BASE_DIR / 'data'
+HAMILTONIAN_STORE_DIR = BASE_DIR / 'data/store'
+HAMILTONIAN_STORE_CACHE_BYTES = 4 * 1024 ** 3  # 4 GB of open projects per process
+HAMILTONIAN_TASK_CHUNK_SIZE = 10000  # sequences scored at once by calculate_hamiltonian_task
 DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440000  # 2500 MB
\ No newline at end of file